@@ -0,0 +1,89 @@
+"""Admin bulk operations: per-user Python loops vs the balance columns.
+
+    python -m benchmarks.bench_bulk                    # 100k and 1M users
+    python -m benchmarks.bench_bulk --users 10000 --out bulk_bench.json
+
+'loop' is what !massadd, !inflation and !godstats did before (a pass over
+every user dict); 'columns' is UserRepository on top of economy/columns.py
+(NumPy when installed, see the 'backend' column).
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.synthetic import make_economy
+from economy.columns import numpy
+from economy.users import UserRepository
+
+
+def loop_massadd(users):
+    for data in users.values():
+        data['reiatsu'] += 100
+        if data['reiatsu'] < 0:
+            data['reiatsu'] = 0
+
+
+def loop_inflation(users):
+    for data in users.values():
+        data['reiatsu'] = int(data['reiatsu'] * 1.05)
+        data['soul_fragments'] = int(data['soul_fragments'] * 1.05)
+
+
+def loop_totals(users):
+    return sum(d['reiatsu'] for d in users.values()), sum(d['soul_fragments'] for d in users.values())
+
+
+def timed(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def bench(users, repeat):
+    plain = make_economy(users)['user_data']
+    repo = UserRepository(plain)
+    run = asyncio.new_event_loop().run_until_complete
+    cases = {
+        'massadd': (lambda: loop_massadd(plain), lambda: run(repo.bulk_add('reiatsu', 100))),
+        'inflation': (lambda: loop_inflation(plain),
+                      lambda: run(repo.bulk_scale(['reiatsu', 'soul_fragments'], 1.05))),
+        'totals': (lambda: loop_totals(plain), lambda: run(repo.totals(['reiatsu', 'soul_fragments']))),
+    }
+    rows = []
+    for name, (loop, columns) in cases.items():
+        rows.append({
+            'users': users,
+            'operation': name,
+            'loop_ms': timed(loop, repeat),
+            'columns_ms': timed(columns, repeat),
+            'backend': 'numpy' if numpy is not None else 'array',
+        })
+        repo.drain_bulk()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--out', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'users':>9} {'operation':<10} {'loop ms':>9} {'columns ms':>11} {'backend':>8}")
+    for users in args.users:
+        for row in bench(users, args.repeat):
+            results.append(row)
+            print(f"{row['users']:>9,} {row['operation']:<10} {row['loop_ms']:>9.2f} "
+                  f"{row['columns_ms']:>11.3f} {row['backend']:>8}")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Flash-sale burst: many concurrent !buy calls per item.
+
+    python -m benchmarks.bench_buy                       # 500 buyers per item
+    python -m benchmarks.bench_buy --buyers 100 1000 --out buy_bench.json
+
+Every buyer is its own task that yields to the event loop before buying, as
+a command callback would, and all of them start at once.  Each run checks
+that limited stock was never oversold, that exactly the expected number of
+purchases went through and that every unit sold was paid for; 'attempts/s'
+is the throughput of PurchaseEngine.buy() including the rejections.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.synthetic import make_economy, user_id
+from economy.shop import PurchaseEngine, PurchaseError, limited
+from economy.tracking import TrackedTable
+from economy.users import UserRepository
+
+ITEMS = {
+    'hogyoku_shard': {'name': 'Hogyoku Shard', 'price': 50, 'currency': 'soul_fragments',
+                      'category': 'rare', 'stock': 10, 'purchasable': True},
+    'stand_arrow': {'name': 'Stand Arrow', 'price': 75, 'currency': 'soul_fragments',
+                    'category': 'rare', 'stock': 25, 'purchasable': True},
+    'hollow_mask': {'name': 'Hollow Mask Fragment', 'price': 10, 'currency': 'soul_fragments',
+                    'category': 'rare', 'stock': 50, 'purchasable': True},
+    'shinigami_robes': {'name': 'Shinigami Robes', 'price': 2000, 'currency': 'reiatsu',
+                        'category': 'equipment', 'stock': 999, 'purchasable': True},
+}
+
+
+async def burst(engine, users, item_id, buyers):
+    sold = []
+
+    async def buyer(key):
+        await asyncio.sleep(0)  # command dispatch
+        try:
+            engine.buy(key, users[key], item_id)
+            sold.append(key)
+        except PurchaseError:
+            pass
+
+    start = time.perf_counter()
+    await asyncio.gather(*(buyer(user_id(i)) for i in range(buyers)))
+    return sold, time.perf_counter() - start
+
+
+def bench(buyers, repeat):
+    rows = []
+    for item_id, template in ITEMS.items():
+        best = float('inf')
+        for _ in range(repeat):
+            plain = make_economy(buyers)['user_data']
+            for i, data in enumerate(plain.values()):
+                # Nine in ten buyers can afford the item
+                data[template['currency']] = template['price'] - (i % 10 == 0)
+            users = UserRepository(plain)
+            items = TrackedTable('shop_items', {item_id: dict(template)})
+            engine = PurchaseEngine(items)
+            currency = template['currency']
+            before = {key: record[currency] for key, record in users.records()}
+            affordable = sum(balance >= template['price'] for balance in before.values())
+
+            sold, seconds = asyncio.run(burst(engine, users, item_id, buyers))
+
+            stock = template['stock']
+            expected = min(stock, affordable) if limited(template) else affordable
+            item = items[item_id]
+            assert len(sold) == expected, f"{item_id}: sold {len(sold)}, expected {expected}"
+            assert not limited(template) or item['stock'] == stock - len(sold) >= 0, f"{item_id} oversold"
+            spent = sum(before[key] - record[currency] for key, record in users.records())
+            assert spent == len(sold) * template['price'], f"{item_id}: paid {spent} for {len(sold)} units"
+            assert all(users[key]['inventory'][item_id] == 1 for key in sold)
+            best = min(best, seconds)
+        rows.append({
+            'buyers': buyers,
+            'item': item_id,
+            'stock': template['stock'] if limited(template) else None,
+            'sold': len(sold),
+            'burst_ms': best * 1000,
+            'attempts_per_s': buyers / best,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--buyers', type=int, nargs='+', default=[500])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--out', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'buyers':>7} {'item':<16} {'stock':>6} {'sold':>6} {'burst ms':>9} {'attempts/s':>11}")
+    for buyers in args.buyers:
+        for row in bench(buyers, args.repeat):
+            results.append(row)
+            stock = '-' if row['stock'] is None else row['stock']
+            print(f"{row['buyers']:>7,} {row['item']:<16} {stock:>6} {row['sold']:>6,} "
+                  f"{row['burst_ms']:>9.2f} {row['attempts_per_s']:>11,.0f}")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
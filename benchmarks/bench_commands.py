@@ -0,0 +1,304 @@
+"""The bot's own command callbacks on synthetic economies.
+
+    python -m benchmarks.bench_commands                          # 1k and 100k users
+    python -m benchmarks.bench_commands --users 1000000 --offers 5000 --out commands.json
+    python -m benchmarks.bench_commands --commands bet give --baseline commands.json
+
+Each economy size runs in a fresh process.  That process writes the
+synthetic economy (benchmarks.synthetic, with open offers and bets) to a
+temporary DATA_FILE, imports main.py against it and loads the economy the
+way setup_hook does.  Then each command callback runs ``--ops`` times with a
+fake ``ctx`` that records what it sends, framed by the bot's before/after
+invoke hooks like a real invocation.  Admin confirmations are answered
+with ✅ straight away.
+
+Reported per command:
+- ops/s and the p50/p95/p99 callback latency.
+- 'alloc': KB allocated and still alive per call, measured with tracemalloc
+  in a separate, shorter pass.
+- 'save ms': the flush that persists what the timed calls changed, i.e.
+  what their save_data() calls cost once the background writer runs.
+
+``--baseline`` compares the run with an earlier ``--out`` file.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.synthetic import make_economy
+from economy.sqlite_store import migrate
+from economy.transactions import percentile
+
+COMMANDS = ['shop', 'leaderboard', 'work', 'give', 'bet', 'serveranalytics', 'inflation', 'result']
+ALLOC_OPS = 50
+
+
+class FakeMember:
+    def __init__(self, uid):
+        self.id = int(uid)
+        self.mention = f'<@{uid}>'
+        self.display_name = self.name = f'user{str(uid)[-6:]}'
+        self.bot = False
+
+    def __eq__(self, other):
+        return isinstance(other, FakeMember) and other.id == self.id
+
+    def __hash__(self):
+        return self.id
+
+
+class FakeMessage:
+    def __init__(self, message_id, content, embed):
+        self.id = message_id
+        self.content = content
+        self.embed = embed
+
+    async def add_reaction(self, emoji):
+        pass
+
+    async def edit(self, **kwargs):
+        pass
+
+
+class FakeReaction:
+    def __init__(self, emoji, message):
+        self.emoji = emoji
+        self.message = message
+
+
+class FakeCommand:
+    def __init__(self, name):
+        self.qualified_name = name
+
+
+class FakeContext:
+    """Just enough of commands.Context for the callbacks; records sends."""
+
+    messages = 0
+
+    def __init__(self, harness, command, author):
+        self.harness = harness
+        self.command = FakeCommand(command)
+        self.author = author
+        self.guild = None
+        self.channel = self
+        self.command_failed = False
+        self.sent = []
+
+    async def send(self, content=None, embed=None, **kwargs):
+        FakeContext.messages += 1
+        message = FakeMessage(FakeContext.messages, content, embed)
+        self.sent.append(message)
+        self.harness.current = self
+        return message
+
+
+class Harness:
+    def __init__(self, main, state, rng):
+        self.main = main
+        self.rng = rng
+        self.users = sorted(state['user_data'])
+        self.offers = sorted(state['active_offers'])
+        self.current = None
+        self.worker = 0
+        main.bot.wait_for = self.wait_for
+
+    async def wait_for(self, event, timeout=None, check=None):
+        """The author confirms the last message they were sent."""
+        ctx = self.current
+        reaction, user = FakeReaction("✅", ctx.sent[-1]), ctx.author
+        if check is not None and not check(reaction, user):
+            raise asyncio.TimeoutError
+        return reaction, user
+
+    def member(self):
+        return FakeMember(self.rng.choice(self.users))
+
+    def calls(self):
+        """command -> function returning (ctx author, callback args) for the next call."""
+        main = self.main
+        leaderboards = list(main.LEADERBOARDS)
+
+        def work():
+            # Distinct users so the work cooldown rarely gets in the way
+            self.worker += 1
+            return FakeMember(self.users[self.worker % len(self.users)]), ()
+
+        def result():
+            match_id = next((m for m in self.offers if m in main.active_offers), None)
+            return self.member(), (match_id or 'M-none', self.rng.choice([1, 2]))
+
+        return {
+            'shop': (main.shop, lambda: (self.member(), ())),
+            'leaderboard': (main.leaderboard, lambda: (self.member(), (self.rng.choice(leaderboards),))),
+            'work': (main.work, work),
+            'give': (main.give_reiatsu, lambda: (self.member(), (self.member(), self.rng.randint(100, 5000)))),
+            'bet': (main.place_bet, lambda: (self.member(), (self.rng.choice(self.offers), self.rng.choice(['1', '2']),
+                                                              self.rng.randint(100, 1000)))),
+            'serveranalytics': (main.server_analytics, lambda: (self.member(), ())),
+            'inflation': (main.adjust_inflation, lambda: (self.member(), (self.rng.choice([-1.0, 1.0]),))),
+            'result': (main.end_offer, result),
+        }
+
+    async def invoke(self, name, command, author, args):
+        ctx = FakeContext(self, name, author)
+        ctx.args, ctx.kwargs = [ctx, *args], {}
+        await self.main.bind_economy(ctx)
+        start = time.perf_counter()
+        try:
+            await command.callback(ctx, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            await self.main.record_command(ctx)
+        return elapsed
+
+
+async def run_commands(main, state, names, ops, seed):
+    economy = await main.partitions.ensure()
+    persistence = economy.persistence
+    harness = Harness(main, state, random.Random(seed))
+    calls = harness.calls()
+    rows = []
+    for name in names:
+        command, next_call = calls[name]
+        # !result ends an offer per call
+        count = min(ops, len(harness.offers) // 2) if name == 'result' else ops
+        await persistence.flush()
+        before = persistence.stats()
+        samples = []
+        start = time.perf_counter()
+        for _ in range(count):
+            author, args = next_call()
+            samples.append(await harness.invoke(name, command, author, args))
+        seconds = time.perf_counter() - start
+
+        flush_start = time.perf_counter()
+        await persistence.flush()
+        flush_ms = (time.perf_counter() - flush_start) * 1000
+        after = persistence.stats()
+
+        alloc_count = min(ALLOC_OPS, count)
+        tracemalloc.start()
+        traced_before, _ = tracemalloc.get_traced_memory()
+        for _ in range(alloc_count):
+            author, args = next_call()
+            await harness.invoke(name, command, author, args)
+        traced_after, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        samples.sort()
+        rows.append({
+            'command': name,
+            'ops': count,
+            'ops_per_s': count / seconds if seconds else 0.0,
+            'p50_ms': percentile(samples, 0.50) * 1000,
+            'p95_ms': percentile(samples, 0.95) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000,
+            'max_ms': samples[-1] * 1000 if samples else 0.0,
+            'alloc_kb_per_op': (traced_after - traced_before) / 1024 / alloc_count if alloc_count else 0.0,
+            'peak_alloc_kb': peak / 1024,
+            'save_requests': after['save_requests'] - before['save_requests'],
+            'save_ms': flush_ms,
+            'save_bytes': after['bytes_written'] - before['bytes_written'],
+        })
+    await persistence.flush()
+    return economy.load_seconds, rows
+
+
+def worker(users, offers, bets_per_offer, names, ops, backend, seed):
+    with tempfile.TemporaryDirectory() as directory:
+        state = make_economy(users, offers, bets_per_offer, seed=seed)
+        data_file = os.path.join(directory, 'economy_data.json')
+        with open(data_file, 'w') as f:
+            json.dump(state, f)
+        sqlite_path = os.path.join(directory, 'economy.db')
+        if backend == 'sqlite':
+            migrate(data_file, sqlite_path)
+        os.environ.update({
+            'DATA_FILE': data_file,
+            'LEDGER_FILE': os.path.join(directory, 'economy_ledger.jsonl'),
+            'SQLITE_PATH': sqlite_path,
+            'SHARD_DIR': os.path.join(directory, 'economy_shards'),
+            'STORAGE_BACKEND': backend,
+            # Flushes are timed explicitly after each command
+            'SAVE_INTERVAL': '3600',
+        })
+        os.chdir(directory)
+        random.seed(seed)
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import main
+
+        async def run():
+            try:
+                return await run_commands(main, state, names, ops, seed)
+            finally:
+                for economy in main.partitions.loaded():
+                    await economy.close()
+
+        load_seconds, rows = asyncio.run(run())
+    for row in rows:
+        row.update(users=users, offers=offers, bets_per_offer=bets_per_offer, backend=backend,
+                   load_seconds=load_seconds)
+    return rows
+
+
+def bench(users, offers, bets_per_offer, names, ops, backend, seed=42):
+    # A fresh interpreter per economy: main.py reads its configuration at import
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(worker, (users, offers, bets_per_offer, names, ops, backend, seed))
+
+
+def compare(results, path):
+    with open(path) as f:
+        baseline = {(row['users'], row['command']): row for row in json.load(f)}
+    print(f"\nvs {path}:")
+    print(f"{'users':>9} {'command':<16} {'ops/s':>8} {'p95':>8} {'alloc':>8} {'save':>8}")
+    for row in results:
+        old = baseline.get((row['users'], row['command']))
+        if old is None:
+            continue
+
+        def ratio(key):
+            return f"{row[key] / old[key]:.2f}x" if old[key] else '-'
+
+        print(f"{row['users']:>9,} {row['command']:<16} {ratio('ops_per_s'):>8} {ratio('p95_ms'):>8} "
+              f"{ratio('alloc_kb_per_op'):>8} {ratio('save_ms'):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, nargs='+', default=[1000, 100_000])
+    parser.add_argument('--offers', type=int, default=1000)
+    parser.add_argument('--bets-per-offer', type=int, default=50)
+    parser.add_argument('--commands', nargs='+', choices=COMMANDS, default=COMMANDS)
+    parser.add_argument('--ops', type=int, default=500, help="Calls per command")
+    parser.add_argument('--backend', default='journal', choices=['journal', 'json', 'sqlite', 'sharded'])
+    parser.add_argument('--out', help="Write results as JSON to this file")
+    parser.add_argument('--baseline', help="Compare with the JSON written by an earlier --out")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'users':>9} {'command':<16} {'ops':>6} {'ops/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'alloc KB':>9} {'saves':>6} {'save ms':>8}")
+    for users in args.users:
+        for row in bench(users, args.offers, args.bets_per_offer, args.commands, args.ops, args.backend):
+            results.append(row)
+            print(f"{row['users']:>9,} {row['command']:<16} {row['ops']:>6,} {row['ops_per_s']:>9,.0f} "
+                  f"{row['p50_ms']:>8.3f} {row['p95_ms']:>8.3f} {row['p99_ms']:>8.3f} "
+                  f"{row['alloc_kb_per_op']:>9.2f} {row['save_requests']:>6,} {row['save_ms']:>8.1f}")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Memory per user: legacy dict records vs UserRecord.
+
+    python -m benchmarks.bench_memory                 # 100k users
+    python -m benchmarks.bench_memory --users 10000 100000 --out memory_bench.json
+
+Each layout is built from freshly decoded JSON (so no strings are shared
+with the generator) and measured with tracemalloc after the decoded input
+is dropped.  'active' users come from benchmarks.synthetic; 'fresh' users
+are what init_user() creates for a member who never ran a command.
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+
+from benchmarks.synthetic import make_economy, user_id
+from economy.tracking import TrackedTable
+from economy.users import UserRepository
+
+
+def legacy_fresh_user():
+    # init_user() before UserRecord
+    return {
+        "reiatsu": 5000, "soul_fragments": 0, "zanpakuto": None, "stand": None,
+        "rank": "Academy Student", "level": 1, "exp": 0, "daily_streak": 0,
+        "last_daily": None, "last_work": None, "last_train": None, "inventory": {},
+        "active_bets": [], "total_winnings": 0, "battles_won": 0, "achievements": []
+    }
+
+
+def layouts():
+    yield 'plain dict', lambda users: users
+    yield 'tracked dict', lambda users: TrackedTable('user_data', users)
+    yield 'UserRecord', lambda users: UserRepository(users)
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    table = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del table
+    return size
+
+
+def bench(users):
+    payload = json.dumps(make_economy(users)['user_data'])
+    fresh = json.dumps({user_id(i): legacy_fresh_user() for i in range(users)})
+    rows = []
+    for population, source in (('active', payload), ('fresh', fresh)):
+        for name, layout in layouts():
+            def build():
+                decoded = json.loads(source)
+                table = layout(decoded)
+                del decoded
+                return table
+            size = measure(build)
+            rows.append({'users': users, 'population': population, 'layout': name,
+                         'bytes': size, 'bytes_per_user': size / users})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, nargs='+', default=[100_000])
+    parser.add_argument('--out', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'users':>9} {'population':<10} {'layout':<14} {'MB':>8} {'B/user':>8}")
+    for users in args.users:
+        for row in bench(users):
+            results.append(row)
+            print(f"{row['users']:>9,} {row['population']:<10} {row['layout']:<14} "
+                  f"{row['bytes'] / 1e6:>8.1f} {row['bytes_per_user']:>8.0f}")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
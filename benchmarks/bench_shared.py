@@ -0,0 +1,183 @@
+"""Several processes moving money through one SharedStore.
+
+    python -m benchmarks.bench_shared                     # 1, 2 and 4 processes
+    python -m benchmarks.bench_shared --processes 8 --ops 5000 --out shared_bench.json
+
+Every process loads the same synthetic economy, attaches it to one shared
+SQLite store (economy/shared_store.py) and runs a mix of operations on a
+small set of hot users from several concurrent tasks: transfers through
+``TransactionManager`` (many of them larger than the sender can cover),
+rewards written straight to the record, and purchases through
+``PurchaseEngine`` - half of them of an item with ``STOCK`` units shared
+by all processes.  Afterwards the store must hold exactly the starting
+money plus what the processes minted minus what they spent, no balance
+may be negative and the processes together may not have sold more of the
+limited item than there was - whatever the interleaving.  'ops/s' is the throughput
+over all processes.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.synthetic import make_economy, user_id
+from economy.shared_store import SharedStore
+from economy.shop import PurchaseEngine, PurchaseError
+from economy.tracking import TrackedTable
+from economy.transactions import InsufficientFunds, TransactionManager
+from economy.users import UserRepository
+
+HOT_USERS = 50
+TASKS = 8
+PRICE = 2000
+STOCK = 100
+ITEMS = {'shinigami_robes': {'name': 'Shinigami Robes', 'price': PRICE, 'currency': 'reiatsu',
+                             'category': 'equipment', 'stock': 999, 'purchasable': True},
+         'hogyoku_shard': {'name': 'Hogyoku Shard', 'price': PRICE, 'currency': 'reiatsu',
+                           'category': 'rare', 'stock': STOCK, 'purchasable': True}}
+
+
+def worker(path, users, ops, seed):
+    store = SharedStore(path)
+    repository = UserRepository(make_economy(users)['user_data'])
+    store.attach(repository)
+    transactions = TransactionManager(repository, shared=store)
+    shop = PurchaseEngine(TrackedTable('shop_items', {key: dict(item) for key, item in ITEMS.items()}),
+                          shared=store)
+    rng = random.Random(seed)
+    totals = {'minted': 0, 'spent': 0, 'transfers': 0, 'rewards': 0, 'purchases': 0, 'insufficient': 0,
+              'limited_sold': 0}
+
+    async def task(count):
+        for _ in range(count):
+            await asyncio.sleep(0)  # command dispatch
+            roll = rng.random()
+            sender = user_id(rng.randrange(HOT_USERS))
+            if roll < 0.6:
+                receiver = user_id(rng.randrange(HOT_USERS))
+                if receiver == sender:
+                    continue
+                try:
+                    async with transactions.transaction(sender, receiver) as txn:
+                        txn.transfer('give', sender, receiver, rng.randint(1, 30_000))
+                    totals['transfers'] += 1
+                except InsufficientFunds:
+                    totals['insufficient'] += 1
+            elif roll < 0.8:
+                reward = rng.randint(50, 500)
+                repository[sender]['reiatsu'] += reward
+                totals['minted'] += reward
+                totals['rewards'] += 1
+            else:
+                async with transactions.locks.hold(sender):
+                    await store.retry(store.refresh, sender, repository[sender])
+                    item_id = rng.choice(tuple(ITEMS))
+                    try:
+                        await store.retry(shop.buy, sender, repository[sender], item_id)
+                        totals['spent'] += PRICE
+                        totals['purchases'] += 1
+                        if item_id == 'hogyoku_shard':
+                            totals['limited_sold'] += 1
+                    except PurchaseError:
+                        totals['insufficient'] += 1
+
+    async def run():
+        await asyncio.gather(*(task(ops // TASKS) for _ in range(TASKS)))
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    totals['seconds'] = time.perf_counter() - start
+    totals.update(store.stats())
+    store.close()
+    return totals
+
+
+def simulate(processes, users, ops):
+    """Run ``processes`` workers on one fresh store; the results and the store's end state.
+
+    Besides each worker's totals the dict holds what the conservation
+    checks compare: ``expected`` and ``total`` money, the ``lowest``
+    balance, and the limited item's units ``sold`` and ``left``.
+    tests/test_shared_store.py runs it too.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'shared.db')
+        initial = make_economy(users)['user_data']
+        store = SharedStore(path)
+        store.seed({key: {'reiatsu': data['reiatsu'], 'soul_fragments': data['soul_fragments']}
+                    for key, data in initial.items()})
+        start = time.perf_counter()
+        with multiprocessing.get_context('spawn').Pool(processes) as pool:
+            results = pool.starmap(worker, [(path, users, ops, seed) for seed in range(processes)])
+        seconds = time.perf_counter() - start
+
+        expected = sum(data['reiatsu'] for data in initial.values())
+        expected += sum(result['minted'] - result['spent'] for result in results)
+        outcome = {
+            'results': results,
+            'seconds': seconds,
+            'expected': expected,
+            'total': store.total('reiatsu'),
+            'lowest': store.conn.execute("SELECT MIN(amount) FROM balances").fetchone()[0],
+            'sold': sum(result['limited_sold'] for result in results),
+            'left': store.stock_levels().get('hogyoku_shard', STOCK),
+        }
+        store.close()
+    return outcome
+
+
+def bench(processes, users, ops):
+    outcome = simulate(processes, users, ops)
+    results, total, sold, left = outcome['results'], outcome['total'], outcome['sold'], outcome['left']
+    if total != outcome['expected']:
+        raise RuntimeError(f"{processes} processes: store holds {total:,}, expected {outcome['expected']:,}")
+    if outcome['lowest'] < 0:
+        raise RuntimeError(f"{processes} processes: a balance went negative ({outcome['lowest']})")
+    if sold > STOCK or left != STOCK - sold:
+        raise RuntimeError(f"{processes} processes: sold {sold} of {STOCK}, {left} left")
+    done = sum(result['transfers'] + result['rewards'] + result['purchases'] + result['insufficient']
+               for result in results)
+    return {
+        'processes': processes,
+        'ops': done,
+        'transfers': sum(result['transfers'] for result in results),
+        'purchases': sum(result['purchases'] for result in results),
+        'limited_sold': sold,
+        'insufficient': sum(result['insufficient'] for result in results),
+        'invalidations': sum(result['invalidations'] for result in results),
+        # Writes that found another process holding the lock: retried or queued
+        'store_busy': sum(result['store_busy'] for result in results),
+        'deferred_writes': sum(result['deferred_writes'] for result in results),
+        'seconds': outcome['seconds'],
+        'ops_per_s': done / max(result['seconds'] for result in results),
+        'total': total,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--ops', type=int, default=2000, help="Operations per process")
+    parser.add_argument('--out', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'procs':>5} {'ops':>8} {'transfers':>9} {'purchases':>9} {'rejected':>8} "
+          f"{'invalidated':>11} {'ops/s':>9}  money")
+    for processes in args.processes:
+        row = bench(processes, args.users, args.ops)
+        results.append(row)
+        print(f"{row['processes']:>5} {row['ops']:>8,} {row['transfers']:>9,} {row['purchases']:>9,} "
+              f"{row['insufficient']:>8,} {row['invalidations']:>11,} {row['ops_per_s']:>9,.0f}  conserved")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
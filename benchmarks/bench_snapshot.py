@@ -0,0 +1,87 @@
+"""Snapshot format benchmark: save time, load time and size per format.
+
+    python -m benchmarks.bench_snapshot                 # 10k, 100k, 1M users
+    python -m benchmarks.bench_snapshot --users 10000 --out snapshot_bench.json
+
+'legacy' is the old save_data()/load_data() pair (json.dump indent=2,
+json.load); the others go through economy.snapshot like the bot does.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import make_economy
+from economy.snapshot import encode_snapshot, msgpack, read_state, zstandard
+
+
+def formats():
+    yield 'legacy', None
+    yield 'json', lambda state: json.dumps(state, separators=(',', ':')).encode('utf-8')
+    yield 'marshal', lambda state: encode_snapshot(state, 'marshal', 'none')
+    yield 'marshal+zlib', lambda state: encode_snapshot(state, 'marshal', 'zlib')
+    if zstandard is not None:
+        yield 'marshal+zstd', lambda state: encode_snapshot(state, 'marshal', 'zstd')
+    if msgpack is not None:
+        yield 'msgpack', lambda state: encode_snapshot(state, 'msgpack', 'none')
+
+
+def bench(users, directory, repeat):
+    state = make_economy(users, offers=20, bets_per_offer=min(users // 10, 2000))
+    rows = []
+    for name, encode in formats():
+        path = os.path.join(directory, f"snapshot-{name}")
+        save_times, load_times = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            if encode is None:
+                with open(path, 'w') as f:
+                    json.dump(state, f, indent=2)
+            else:
+                with open(path, 'wb') as f:
+                    f.write(encode(state))
+            save_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            if encode is None:
+                with open(path, 'r') as f:
+                    loaded = json.load(f)
+            else:
+                loaded = read_state(path)
+            load_times.append(time.perf_counter() - start)
+            assert len(loaded['user_data']) == users
+            del loaded
+        rows.append({
+            'users': users,
+            'format': name,
+            'save_s': min(save_times),
+            'load_s': min(load_times),
+            'bytes': os.path.getsize(path),
+        })
+        os.remove(path)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--out', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'users':>9} {'format':<14} {'save s':>8} {'load s':>8} {'MB':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for users in args.users:
+            for row in bench(users, directory, args.repeat):
+                results.append(row)
+                print(f"{row['users']:>9,} {row['format']:<14} {row['save_s']:>8.3f} "
+                      f"{row['load_s']:>8.3f} {row['bytes'] / 1e6:>8.1f}")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+"""A local stand-in for Discord's gateway and HTTP API.
+
+``FakeDiscord`` is an aiohttp app that discord.py can log in to and hold a
+gateway session with.  ``patch()`` points discord.py's REST base URL and
+default gateway at it.  It serves the few endpoints the bot uses:
+- login and application info
+- sending, editing and deleting messages
+- adding reactions
+- DM channels and user lookups
+
+Anything else gets a 404 and is counted in ``stats()['unhandled']``.
+
+The gateway speaks plain-text JSON frames (discord.py only decompresses
+binary ones).  It sends READY and a GUILD_CREATE per guild, with every
+member, so nothing needs chunking.  Messages the bot sends come back to it
+as MESSAGE_CREATE, as on Discord; that is how bot messages enter
+discord.py's cache and so how ``wait_for('reaction_add')`` works.
+``user_message()`` and ``user_reaction()`` inject what members do.
+
+Every REST call waits ``latency`` plus up to ``jitter`` seconds.  A
+``rate_limit`` fraction of calls is answered 429.  ``channel_limit``
+messages per ``channel_window`` seconds per channel are allowed, with the
+X-RateLimit headers discord.py uses to pace itself.  ``on_bot_message``
+and ``on_bot_reaction`` let a load generator see the bot's side.
+"""
+import asyncio
+import itertools
+import json
+import random
+import re
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from urllib.parse import unquote
+
+import aiohttp
+import yarl
+from aiohttp import web
+
+API_PREFIX = '/api/v10/'
+DISCORD_EPOCH_MS = 1420070400000
+HEARTBEAT_MS = 41250
+BOT_ID = 900_000_000_000_000_001
+# View channel, send messages, embed links, attach files, read history, add reactions
+EVERYONE_PERMISSIONS = 1024 | 2048 | 16384 | 32768 | 65536 | 64
+ADMINISTRATOR = 8
+
+_counter = itertools.count()
+
+
+def snowflake():
+    ms = int(time.time() * 1000) - DISCORD_EPOCH_MS
+    return (ms << 22) | (next(_counter) & 0x3FFFFF)
+
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def user_payload(user_id, name=None, bot=False):
+    name = name or f'user{str(user_id)[-6:]}'
+    return {'id': str(user_id), 'username': name, 'global_name': name, 'discriminator': '0',
+            'avatar': None, 'bot': bot, 'public_flags': 0}
+
+
+def member_payload(user, roles=()):
+    return {'user': user, 'roles': [str(role) for role in roles], 'joined_at': now_iso(),
+            'deaf': False, 'mute': False, 'flags': 0}
+
+
+def role_payload(role_id, name, permissions, position):
+    return {'id': str(role_id), 'name': name, 'permissions': str(permissions), 'position': position,
+            'color': 0, 'hoist': False, 'managed': False, 'mentionable': False, 'flags': 0}
+
+
+def json_response(data, status=200, headers=None):
+    # discord.py only decodes a body whose Content-Type is exactly application/json
+    return web.Response(body=json.dumps(data).encode('utf-8'), status=status, headers=headers,
+                        content_type='application/json')
+
+
+class FakeDiscord:
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit=0.0, retry_after=0.25,
+                 channel_limit=0, channel_window=5.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.channel_limit = channel_limit
+        self.channel_window = channel_window
+        self.rng = random.Random(seed)
+        self.bot_user = user_payload(BOT_ID, 'Soul Bot', bot=True)
+        self.guilds = {}
+        # channel id -> guild id (None for DMs)
+        self.channels = {}
+        self.users = {}
+        self.admin_roles = {}
+        # channel id -> [window start, messages in window]
+        self.buckets = {}
+        self.sockets = set()
+        self.sequence = 0
+        self.on_bot_message = None
+        self.on_bot_reaction = None
+        self.requests = Counter()
+        self.unhandled = Counter()
+        self.rate_limited = 0
+        self.dispatched = 0
+        self.runner = None
+        self.port = None
+        self.routes = [
+            ('GET', r'users/@me', self.get_me),
+            ('GET', r'oauth2/applications/@me', self.get_application),
+            ('GET', r'gateway', self.get_gateway),
+            ('GET', r'gateway/bot', self.get_gateway),
+            ('GET', r'users/(\d+)', self.get_user),
+            ('POST', r'users/@me/channels', self.create_dm),
+            ('POST', r'channels/(\d+)/messages', self.create_message),
+            ('PATCH', r'channels/(\d+)/messages/(\d+)', self.edit_message),
+            ('DELETE', r'channels/(\d+)/messages/(\d+)', self.no_content),
+            ('PUT', r'channels/(\d+)/messages/(\d+)/reactions/([^/]+)/@me', self.add_reaction),
+            ('DELETE', r'channels/(\d+)/messages/(\d+)/reactions/.*', self.no_content),
+            ('POST', r'channels/(\d+)/typing', self.no_content),
+        ]
+        self.routes = [(method, re.compile(pattern + '$'), handler) for method, pattern, handler in self.routes]
+
+    # -- setup ---------------------------------------------------------
+
+    def add_guild(self, guild_id, channel_ids, members):
+        """``members``: {user id: is administrator}."""
+        admin_role = guild_id + 1
+        self.admin_roles[guild_id] = admin_role
+        for channel_id in channel_ids:
+            self.channels[channel_id] = guild_id
+        for user_id in members:
+            self.users.setdefault(user_id, user_payload(user_id))
+        self.guilds[guild_id] = {'channels': list(channel_ids), 'members': dict(members)}
+
+    def guild_payload(self, guild_id):
+        guild = self.guilds[guild_id]
+        admin_role = self.admin_roles[guild_id]
+        members = [member_payload(self.users[user_id], [admin_role] if admin else [])
+                   for user_id, admin in guild['members'].items()]
+        members.append(member_payload(self.bot_user))
+        return {
+            'id': str(guild_id), 'name': f'Guild {guild_id}', 'owner_id': str(BOT_ID), 'unavailable': False,
+            'member_count': len(members), 'large': False, 'icon': None, 'splash': None,
+            'roles': [role_payload(guild_id, '@everyone', EVERYONE_PERMISSIONS, 0),
+                      role_payload(admin_role, 'Admin', ADMINISTRATOR, 1)],
+            'channels': [{'id': str(channel_id), 'type': 0, 'name': f'channel-{position}', 'position': position,
+                          'permission_overwrites': [], 'nsfw': False, 'parent_id': None}
+                         for position, channel_id in enumerate(guild['channels'])],
+            'members': members,
+            'emojis': [], 'stickers': [], 'features': [], 'voice_states': [], 'presences': [], 'threads': [],
+            'stage_instances': [], 'guild_scheduled_events': [], 'soundboard_sounds': [],
+            'premium_tier': 0, 'verification_level': 0, 'default_message_notifications': 0,
+            'explicit_content_filter': 0, 'mfa_level': 0, 'nsfw_level': 0, 'system_channel_flags': 0,
+            'preferred_locale': 'en-US', 'afk_timeout': 300, 'joined_at': now_iso(),
+        }
+
+    async def start(self, host='127.0.0.1', port=0):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.add_routes([web.get('/gateway', self.gateway), web.route('*', API_PREFIX + '{tail:.*}', self.rest)])
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://{host}:{self.port}'
+        return self.url
+
+    def patch(self):
+        """Point discord.py (this process) at the fake."""
+        from discord.gateway import DiscordWebSocket
+        from discord.http import Route
+        Route.BASE = self.url + API_PREFIX.rstrip('/')
+        DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(self.gateway_url)
+
+    @property
+    def gateway_url(self):
+        return self.url.replace('http://', 'ws://') + '/gateway'
+
+    async def stop(self):
+        for ws in list(self.sockets):
+            await ws.close()
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    def stats(self):
+        return {
+            'requests': sum(self.requests.values()),
+            'by_route': dict(self.requests),
+            'rate_limited': self.rate_limited,
+            'dispatched': self.dispatched,
+            'unhandled': dict(self.unhandled),
+        }
+
+    # -- gateway -------------------------------------------------------
+
+    async def gateway(self, request):
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        await ws.send_str(json.dumps({'op': 10, 'd': {'heartbeat_interval': HEARTBEAT_MS}}))
+        try:
+            async for frame in ws:
+                if frame.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                payload = json.loads(frame.data)
+                op = payload['op']
+                if op == 1:
+                    await ws.send_str(json.dumps({'op': 11}))
+                elif op == 2:
+                    await self._identify(ws, payload['d'])
+                elif op == 6:
+                    self.sockets.add(ws)
+                    await self._send(ws, 'RESUMED', {})
+        finally:
+            self.sockets.discard(ws)
+        return ws
+
+    async def _identify(self, ws, data):
+        shard_id, shard_count = data.get('shard') or (0, 1)
+        guild_ids = [guild_id for guild_id in self.guilds if (guild_id >> 22) % shard_count == shard_id]
+        await self._send(ws, 'READY', {
+            'v': 10, 'user': self.bot_user, 'session_id': f'fake-{shard_id}',
+            'resume_gateway_url': self.gateway_url, 'shard': [shard_id, shard_count],
+            'guilds': [{'id': str(guild_id), 'unavailable': True} for guild_id in guild_ids],
+            'application': {'id': str(BOT_ID), 'flags': 0},
+        })
+        for guild_id in guild_ids:
+            await self._send(ws, 'GUILD_CREATE', self.guild_payload(guild_id))
+        self.sockets.add(ws)
+
+    async def _send(self, ws, event, data):
+        self.sequence += 1
+        await ws.send_str(json.dumps({'op': 0, 't': event, 's': self.sequence, 'd': data}))
+
+    async def dispatch(self, event, data):
+        self.dispatched += 1
+        for ws in list(self.sockets):
+            await self._send(ws, event, data)
+
+    def message_payload(self, channel_id, author, content='', embeds=(), message_id=None):
+        payload = {
+            'id': str(message_id or snowflake()), 'channel_id': str(channel_id), 'author': author,
+            'content': content or '', 'timestamp': now_iso(), 'edited_timestamp': None, 'tts': False,
+            'mention_everyone': False, 'mentions': [], 'mention_roles': [], 'attachments': [],
+            'embeds': list(embeds), 'pinned': False, 'type': 0, 'flags': 0, 'components': [],
+        }
+        guild_id = self.channels.get(channel_id)
+        if guild_id is not None:
+            payload['guild_id'] = str(guild_id)
+        return payload
+
+    async def user_message(self, channel_id, user_id, content):
+        """A member posts ``content``; returns the message id."""
+        payload = self.message_payload(channel_id, self.users[user_id], content)
+        if 'guild_id' in payload:
+            payload['member'] = {'roles': self._roles(channel_id, user_id), 'joined_at': now_iso(),
+                                 'deaf': False, 'mute': False, 'flags': 0}
+        await self.dispatch('MESSAGE_CREATE', payload)
+        return int(payload['id'])
+
+    async def user_reaction(self, channel_id, message_id, user_id, emoji):
+        data = {'user_id': str(user_id), 'channel_id': str(channel_id), 'message_id': str(message_id),
+                'emoji': {'id': None, 'name': emoji}, 'burst': False, 'type': 0}
+        guild_id = self.channels.get(channel_id)
+        if guild_id is not None:
+            data['guild_id'] = str(guild_id)
+            data['member'] = member_payload(self.users[user_id], self._roles(channel_id, user_id))
+        await self.dispatch('MESSAGE_REACTION_ADD', data)
+
+    def _roles(self, channel_id, user_id):
+        guild_id = self.channels[channel_id]
+        admin = self.guilds[guild_id]['members'].get(user_id)
+        return [str(self.admin_roles[guild_id])] if admin else []
+
+    # -- REST ----------------------------------------------------------
+
+    async def rest(self, request):
+        delay = self.latency + (self.rng.random() * self.jitter if self.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        path = request.match_info['tail']
+        for method, pattern, handler in self.routes:
+            match = pattern.match(path)
+            if method == request.method and match:
+                self.requests[f"{method} {pattern.pattern.rstrip('$')}"] += 1
+                if self.rate_limit and self.rng.random() < self.rate_limit:
+                    return self._too_many(self.retry_after, scope='shared')
+                return await handler(request, *match.groups())
+        self.unhandled[f'{request.method} {path}'] += 1
+        return json_response({'message': '404: Not Found', 'code': 0}, status=404)
+
+    def _too_many(self, retry_after, scope='user', headers=None):
+        self.rate_limited += 1
+        headers = dict(headers or {})
+        # discord.py treats a 429 without Via as a Cloudflare ban
+        headers.update({'Via': '1.1 google', 'Retry-After': str(max(1, round(retry_after))),
+                        'X-RateLimit-Scope': scope})
+        return json_response({'message': 'You are being rate limited.', 'retry_after': retry_after,
+                                  'global': False}, status=429, headers=headers)
+
+    def _bucket(self, channel_id):
+        """X-RateLimit headers for a message to ``channel_id``, and whether it is over the limit."""
+        if not self.channel_limit:
+            return {}, False
+        now = time.monotonic()
+        bucket = self.buckets.get(channel_id)
+        if bucket is None or now - bucket[0] >= self.channel_window:
+            bucket = self.buckets[channel_id] = [now, 0]
+        reset_after = self.channel_window - (now - bucket[0])
+        over = bucket[1] >= self.channel_limit
+        if not over:
+            bucket[1] += 1
+        headers = {
+            'X-RateLimit-Limit': str(self.channel_limit),
+            'X-RateLimit-Remaining': str(max(0, self.channel_limit - bucket[1])),
+            'X-RateLimit-Reset-After': f'{reset_after:.3f}',
+            'X-RateLimit-Bucket': 'channel-messages',
+        }
+        return headers, over
+
+    async def _json_body(self, request):
+        if request.content_type == 'application/json':
+            return await request.json()
+        # Multipart when files are attached: the message is in payload_json
+        body = {}
+        reader = await request.multipart()
+        async for part in reader:
+            if part.name == 'payload_json':
+                body = json.loads(await part.text())
+            else:
+                await part.read()
+        return body
+
+    async def get_me(self, request):
+        return json_response(self.bot_user)
+
+    async def get_application(self, request):
+        return json_response({
+            'id': str(BOT_ID), 'name': 'Soul Bot', 'description': '', 'icon': None, 'bot_public': True,
+            'bot_require_code_grant': False, 'owner': user_payload(BOT_ID - 1, 'owner'), 'verify_key': '0' * 64,
+            'flags': 0, 'bot': self.bot_user,
+        })
+
+    async def get_gateway(self, request):
+        return json_response({
+            'url': self.gateway_url, 'shards': 1,
+            'session_start_limit': {'total': 1000, 'remaining': 1000, 'reset_after': 0, 'max_concurrency': 1},
+        })
+
+    async def get_user(self, request, user_id):
+        return json_response(self.users.get(int(user_id)) or user_payload(user_id))
+
+    async def create_dm(self, request):
+        body = await request.json()
+        user_id = int(body['recipient_id'])
+        channel_id = user_id + 7
+        self.channels.setdefault(channel_id, None)
+        return json_response({'id': str(channel_id), 'type': 1, 'last_message_id': None,
+                                  'recipients': [self.users.get(user_id) or user_payload(user_id)]})
+
+    async def create_message(self, request, channel_id):
+        channel_id = int(channel_id)
+        headers, over = self._bucket(channel_id)
+        if over:
+            return self._too_many(float(headers['X-RateLimit-Reset-After']), headers=headers)
+        body = await self._json_body(request)
+        embeds = body.get('embeds') or ([body['embed']] if body.get('embed') else [])
+        payload = self.message_payload(channel_id, self.bot_user, body.get('content'), embeds)
+        if self.on_bot_message is not None:
+            self.on_bot_message(channel_id, payload)
+        await self.dispatch('MESSAGE_CREATE', payload)
+        return json_response(payload, headers=headers)
+
+    async def edit_message(self, request, channel_id, message_id):
+        body = await self._json_body(request)
+        payload = self.message_payload(int(channel_id), self.bot_user, body.get('content'), body.get('embeds') or (),
+                                       message_id=message_id)
+        payload['edited_timestamp'] = now_iso()
+        return json_response(payload)
+
+    async def add_reaction(self, request, channel_id, message_id, emoji):
+        if self.on_bot_reaction is not None:
+            self.on_bot_reaction(int(channel_id), int(message_id), unquote(emoji))
+        return web.Response(status=204)
+
+    async def no_content(self, request, *ids):
+        return web.Response(status=204)
@@ -0,0 +1,345 @@
+"""Replay a command trace through the whole bot against a fake Discord.
+
+    python -m benchmarks.replay                                  # synthetic trace at 1x and 10x
+    python -m benchmarks.replay --trace trace.jsonl --speed 1 5 20 50 --out replay.json
+    python -m benchmarks.replay --latency 0.08 --jitter 0.04 --rate-limit 0.02 --channel-limit 5
+
+Each speed runs in a fresh process.  That process:
+1. Builds a synthetic economy covering every user in the trace.
+2. Imports main.py against it.
+3. Starts the fake gateway and REST API (benchmarks/fake_discord.py) and
+   logs the bot in with ``bot.start()`` as in production, so commands go
+   through discord.py's gateway parsing, command dispatch, checks and
+   REST client.
+4. Plays the trace (benchmarks/traffic.py) at ``--speed`` times its
+   recorded pace.
+
+Reactions answer !battle challenges and admin confirmations through the
+bot's real ``wait_for`` calls.
+
+Commands are spread over a pool of channels per guild, so each reply can
+be matched to what caused it.  A reply is the bot's first message in that
+channel after a command or reaction.  Latency is the time from the gateway
+event to that message arriving at the fake REST API, including any 429
+retries.  Rows for a command answered by reaction (``battle ⚔️``) time the
+step after the reaction.  'unanswered' are commands with no reply within
+``--reply-timeout``.  'orphans' are reactions that found no bot message,
+from a flow their user takes part in, to react to.
+
+The fake and the load generator share the bot's event loop and CPU, so at
+high speeds the numbers are a lower bound on what the bot alone would do.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+
+from benchmarks.fake_discord import FakeDiscord
+from benchmarks.synthetic import make_economy, user_id
+from benchmarks.traffic import CHANNEL_PLACEHOLDER, OFFERS, PLACEHOLDER, load, synthesize
+from economy.sqlite_store import migrate
+from economy.transactions import percentile
+
+GUILD_BASE = 800_000_000_000_000_000
+CHANNEL_POOL = 256
+# Bot messages per channel that reactions can still target
+REACTABLE = 8
+
+
+def guild_id(index):
+    return GUILD_BASE + (index or 0) * 100_000
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'p50_ms': percentile(ordered, 0.50) * 1000,
+        'p95_ms': percentile(ordered, 0.95) * 1000,
+        'p99_ms': percentile(ordered, 0.99) * 1000,
+        'max_ms': ordered[-1] * 1000 if ordered else 0.0,
+    }
+
+
+class Replayer:
+    def __init__(self, fake, events, speed, commands, pool=CHANNEL_POOL, reply_timeout=30.0):
+        self.fake = fake
+        self.events = events
+        self.speed = speed
+        self.commands = commands
+        self.pool = pool
+        self.reply_timeout = reply_timeout
+        self.clock = time.perf_counter
+        # replay channel -> deque of (sent at, label, user ids taking part) waiting for a reply
+        self.pending = defaultdict(deque)
+        # replay channel -> deque of [message id, emojis the bot added, label, user ids]
+        self.reactable = defaultdict(lambda: deque(maxlen=REACTABLE))
+        # (guild, trace channel) -> replay channels it used, most recent last
+        self.flows = defaultdict(lambda: deque(maxlen=REACTABLE))
+        self.next_channel = defaultdict(int)
+        self.labels = {}
+        self.samples = defaultdict(list)
+        self.missed = defaultdict(int)
+        self.answered = 0
+        self.unanswered = 0
+        self.extra = 0
+        self.orphans = 0
+        self.skipped = 0
+        self.max_dispatch_lag = 0.0
+        self.last_reply = None
+        self.reactions = []
+        fake.on_bot_message = self.bot_message
+        fake.on_bot_reaction = self.bot_reaction
+
+    def setup(self):
+        """Guilds, channel pools and members from the trace."""
+        members = defaultdict(dict)
+        for event in self.events:
+            if event['guild'] is None:
+                continue
+            admins = members[event['guild']]
+            uid = int(user_id(event['user']))
+            admins[uid] = admins.get(uid, False) or event.get('admin', False)
+            for match in PLACEHOLDER.finditer(event.get('content', '')):
+                admins.setdefault(int(user_id(int(match.group(2)))), False)
+        for guild, users in members.items():
+            base = guild_id(guild)
+            self.fake.add_guild(base, [base + 1000 + i for i in range(self.pool)], users)
+
+    def channel_for(self, guild):
+        index = self.next_channel[guild] % self.pool
+        self.next_channel[guild] += 1
+        return guild_id(guild) + 1000 + index
+
+    def bot_message(self, channel, payload):
+        now = self.clock()
+        pending = self.pending[channel]
+        while pending and now - pending[0][0] > self.reply_timeout:
+            self.miss(pending.popleft())
+        if not pending:
+            self.extra += 1
+            return
+        sent, label, users = pending.popleft()
+        self.samples[label].append(now - sent)
+        self.labels[int(payload['id'])] = (label, users)
+        self.answered += 1
+        self.last_reply = now
+
+    def bot_reaction(self, channel, message_id, emoji):
+        entries = self.reactable[channel]
+        for entry in entries:
+            if entry[0] == message_id:
+                entry[1].add(emoji)
+                return
+        entries.append([message_id, {emoji}, *self.labels.get(message_id, ('?', ()))])
+
+    def miss(self, stimulus):
+        self.unanswered += 1
+        self.missed[stimulus[1]] += 1
+
+    def participants(self, author, text):
+        return {author, *(int(user_id(int(match.group(2)))) for match in PLACEHOLDER.finditer(text))}
+
+    def content(self, text, guild):
+        def user(match):
+            uid = user_id(int(match.group(2)))
+            return f"<@{uid}>" if match.group(1) else uid
+        text = PLACEHOLDER.sub(user, text)
+        return CHANNEL_PLACEHOLDER.sub(lambda m: f"<#{guild_id(guild) + 1000 + int(m.group(1)) % self.pool}>", text)
+
+    async def react(self, event, sent_at):
+        """Reacts once the bot has put up a message to react to.
+
+        Only flows the user takes part in (as author or mentioned) are
+        candidates, and each flow takes one answer.
+        """
+        deadline = sent_at + self.reply_timeout
+        user = int(user_id(event['user']))
+        while True:
+            for channel in reversed(self.flows[(event['guild'], event['channel'])]):
+                entries = self.reactable[channel]
+                for entry in reversed(entries):
+                    if event['emoji'] in entry[1] and user in entry[3]:
+                        entries.remove(entry)
+                        self.pending[channel].append((self.clock(), f"{entry[2]} {event['emoji']}", entry[3]))
+                        await self.fake.user_reaction(channel, entry[0], user, event['emoji'])
+                        return
+            if self.clock() > deadline:
+                self.orphans += 1
+                return
+            await asyncio.sleep(0.02)
+
+    async def run(self):
+        start = self.clock()
+        for event in self.events:
+            if event['guild'] is None:
+                self.skipped += 1
+                continue
+            due = start + event['t'] / self.speed
+            delay = due - self.clock()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            now = self.clock()
+            self.max_dispatch_lag = max(self.max_dispatch_lag, now - due)
+            author = int(user_id(event['user']))
+            if event['kind'] == 'reaction':
+                self.reactions.append(asyncio.create_task(self.react(event, now)))
+                continue
+            channel = self.channel_for(event['guild'])
+            if event['kind'] == 'chatter':
+                await self.fake.user_message(channel, author, 'x' * event['length'])
+                continue
+            name = event['content'][1:].split(' ', 1)[0].lower()
+            if name in self.commands:
+                participants = self.participants(author, event['content'])
+                self.pending[channel].append((self.clock(), self.commands[name], participants))
+                self.flows[(event['guild'], event['channel'])].append(channel)
+            await self.fake.user_message(channel, author, self.content(event['content'], event['guild']))
+        sent_until = self.clock()
+        await asyncio.gather(*self.reactions)
+        # Wait for the last replies
+        deadline = self.clock() + self.reply_timeout
+        while any(self.pending.values()) and self.clock() < deadline:
+            await asyncio.sleep(0.05)
+        for pending in self.pending.values():
+            for stimulus in pending:
+                self.miss(stimulus)
+        return start, sent_until
+
+
+async def replay(main, events, speed, options):
+    fake = FakeDiscord(options['latency'], options['jitter'], options['rate_limit'], options['retry_after'],
+                       options['channel_limit'])
+    await fake.start()
+    fake.patch()
+    # Command name or alias -> command name
+    commands = {alias: command.name for command in main.bot.commands for alias in (command.name, *command.aliases)}
+    replayer = Replayer(fake, events, speed, commands, options['channel_pool'], options['reply_timeout'])
+    replayer.setup()
+
+    bot = asyncio.create_task(main.bot.start('fake-token'))
+    ready = asyncio.create_task(main.bot.wait_until_ready())
+    await asyncio.wait([bot, ready], timeout=60, return_when=asyncio.FIRST_COMPLETED)
+    if not ready.done():
+        ready.cancel()
+        await main.bot.close()
+        await fake.stop()
+        # The bot failed to log in: raise why
+        await bot
+        raise TimeoutError("the bot did not become ready")
+    try:
+        start, sent_until = await replayer.run()
+    finally:
+        await main.bot.close()
+        await bot
+        for economy in main.partitions.loaded():
+            await economy.close()
+        await fake.stop()
+
+    end = replayer.last_reply or sent_until
+    all_samples = [sample for samples in replayer.samples.values() for sample in samples]
+    flows = [sample for label, samples in replayer.samples.items() if ' ' in label for sample in samples]
+    row = {
+        'speed': speed,
+        'events': len(events),
+        'commands': replayer.answered + replayer.unanswered,
+        'answered': replayer.answered,
+        'unanswered': replayer.unanswered,
+        'extra_messages': replayer.extra,
+        'orphan_reactions': replayer.orphans,
+        'skipped': replayer.skipped,
+        'seconds': end - start,
+        'replies_per_s': replayer.answered / (end - start) if end > start else 0.0,
+        'dispatch_lag_max_ms': replayer.max_dispatch_lag * 1000,
+        'loop_lag_max_ms': main.loop_lag.max * 1000,
+        'latency': summarize(all_samples),
+        'reaction_flows': summarize(flows),
+        'by_command': {label: dict(summarize(replayer.samples[label]), unanswered=replayer.missed[label])
+                       for label in sorted(set(replayer.samples) | set(replayer.missed))},
+        'discord': fake.stats(),
+    }
+    return row
+
+
+def worker(events, speed, users, options):
+    with tempfile.TemporaryDirectory() as directory:
+        data_file = os.path.join(directory, 'economy_data.json')
+        with open(data_file, 'w') as f:
+            json.dump(make_economy(users, OFFERS, options['bets_per_offer']), f)
+        sqlite_path = os.path.join(directory, 'economy.db')
+        if options['backend'] == 'sqlite':
+            migrate(data_file, sqlite_path)
+        os.environ.update({
+            'DATA_FILE': data_file,
+            'LEDGER_FILE': os.path.join(directory, 'economy_ledger.jsonl'),
+            'SQLITE_PATH': sqlite_path,
+            'SHARD_DIR': os.path.join(directory, 'economy_shards'),
+            'GUILD_DATA_DIR': os.path.join(directory, 'economy_guilds'),
+            'STORAGE_BACKEND': options['backend'],
+            'ECONOMY_PARTITIONS': options['partitions'],
+            'PORT': '0',
+        })
+        os.environ.pop('TRAFFIC_LOG', None)
+        os.chdir(directory)
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import main
+        return asyncio.run(replay(main, events, speed, options))
+
+
+def run(events, speed, users, options):
+    # A fresh interpreter per run: main.py reads its configuration at import
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(worker, (events, speed, users, options))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trace', help="Trace from benchmarks.traffic (default: a synthetic one)")
+    parser.add_argument('--seconds', type=float, default=60, help="Length of the synthetic trace")
+    parser.add_argument('--rate', type=float, default=20.0, help="Messages/s of the synthetic trace")
+    parser.add_argument('--speed', type=float, nargs='+', default=[1, 10])
+    parser.add_argument('--users', type=int, default=1000, help="Economy size (at least the trace's users)")
+    parser.add_argument('--bets-per-offer', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds per REST call")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Up to this many extra seconds per REST call")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="Fraction of REST calls answered 429")
+    parser.add_argument('--retry-after', type=float, default=0.25)
+    parser.add_argument('--channel-limit', type=int, default=0, help="Messages per channel per 5s (0: unlimited)")
+    parser.add_argument('--channel-pool', type=int, default=CHANNEL_POOL)
+    parser.add_argument('--reply-timeout', type=float, default=30.0)
+    parser.add_argument('--backend', default='journal', choices=['journal', 'json', 'sqlite', 'sharded'])
+    parser.add_argument('--partitions', default='global', choices=['global', 'guild'])
+    parser.add_argument('--out', help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    events = load(args.trace) if args.trace else synthesize(args.seconds, args.rate, args.users)
+    users = max([args.users] + [event['user'] + 1 for event in events])
+    options = {
+        'latency': args.latency, 'jitter': args.jitter, 'rate_limit': args.rate_limit,
+        'retry_after': args.retry_after, 'channel_limit': args.channel_limit, 'channel_pool': args.channel_pool,
+        'reply_timeout': args.reply_timeout, 'backend': args.backend, 'partitions': args.partitions,
+        'bets_per_offer': args.bets_per_offer,
+    }
+
+    results = []
+    print(f"{'speed':>5} {'commands':>8} {'replies/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+          f"{'flow p95':>8} {'unans.':>6} {'orphans':>7} {'429s':>5}")
+    for speed in args.speed:
+        row = run(events, speed, users, options)
+        results.append(row)
+        latency, flows = row['latency'], row['reaction_flows']
+        print(f"{row['speed']:>5g} {row['commands']:>8,} {row['replies_per_s']:>9,.1f} {latency['p50_ms']:>8.1f} "
+              f"{latency['p95_ms']:>8.1f} {latency['p99_ms']:>8.1f} {latency['max_ms']:>8.1f} {flows['p95_ms']:>8.1f} "
+              f"{row['unanswered']:>6,} {row['orphan_reactions']:>7,} {row['discord']['rate_limited']:>5,}")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
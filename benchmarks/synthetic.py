@@ -0,0 +1,91 @@
+"""Synthetic economies shaped like the real economy_data.json."""
+import random
+from datetime import datetime, timedelta
+
+ZANPAKUTO_NAMES = ["Senbonzakura", "Hyorinmaru", "Ryujin Jakka", "Zabimaru", "Wabisuke"]
+STAND_NAMES = ["Star Platinum", "The World", "Crazy Diamond", "Gold Experience", "King Crimson"]
+RANKS = ["Academy Student", "Unseated Officer", "20th Seat", "15th Seat", "10th Seat",
+         "5th Seat", "3rd Seat", "Lieutenant", "Captain", "Captain Commander"]
+
+BASE_USER_ID = 100_000_000_000_000_000
+
+
+def user_id(i):
+    return str(BASE_USER_ID + i)
+
+
+def make_user(rng, now):
+    def maybe_time(p):
+        return (now - timedelta(seconds=rng.randint(0, 200_000))).isoformat() if rng.random() < p else None
+
+    return {
+        "reiatsu": rng.randint(0, 50_000),
+        "soul_fragments": rng.randint(0, 30) if rng.random() < 0.3 else 0,
+        "zanpakuto": rng.choice(ZANPAKUTO_NAMES) if rng.random() < 0.1 else None,
+        "stand": rng.choice(STAND_NAMES) if rng.random() < 0.1 else None,
+        "rank": RANKS[min(int(rng.expovariate(1.2)), len(RANKS) - 1)],
+        "level": rng.randint(1, 60),
+        "exp": rng.randint(0, 99),
+        "daily_streak": rng.randint(0, 30),
+        "last_daily": maybe_time(0.6),
+        "last_work": maybe_time(0.5),
+        "last_train": maybe_time(0.4),
+        "inventory": {},
+        "active_bets": [],
+        "total_winnings": rng.randint(0, 20_000),
+        "battles_won": rng.randint(0, 50),
+        "achievements": []
+    }
+
+
+def make_offer(match_id, rng, now):
+    return {
+        'id': match_id,
+        'team1': f"T{rng.randint(1, 99)}",
+        'team2': f"T{rng.randint(100, 199)}",
+        'profit_percentage': rng.choice([50, 80, 100, 150]),
+        'created_at': now.isoformat(),
+        'bets': {},
+        'total_team1_bets': 0,
+        'total_team2_bets': 0,
+        'total_bets_count': 0,
+        'status': 'open'
+    }
+
+
+def place_bet(state, match_id, uid, team, amount):
+    """Record a bet the way !bet does (balance, offer and active_bets)."""
+    offer = state['active_offers'][match_id]
+    user = state['user_data'][uid]
+    total_return = amount + amount * offer['profit_percentage'] // 100
+    user['reiatsu'] -= amount
+    offer['bets'][uid] = {'team': team, 'amount': amount, 'potential_return': total_return, 'user_name': f"user{uid[-6:]}"}
+    offer[f'total_{team}_bets'] += amount
+    offer['total_bets_count'] += 1
+    user['active_bets'].append({
+        'match_id': match_id, 'team': team, 'amount': amount, 'potential_return': total_return,
+        'match_description': f"{offer['team1']} vs {offer['team2']}"
+    })
+
+
+def make_economy(users, offers=0, bets_per_offer=0, seed=42):
+    """Plain-dict economy with ``users`` users and ``offers`` open offers."""
+    rng = random.Random(seed)
+    now = datetime(2025, 6, 5, 12, 0, 0)
+    state = {
+        'user_data': {user_id(i): make_user(rng, now) for i in range(users)},
+        'active_offers': {},
+        'offer_results': {},
+        'shop_items': {},
+        'daily_missions': {},
+        'tournaments': {}
+    }
+    for o in range(offers):
+        match_id = f"M{o:05d}"
+        state['active_offers'][match_id] = make_offer(match_id, rng, now)
+        for i in rng.sample(range(users), min(bets_per_offer, users)):
+            uid = user_id(i)
+            amount = rng.randint(100, 1000)
+            if state['user_data'][uid]['reiatsu'] >= amount:
+                place_bet(state, match_id, uid, rng.choice(['team1', 'team2']), amount)
+    return state
@@ -0,0 +1,182 @@
+"""Command traces for benchmarks/replay.py: recorded or synthetic.
+
+    python -m benchmarks.traffic record traffic.log --out trace.jsonl
+    python -m benchmarks.traffic synth --seconds 300 --rate 20 --out trace.jsonl
+
+'record' turns the bot's TRAFFIC_LOG (economy/traffic.py) into an
+anonymized trace:
+- Guilds, channels and users become small indices, in order of first
+  appearance.
+- In command text, user mentions and bare user IDs become ``<@user:N>`` /
+  ``<user:N>`` and channel mentions ``<#channel:N>``; any other
+  snowflake-sized number becomes 0.
+- Times become seconds since the first event.
+
+The log already reduces ordinary chat to its length.
+
+'synth' makes a trace without production data: a mix of player commands
+with a few very active users, !battle challenges the opponent answers with
+a reaction, and admin !inflation / !massadd confirmed with ✅.
+
+A trace is one JSON object per line, ordered by ``t``:
+``{"t", "kind": "message"|"chatter"|"reaction", "guild", "channel", "user"}``
+plus ``content`` and ``admin`` (message), ``length`` (chatter) or
+``emoji`` (reaction).  A reaction goes to the latest bot message in its
+channel that the bot itself reacted to with that emoji.
+"""
+import argparse
+import json
+import random
+import re
+
+MENTION = re.compile(r'<@!?(\d{15,21})>')
+CHANNEL_MENTION = re.compile(r'<#(\d{15,21})>')
+SNOWFLAKE = re.compile(r'\b\d{15,21}\b')
+PLACEHOLDER = re.compile(r'<(@?)user:(\d+)>')
+CHANNEL_PLACEHOLDER = re.compile(r'<#channel:(\d+)>')
+
+OFFERS = 200
+ITEMS = ['shinigami_robes', 'spiritual_amplifier']
+# Synthetic mix: (weight, content template); {user} is a random other member
+PLAYER_COMMANDS = [
+    (12, '!balance'), (8, '!profile'), (10, '!daily'), (10, '!work'), (6, '!train'),
+    (6, '!leaderboard'), (4, '!rank'), (4, '!shop'), (4, '!offers'), (3, '!showbets'),
+    (10, '!bet {offer} {team} {amount}'), (6, '!give {user} {amount}'), (2, '!buy {item}'),
+    (2, '!inventory'), (5, '!battle {user}'),
+]
+ADMIN_COMMANDS = [(2, '!inflation {percent}'), (2, '!massadd reiatsu {amount}'), (3, '!serveranalytics')]
+
+
+class Anonymizer:
+    def __init__(self):
+        self.ids = {'guild': {}, 'channel': {}, 'user': {}}
+
+    def index(self, kind, value):
+        if value is None:
+            return None
+        table = self.ids[kind]
+        return table.setdefault(value, len(table))
+
+    def content(self, text):
+        text = MENTION.sub(lambda m: f"<@user:{self.index('user', int(m.group(1)))}>", text)
+        text = CHANNEL_MENTION.sub(lambda m: f"<#channel:{self.index('channel', int(m.group(1)))}>", text)
+
+        def bare(match):
+            value = int(match.group(0))
+            if value in self.ids['user']:
+                return f"<user:{self.ids['user'][value]}>"
+            return '0'
+        return SNOWFLAKE.sub(bare, text)
+
+
+def record(lines):
+    """Trace events from TRAFFIC_LOG lines."""
+    records = [json.loads(line) for line in lines if line.strip()]
+    records.sort(key=lambda record: record['ts'])
+    anonymizer = Anonymizer()
+    # Everyone who posted or reacted, so a bare ID of theirs in an argument is recognised
+    for entry in records:
+        anonymizer.index('user', entry['author'])
+    start = records[0]['ts'] if records else 0.0
+    for entry in records:
+        event = {
+            't': round(entry['ts'] - start, 3),
+            'kind': entry['kind'],
+            'guild': anonymizer.index('guild', entry.get('guild')),
+            'channel': anonymizer.index('channel', entry['channel']),
+            'user': anonymizer.index('user', entry['author']),
+        }
+        if entry['kind'] == 'message':
+            event['admin'] = entry.get('admin', False)
+            event['content'] = anonymizer.content(entry['content'])
+        elif entry['kind'] == 'chatter':
+            event['length'] = entry['length']
+        else:
+            event['emoji'] = entry['emoji']
+        yield event
+
+
+def synthesize(seconds=300, rate=20.0, users=1000, admins=3, channels=20, offers=OFFERS, seed=7):
+    """A trace of ``rate`` messages/s for ``seconds``, with reaction flows."""
+    rng = random.Random(seed)
+    player_weights = [weight for weight, _ in PLAYER_COMMANDS]
+    admin_weights = [weight for weight, _ in ADMIN_COMMANDS]
+    events = []
+    t = 0.0
+    while True:
+        t += rng.expovariate(rate)
+        if t >= seconds:
+            break
+        # A few users are far more active than the rest
+        user = min(int(users * rng.random() ** 3), users - 1)
+        channel = rng.randrange(channels)
+        event = {'t': round(t, 3), 'kind': 'message', 'guild': 0, 'channel': channel, 'user': user, 'admin': False}
+        roll = rng.random()
+        if roll < 0.25:
+            events.append(dict(event, kind='chatter', length=rng.randint(3, 120)))
+            continue
+        if roll < 0.26:
+            user = event['user'] = rng.randrange(admins)
+            event['admin'] = True
+            template = rng.choices(ADMIN_COMMANDS, admin_weights)[0][1]
+        else:
+            template = rng.choices(PLAYER_COMMANDS, player_weights)[0][1]
+        other = rng.randrange(users - 1)
+        other += other >= user
+        event['content'] = template.format(
+            user=f'<@user:{other}>', offer=f'M{rng.randrange(offers):05d}', team=rng.choice('12'),
+            amount=rng.randint(100, 2000), item=rng.choice(ITEMS), percent=rng.choice(['1', '-1', '2.5']),
+        )
+        events.append(event)
+        # Confirmations and accepted challenges, a few seconds later
+        if template.startswith('!battle'):
+            events.append({'t': round(t + rng.uniform(1, 8), 3), 'kind': 'reaction', 'guild': 0, 'channel': channel,
+                           'user': other, 'emoji': '⚔️' if rng.random() < 0.85 else '❌'})
+        elif template.startswith(('!inflation', '!massadd')):
+            events.append({'t': round(t + rng.uniform(1, 3), 3), 'kind': 'reaction', 'guild': 0, 'channel': channel,
+                           'user': user, 'emoji': '✅'})
+    events.sort(key=lambda event: event['t'])
+    return events
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write(events, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        for event in events:
+            f.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='mode', required=True)
+    rec = sub.add_parser('record', help="Anonymize a TRAFFIC_LOG")
+    rec.add_argument('log')
+    rec.add_argument('--out', required=True)
+    syn = sub.add_parser('synth', help="Generate a synthetic trace")
+    syn.add_argument('--seconds', type=float, default=300)
+    syn.add_argument('--rate', type=float, default=20.0, help="Messages per second")
+    syn.add_argument('--users', type=int, default=1000)
+    syn.add_argument('--channels', type=int, default=20)
+    syn.add_argument('--seed', type=int, default=7)
+    syn.add_argument('--out', required=True)
+    args = parser.parse_args()
+
+    if args.mode == 'record':
+        with open(args.log, encoding='utf-8') as f:
+            events = list(record(f))
+    else:
+        events = synthesize(args.seconds, args.rate, args.users, channels=args.channels, seed=args.seed)
+    write(events, args.out)
+    kinds = {}
+    for event in events:
+        kinds[event['kind']] = kinds.get(event['kind'], 0) + 1
+    span = events[-1]['t'] if events else 0.0
+    print(f"{len(events):,} events over {span:.0f}s: " + ', '.join(f"{count:,} {kind}" for kind, count in kinds.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+"""Support modules for the Soul Society economy bot (storage, indexes, metrics)."""
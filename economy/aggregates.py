@@ -0,0 +1,254 @@
+"""Economy-wide aggregates kept current on every user change.
+
+``!serveranalytics`` and ``!godstats`` need the money supply, level sum,
+power-holder counts, rank histogram and active-bet totals.  Instead of
+scanning every user per request, ``AggregateRegistry`` registers each
+figure with the ``UserRepository`` like a leaderboard metric: the
+repository hands it the before/after value on every write to a field it
+depends on and on every insert/delete, so ``snapshot()`` is O(1).
+
+``active_bets`` is a list mutated in place, so that aggregate is driven by
+the repository's change tracking rather than item writes and remembers each
+bettor's last contribution itself.
+
+``verify()`` recomputes everything with one scan (``scan()``), replaces any
+figure that disagrees and keeps a drift report of what was wrong.  Lazy
+repositories keep no registry; the SQLite store computes the same figures
+with aggregate queries (``SqliteBackend.user_figures()``).
+"""
+import time
+
+from economy.records import UserRecord, rank_name
+
+SUM_FIELDS = ('reiatsu', 'soul_fragments', 'level')
+MAX_DRIFT_REPORTS = 20
+
+
+class Sum:
+    """Total of a per-user value.
+
+    ``recount()`` gives the exact total again after a bulk operation.
+    """
+
+    def __init__(self, recount):
+        self.recount = recount
+        self._total = recount()
+        self._stale = False
+
+    @property
+    def value(self):
+        if self._stale:
+            self._total = self.recount()
+            self._stale = False
+        return self._total
+
+    def set(self, value):
+        self._total = value
+        self._stale = False
+
+    def insert(self, key, value):
+        self._total += value
+
+    def remove(self, key, value):
+        self._total -= value
+
+    def move(self, key, old, new):
+        self._total += new - old
+
+    def bulk_changed(self, op=None):
+        self._stale = True
+
+
+class Histogram:
+    """Number of users per value."""
+
+    def __init__(self, source):
+        self.source = source
+        self.counts = {}
+        self.set(value for value, _ in source())
+
+    @property
+    def value(self):
+        return dict(self.counts)
+
+    def set(self, values):
+        self.counts = {}
+        for value in values:
+            self.insert(None, value)
+
+    def insert(self, key, value):
+        self.counts[value] = self.counts.get(value, 0) + 1
+
+    def remove(self, key, value):
+        count = self.counts.get(value, 0) - 1
+        if count > 0:
+            self.counts[value] = count
+        else:
+            self.counts.pop(value, None)
+
+    def move(self, key, old, new):
+        self.remove(key, old)
+        self.insert(key, new)
+
+    def bulk_changed(self, op=None):
+        self.set(value for value, _ in self.source())
+
+
+class PerUser:
+    """Element-wise total of tuple contributions, remembered per user.
+
+    For values derived from containers that change in place, where the old
+    value is not available when the change is reported.
+    """
+
+    def __init__(self, source, width):
+        self.source = source
+        self.width = width
+        self.set(source())
+
+    @property
+    def value(self):
+        return tuple(self.totals)
+
+    def set(self, items):
+        self.contributions = {}
+        self.totals = [0] * self.width
+        for value, key in items:
+            self.insert(key, value)
+
+    def insert(self, key, value):
+        if any(value):
+            self.contributions[key] = value
+            self.totals = [total + part for total, part in zip(self.totals, value)]
+
+    def remove(self, key, value=None):
+        old = self.contributions.pop(key, None)
+        if old is not None:
+            self.totals = [total - part for total, part in zip(self.totals, old)]
+
+    def move(self, key, old, new):
+        self.remove(key)
+        self.insert(key, new)
+
+    def bulk_changed(self, op=None):
+        self.set(self.source())
+
+
+# Value functions take a UserRecord or, when scanning a lazy store, a dict
+
+def powers(record):
+    return bool(record['zanpakuto']), bool(record['stand'])
+
+
+def active_bets(record):
+    # The attribute avoids materialising the shared empty list
+    bets = record.active_bets if isinstance(record, UserRecord) else record.get('active_bets')
+    if not bets:
+        return 0, 0
+    return len(bets), sum(bet.get('amount', 0) for bet in bets)
+
+
+def scan(records):
+    """Every figure of ``AggregateRegistry.snapshot()`` in one pass."""
+    users = 0
+    sums = dict.fromkeys(SUM_FIELDS, 0)
+    power_counts = {}
+    ranks = {}
+    bets = amount = 0
+    for record in records:
+        users += 1
+        for field in SUM_FIELDS:
+            sums[field] += record[field]
+        flags = powers(record)
+        power_counts[flags] = power_counts.get(flags, 0) + 1
+        rank = record['rank']
+        ranks[rank] = ranks.get(rank, 0) + 1
+        count, total = active_bets(record)
+        bets += count
+        amount += total
+    return figures(users, sums, power_counts, ranks, bets, amount)
+
+
+def figures(users, sums, power_counts, ranks, bets, amount):
+    return {
+        'users': users,
+        'reiatsu': sums['reiatsu'],
+        'soul_fragments': sums['soul_fragments'],
+        'level': sums['level'],
+        'zanpakuto_users': power_counts.get((True, False), 0) + power_counts.get((True, True), 0),
+        'stand_users': power_counts.get((False, True), 0) + power_counts.get((True, True), 0),
+        'both_powers': power_counts.get((True, True), 0),
+        'ranks': {rank_name(rank): count for rank, count in ranks.items() if count},
+        'active_bets': bets,
+        'active_bet_amount': amount,
+    }
+
+
+class AggregateRegistry:
+    """O(1) economy figures for a resident ``UserRepository``."""
+
+    def __init__(self, users):
+        self.users = users
+        records = users.records
+
+        def source(value):
+            return lambda: ((value(record), key) for key, record in records())
+
+        self.count = Sum(users.resident)
+        self.sums = {field: Sum(lambda field=field: users.total(field)) for field in SUM_FIELDS}
+        self.powers = Histogram(source(powers))
+        # Ordinals; names only in snapshots
+        self.ranks = Histogram(source(lambda record: record.rank))
+        self.bets = PerUser(source(active_bets), 2)
+
+        users.add_aggregate('users', self.count, lambda record: 1, fields=())
+        for field, total in self.sums.items():
+            users.add_aggregate(field, total)
+        users.add_aggregate('powers', self.powers, powers, fields=('zanpakuto', 'stand'))
+        users.add_aggregate('ranks', self.ranks, lambda record: record.rank, fields=('rank',))
+        users.add_aggregate('active_bets', self.bets, active_bets, fields=('active_bets',), container=True)
+
+        self.verifications = 0
+        self.last_verified = None
+        self.last_verify_seconds = None
+        self.drift_reports = []
+
+    def snapshot(self):
+        bets, amount = self.bets.value
+        return figures(self.count.value, {field: total.value for field, total in self.sums.items()},
+                        self.powers.counts, self.ranks.counts, bets, amount)
+
+    def verify(self):
+        """Compare with a full scan and fix any drift.
+
+        Returns the drift report ({figure: {'tracked', 'actual'}}), empty
+        when everything matched.
+        """
+        start = time.perf_counter()
+        tracked = self.snapshot()
+        records = self.users.records
+        actual = scan(record for _, record in records())
+        drift = {name: {'tracked': tracked[name], 'actual': value}
+                 for name, value in actual.items() if tracked[name] != value}
+        if drift:
+            self.count.set(actual['users'])
+            for field, total in self.sums.items():
+                total.set(actual[field])
+            self.powers.set(powers(record) for _, record in records())
+            self.ranks.set(record.rank for _, record in records())
+            self.bets.set((active_bets(record), key) for key, record in records())
+            self.drift_reports.append({'at': time.time(), 'drift': drift})
+            del self.drift_reports[:-MAX_DRIFT_REPORTS]
+        self.verifications += 1
+        self.last_verified = time.time()
+        self.last_verify_seconds = time.perf_counter() - start
+        return drift
+
+    def stats(self):
+        return {
+            'verifications': self.verifications,
+            'last_verified': self.last_verified,
+            'last_verify_seconds': self.last_verify_seconds,
+            'drift_reports': len(self.drift_reports),
+        }
+
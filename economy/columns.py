@@ -0,0 +1,218 @@
+"""Columnar storage for the users' numeric balances.
+
+``reiatsu``, ``soul_fragments``, ``level``, ``exp`` and ``battles_won`` of
+every resident user live in one contiguous int64 array per field, indexed
+by a per-user slot.  ``UserRecord`` reads and writes its slot through
+descriptors, so ``record['reiatsu']`` works as before, while whole-economy
+operations - mass grants, inflation, clamping, totals - run as a single
+vectorized pass over the arrays.
+
+NumPy is used when it is installed; otherwise the columns are stdlib
+``array('q')`` and the bulk operations fall back to Python loops with the
+same results.  Freed slots are zeroed and reused, so sums over the whole
+array are sums over live users.
+
+NumPy's in-place arithmetic wraps around silently on int64 overflow, so
+``set()`` and the bulk operations check their range first and raise
+``OverflowError`` with nothing changed; ``check_add()``/``check_scale()``
+do the same for the SQLite ``UPDATE`` equivalents.
+"""
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+COLUMN_FIELDS = ('reiatsu', 'soul_fragments', 'level', 'exp', 'battles_won')
+INITIAL_CAPACITY = 1024
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+
+def check_add(field, low, high, amount):
+    """Raise ``OverflowError`` if adding ``amount`` to values in [low, high] leaves int64."""
+    if low is None:
+        return  # no values
+    if high + amount > INT64_MAX or low + amount < INT64_MIN:
+        raise OverflowError(f"adding {amount:,} to {field} would overflow a balance")
+
+
+def check_scale(field, low, high, multiplier):
+    """Raise ``OverflowError`` if scaling values in [low, high] leaves int64."""
+    if low is None:
+        return
+    if max(abs(low), abs(high)) * abs(multiplier) > INT64_MAX:
+        raise OverflowError(f"scaling {field} by {multiplier:g} would overflow a balance")
+
+
+def _new_array(capacity):
+    if numpy is not None:
+        return numpy.zeros(capacity, dtype=numpy.int64)
+    return array('q', bytes(8 * capacity))
+
+
+class BalanceColumns:
+    """Typed arrays for ``COLUMN_FIELDS`` plus the slot allocator."""
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.capacity = capacity
+        self.arrays = {field: _new_array(capacity) for field in COLUMN_FIELDS}
+        self.size = 0  # high-water mark of used slots
+        self.free = []
+        self.live = 0
+        self._scratch = None  # float64 buffer reused by scale()
+
+    @property
+    def vectorized(self):
+        return numpy is not None
+
+    # Slots ----------------------------------------------------------------
+
+    def allocate(self):
+        if self.free:
+            slot = self.free.pop()
+        else:
+            if self.size == self.capacity:
+                self._grow()
+            slot = self.size
+            self.size += 1
+        self.live += 1
+        return slot
+
+    def release(self, slot):
+        for column in self.arrays.values():
+            column[slot] = 0
+        self.free.append(slot)
+        self.live -= 1
+
+    def _grow(self):
+        capacity = self.capacity * 2
+        for field, column in self.arrays.items():
+            if numpy is not None:
+                grown = numpy.zeros(capacity, dtype=numpy.int64)
+                grown[:self.capacity] = column
+            else:
+                grown = column
+                grown.extend(_new_array(self.capacity))
+            self.arrays[field] = grown
+        self.capacity = capacity
+
+    def get(self, field, slot):
+        return int(self.arrays[field][slot])
+
+    def set(self, field, slot, value):
+        if not INT64_MIN <= value <= INT64_MAX:
+            raise OverflowError(f"{field} value {value:,} is out of range")
+        self.arrays[field][slot] = value
+
+    def bounds(self, field):
+        """(lowest, highest) value of ``field`` over the used slots, ``(None, None)`` if none."""
+        if not self.size:
+            return None, None
+        view = self.arrays[field][:self.size]
+        if numpy is not None:
+            return int(view.min()), int(view.max())
+        return min(view), max(view)
+
+    def _rezero_free(self, fields):
+        if not self.free:
+            return
+        for field in fields:
+            column = self.arrays[field]
+            if numpy is not None:
+                column[self.free] = 0
+            else:
+                for slot in self.free:
+                    column[slot] = 0
+
+    # Bulk operations ------------------------------------------------------
+
+    def total(self, field):
+        column = self.arrays[field]
+        if numpy is not None:
+            return int(column[:self.size].sum())
+        return sum(column[:self.size]) if self.size else 0
+
+    def add(self, field, amount, floor=0):
+        """``value = max(floor, value + amount)`` for every live slot."""
+        check_add(field, *self.bounds(field), amount)
+        column = self.arrays[field]
+        if numpy is not None:
+            view = column[:self.size]
+            view += amount
+            if floor is not None:
+                numpy.maximum(view, floor, out=view)
+        else:
+            for slot in range(self.size):
+                value = column[slot] + amount
+                column[slot] = value if floor is None or value > floor else floor
+        self._rezero_free((field,))
+
+    def scale(self, field, multiplier):
+        """``value = int(value * multiplier)`` for every live slot."""
+        check_scale(field, *self.bounds(field), multiplier)
+        column = self.arrays[field]
+        if numpy is not None:
+            if self._scratch is None or len(self._scratch) < self.size:
+                self._scratch = numpy.empty(self.capacity, dtype=numpy.float64)
+            view = column[:self.size]
+            scratch = self._scratch[:self.size]
+            # float64 product truncated toward zero on the cast back, like int()
+            numpy.multiply(view, multiplier, out=scratch)
+            view[:] = scratch
+        else:
+            for slot in range(self.size):
+                column[slot] = int(column[slot] * multiplier)
+        self._rezero_free((field,))
+
+    def stats(self):
+        return {
+            'column_slots': self.size,
+            'column_live': self.live,
+            'column_capacity': self.capacity,
+            'column_bytes': self.capacity * 8 * len(self.arrays),
+            'column_backend': 'numpy' if numpy is not None else 'array',
+        }
+
+    def check(self, op):
+        """Raise ``OverflowError`` if ``op`` would take a value out of int64."""
+        if op['op'] == 'add':
+            check_add(op['field'], *self.bounds(op['field']), op['amount'])
+        else:
+            check_scale(op['field'], *self.bounds(op['field']), op['multiplier'])
+
+    def apply(self, op):
+        """Apply a bulk operation (see ``add_op``/``scale_op``)."""
+        if op['op'] == 'add':
+            self.add(op['field'], op['amount'], op['floor'])
+        else:
+            self.scale(op['field'], op['multiplier'])
+
+
+# Bulk operations are also persisted as-is (one journal record or UPDATE
+# instead of one change per user), so they are plain dicts.
+
+def add_op(field, amount, floor=0):
+    return {'op': 'add', 'field': field, 'amount': amount, 'floor': floor}
+
+
+def scale_op(field, multiplier):
+    return {'op': 'scale', 'field': field, 'multiplier': multiplier}
+
+
+def apply_op(value, op):
+    """Result of ``op`` on one value; matches ``BalanceColumns`` exactly."""
+    if op['op'] == 'add':
+        value += op['amount']
+        floor = op['floor']
+        return value if floor is None or value > floor else floor
+    return int(value * op['multiplier'])
+
+
+def apply_bulk_op(users, op):
+    """Apply ``op`` to every record of a plain ``{user_id: dict}`` table."""
+    field = op['field']
+    for record in users.values():
+        if field in record:
+            record[field] = apply_op(record[field], op)
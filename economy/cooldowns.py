@@ -0,0 +1,214 @@
+"""Command cooldowns and cooldown-ready reminders.
+
+Cooldowns are read straight from the user record: ``UserRecord`` keeps
+``last_daily``/``last_work``/``last_train`` as epoch seconds in its slots
+(the compact per-(user, action) table), so "ready / seconds left" is one
+subtraction - no ISO parsing, and the durations live in ``COOLDOWNS`` only.
+
+Users who opt in with ``!remind`` get a ping when ``!daily`` or ``!work``
+comes off cooldown.  Pending reminders sit in a hierarchical ``TimerWheel``
+(64 one-second slots, then 64 slots of 64 s, and so on): scheduling and
+cancelling are O(1), and ``CooldownEngine.run()`` sleeps until the next
+occupied slot or cascade instead of polling every user.
+"""
+import asyncio
+import math
+import time
+
+COOLDOWNS = {'daily': 86400, 'work': 3600, 'train': 1800}
+# A daily claimed within this long of the previous one keeps the streak
+STREAK_WINDOW = 172800
+REMINDABLE = ('daily', 'work')
+# Extra field on the user record, persisted with it
+REMINDER_FIELD = 'reminders'
+
+
+class TimerWheel:
+    """Hierarchical timing wheel keyed by timer id, 1 s resolution.
+
+    Level ``l`` has ``2**slot_bits`` slots of ``2**(slot_bits*l)`` seconds;
+    a timer sits in the lowest level whose span covers its delay and drops
+    a level each time the wheel below wraps.  Cancelled or rescheduled
+    timers are left in their old bucket and skipped when it is reached.
+    """
+
+    def __init__(self, now, slot_bits=6, levels=4):
+        self.bits = slot_bits
+        self.mask = (1 << slot_bits) - 1
+        self.levels = levels
+        self.wheels = [[[] for _ in range(1 << slot_bits)] for _ in range(levels)]
+        self.overflow = []  # beyond the top level's span
+        self.due = []  # already expired when scheduled
+        self.tick = int(now)
+        self.timers = {}  # key -> (deadline tick, payload)
+
+    def __len__(self):
+        return len(self.timers)
+
+    def schedule(self, key, deadline, payload=None, now=None):
+        deadline = int(math.ceil(deadline))
+        if not self.timers and now is not None:
+            # Nothing to cascade; skip the idle ticks
+            self.tick = max(self.tick, int(now))
+        self.timers[key] = (deadline, payload)
+        self._place(key, deadline)
+
+    def cancel(self, key):
+        return self.timers.pop(key, None) is not None
+
+    def _place(self, key, deadline):
+        delta = deadline - self.tick
+        if delta <= 0:
+            self.due.append(key)
+            return
+        for level in range(self.levels):
+            if delta < 1 << (self.bits * (level + 1)):
+                self.wheels[level][(deadline >> (self.bits * level)) & self.mask].append(key)
+                return
+        self.overflow.append(key)
+
+    def _live(self, key):
+        entry = self.timers.get(key)
+        return entry is not None and entry[0] > self.tick
+
+    def advance(self, now):
+        """Move to ``now``; returns ``[(key, payload)]`` of expired timers."""
+        fired = []
+        target = int(now)
+        while True:
+            for key in self.due:
+                entry = self.timers.get(key)
+                if entry is not None and entry[0] <= self.tick:
+                    del self.timers[key]
+                    fired.append((key, entry[1]))
+            self.due = []
+            if self.tick >= target:
+                return fired
+            self.tick += 1
+            tick = self.tick
+            # Cascade from the top so timers can drop several levels at once
+            for level in range(self.levels - 1, 0, -1):
+                if tick & ((1 << (self.bits * level)) - 1):
+                    continue
+                if level == self.levels - 1:
+                    bucket, self.overflow = self.overflow, []
+                    self._replace(bucket)
+                slot = (tick >> (self.bits * level)) & self.mask
+                bucket, self.wheels[level][slot] = self.wheels[level][slot], []
+                self._replace(bucket)
+            slot = tick & self.mask
+            self.due.extend(self.wheels[0][slot])
+            self.wheels[0][slot] = []
+
+    def _replace(self, keys):
+        for key in keys:
+            entry = self.timers.get(key)
+            if entry is not None:
+                self._place(key, entry[0])
+
+    def next_wakeup(self):
+        """Earliest tick at which ``advance()`` may fire something, or None."""
+        if not self.timers:
+            return None
+        if self.due:
+            return self.tick
+        wakeup = None
+        for offset in range(1, self.mask + 2):
+            if any(self._live(key) for key in self.wheels[0][(self.tick + offset) & self.mask]):
+                wakeup = self.tick + offset
+                break
+        if self.overflow or any(any(wheel) for wheel in self.wheels[1:]):
+            # Longer timers may drop into level 0 at the next cascade
+            cascade = ((self.tick >> self.bits) + 1) << self.bits
+            wakeup = cascade if wakeup is None else min(wakeup, cascade)
+        return wakeup
+
+
+class CooldownEngine:
+    """Cooldown checks on user records plus the reminder wheel."""
+
+    def __init__(self, durations=None, clock=time.time):
+        self.durations = dict(COOLDOWNS if durations is None else durations)
+        self.clock = clock
+        self.wheel = TimerWheel(clock())
+        # Coroutine function called as on_ready(user_id, action)
+        self.on_ready = None
+        self._wake = asyncio.Event()
+        self.reminders_sent = 0
+
+    def remaining(self, record, action, now=None):
+        """Whole seconds until ``action`` is available again (0 = ready)."""
+        last = getattr(record, f'last_{action}')
+        if last is None:
+            return 0
+        now = self.clock() if now is None else now
+        return max(0, math.ceil(last + self.durations[action] - now))
+
+    def since(self, record, action, now=None):
+        """Seconds since ``action`` was last used, or None."""
+        last = getattr(record, f'last_{action}')
+        if last is None:
+            return None
+        return (self.clock() if now is None else now) - last
+
+    def use(self, user_id, record, action, now=None):
+        """Start the cooldown (and the reminder, if the user opted in)."""
+        now = int(self.clock() if now is None else now)
+        record[f'last_{action}'] = now
+        if action in REMINDABLE and record.get(REMINDER_FIELD):
+            self._schedule(user_id, action, now + self.durations[action])
+
+    def reset(self, user_id, record):
+        for action in self.durations:
+            record[f'last_{action}'] = None
+            self.wheel.cancel((user_id, action))
+
+    # Reminders ------------------------------------------------------------
+
+    def set_reminders(self, user_id, record, enabled):
+        if enabled:
+            record[REMINDER_FIELD] = True
+            self.restore_user(user_id, record)
+        else:
+            record.pop(REMINDER_FIELD, None)
+            for action in REMINDABLE:
+                self.wheel.cancel((user_id, action))
+
+    def restore_user(self, user_id, record):
+        now = self.clock()
+        for action in REMINDABLE:
+            if self.remaining(record, action, now):
+                self._schedule(user_id, action, getattr(record, f'last_{action}') + self.durations[action])
+
+    def restore(self, records):
+        """Re-arm reminders of opted-in users after a restart."""
+        for user_id, record in records:
+            if record.get(REMINDER_FIELD):
+                self.restore_user(user_id, record)
+
+    def _schedule(self, user_id, action, deadline):
+        self.wheel.schedule((user_id, action), deadline, now=self.clock())
+        self._wake.set()
+
+    async def run(self):
+        """Fire reminders as cooldowns expire; runs for the bot's lifetime."""
+        while True:
+            for (user_id, action), _ in self.wheel.advance(self.clock()):
+                try:
+                    await self.on_ready(user_id, action)
+                    self.reminders_sent += 1
+                except Exception as error:
+                    print(f"Cooldown reminder for {user_id} failed: {error}")
+            wakeup = self.wheel.next_wakeup()
+            timeout = None if wakeup is None else max(0.0, wakeup - self.clock())
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self):
+        return {
+            'pending_reminders': len(self.wheel),
+            'reminders_sent': self.reminders_sent,
+        }
@@ -0,0 +1,67 @@
+"""Prebuilt embeds for views that rarely change.
+
+``!help``, ``!adminhelp``, ``!shop``, ``!shopmanage``, ``!offers`` and
+``!history`` used to build their embed field by field (and regroup the
+shop by category) on every call.  ``EmbedCache`` keeps the built value per
+view and builds again only when the view's version has moved on: static
+views are never invalidated, data-driven ones are invalidated by the
+commands that change their data (``!additem``, ``!edititem``,
+``!newoffer``, ``!result``...).
+
+Values are built by a callable and shared between calls, so callers must
+not modify a cached embed.  A randomized footer is handled by building one
+embed per footer up front and picking one with ``pick()``.
+"""
+import random
+
+
+class EmbedCache:
+    """view -> built value, rebuilt when ``invalidate(view)`` was called."""
+
+    def __init__(self):
+        self.versions = {}
+        # (view, variant) -> (version, value)
+        self.entries = {}
+        self.hits = 0
+        self.builds = 0
+
+    def version(self, view):
+        return self.versions.get(view, 0)
+
+    def invalidate(self, *views):
+        for view in views:
+            self.versions[view] = self.versions.get(view, 0) + 1
+
+    def clear(self):
+        """Invalidate every view (e.g. after the tables were reloaded)."""
+        for view, _ in list(self.entries):
+            self.invalidate(view)
+        self.entries.clear()
+
+    def get(self, view, build, variant=None):
+        """Cached ``build()`` for ``view``.
+
+        ``variant`` separates versions of one view that differ by caller,
+        e.g. the admin and member ``!help``; they share the view's version.
+        """
+        key = (view, variant)
+        version = self.versions.get(view, 0)
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != version:
+            entry = (version, build())
+            self.entries[key] = entry
+            self.builds += 1
+        else:
+            self.hits += 1
+        return entry[1]
+
+    def pick(self, view, build, variant=None):
+        """Random one of the prebuilt variants ``build()`` returns."""
+        return random.choice(self.get(view, build, variant))
+
+    def stats(self):
+        return {
+            'views': len(self.entries),
+            'hits': self.hits,
+            'builds': self.builds,
+        }
@@ -0,0 +1,277 @@
+"""Append-only journal with snapshot compaction.
+
+Each flush appends one compact JSON line per changed path::
+
+    [seq, ts_ms, table, path, value]    # set path to value
+    [seq, ts_ms, table, path]           # delete path
+    [seq, ts_ms, table, ["*"], op]      # bulk op on every record (economy/columns.py)
+
+so a balance change, a placed bet, a settled offer or a shop edit costs a
+few dozen bytes instead of a rewrite of the whole economy.  A flush writes
+its batch with a single fsync and ends it with a commit marker::
+
+    ["commit", first_seq, count]
+
+Records go to numbered segment files ``<base>.<first_seq>.log``, each
+starting with a ``{"format": 2}`` header.  When the live segments grow past
+``compact_bytes`` the worker folds the state into a snapshot
+(``journal_seq`` records the last sequence it covers), atomically renames
+it into place and drops the segments it made redundant.  Loading is
+snapshot + every record with a later sequence number, one whole batch at a
+time: records after the last commit marker of a segment (a batch a crash
+cut short) are discarded, so a flush is replayed completely or not at
+all.  Segments written before the framing have no header and are replayed
+record by record up to a torn line.
+
+Point-in-time recovery::
+
+    python -m economy.journal recover --until 2025-06-05T10:00:00 --out recovered.json
+"""
+import argparse
+import contextlib
+import glob
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+
+from economy.columns import apply_bulk_op
+from economy.persistence import TABLES, fsync_dir, read_json, write_atomic
+from economy.snapshot import encode_state, json_default
+from economy.tracking import MISSING, snapshot_tables
+
+
+def segment_paths(base):
+    """Journal segments for ``base`` in sequence order."""
+    paths = glob.glob(f"{glob.escape(base)}.*.log")
+    return sorted(paths, key=lambda p: int(p[len(base) + 1:-4]))
+
+
+SEGMENT_HEADER = b'{"format":2}\n'
+
+
+def iter_records(paths):
+    """Records of every completely written batch, in order."""
+    for path in paths:
+        with open(path, 'rb') as f:
+            framed = False
+            batch = []
+            for number, line in enumerate(f):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn tail from a crash mid-append; nothing valid follows it
+                    print(f"Journal: ignoring torn record at end of {path}")
+                    break
+                if number == 0 and isinstance(record, dict):
+                    framed = True
+                elif not framed:
+                    yield record
+                elif record[0] != 'commit':
+                    batch.append(record)
+                elif batch and batch[0][0] == record[1] and len(batch) == record[2]:
+                    yield from batch
+                    batch = []
+                else:
+                    print(f"Journal: batch at seq {record[1]} in {path} is incomplete; ignoring the rest")
+                    batch = []
+                    break
+            if batch:
+                print(f"Journal: discarding {len(batch)} uncommitted records at end of {path}")
+
+
+def apply_record(state, record):
+    """Apply one journal record to plain-dict ``state`` in place."""
+    table, path = record[2], record[3]
+    node = state.setdefault(table, {})
+    if path == ['*']:
+        apply_bulk_op(node, record[4])
+        return
+    for key in path[:-1]:
+        child = node.get(key)
+        if not isinstance(child, dict):
+            if len(record) == 4:
+                return
+            child = node[key] = {}
+        node = child
+    if len(record) == 4:
+        node.pop(path[-1], None)
+    else:
+        node[path[-1]] = record[4]
+
+
+def replay(snapshot, paths, until_ms=None):
+    """Fold journal records newer than ``snapshot`` into it and return the state."""
+    state = snapshot
+    base_seq = state.pop('journal_seq', 0)
+    last_seq = base_seq
+    for record in iter_records(paths):
+        if record[0] <= base_seq:
+            continue
+        if until_ms is not None and record[1] > until_ms:
+            break
+        apply_record(state, record)
+        last_seq = record[0]
+    state['journal_seq'] = last_seq
+    return state
+
+
+class JournalBackend:
+    """Snapshot file plus append-only journal segments."""
+
+    name = 'journal'
+
+    def __init__(self, snapshot_path, base=None, compact_bytes=16 * 1024 * 1024, archive_dir=None,
+                 snapshot_format='json', compression='none'):
+        self.snapshot_path = snapshot_path
+        self.snapshot_format = snapshot_format
+        self.compression = compression
+        self.base = base or os.path.splitext(snapshot_path)[0] + '_journal'
+        self.compact_bytes = compact_bytes
+        self.archive_dir = archive_dir
+        self.seq = 0
+        self._pending_bytes = 0
+        self._segment = None
+        self._segment_path = None
+
+        self.records_written = 0
+        self.compactions = 0
+        self.last_compaction_ms = 0.0
+
+    def load(self):
+        state = replay(read_json(self.snapshot_path), segment_paths(self.base))
+        self.seq = state.pop('journal_seq')
+        # Existing segments may end in a torn line, so never append to them
+        self._pending_bytes = sum(os.path.getsize(p) for p in segment_paths(self.base))
+        return state
+
+    def prepare(self, tables, force_snapshot=False):
+        ts = int(time.time() * 1000)
+        lines = []
+        for name, table in tables.items():
+            # Bulk ops first: the path records below carry final values
+            for op in table.drain_bulk():
+                self.seq += 1
+                lines.append(json.dumps([self.seq, ts, name, ['*'], op], separators=(',', ':')))
+            for path in table.drain():
+                self.seq += 1
+                value = table.resolve(path)
+                if value is MISSING:
+                    record = [self.seq, ts, name, list(path)]
+                else:
+                    record = [self.seq, ts, name, list(path), value]
+                lines.append(json.dumps(record, separators=(',', ':'), default=json_default))
+        job = {}
+        if lines:
+            first_seq = self.seq - len(lines) + 1
+            lines.append(json.dumps(['commit', first_seq, len(lines)]))
+            payload = ('\n'.join(lines) + '\n').encode('utf-8')
+            self._pending_bytes += len(payload)
+            job['journal'] = payload
+            job['first_seq'] = first_seq
+            job['records'] = len(lines) - 1
+        if force_snapshot or self._pending_bytes >= self.compact_bytes:
+            if self._pending_bytes or not os.path.exists(self.snapshot_path):
+                job['snapshot'] = snapshot_tables(tables)
+                job['seq'] = self.seq
+                self._pending_bytes = 0
+        return job or None
+
+    def commit(self, job):
+        written = 0
+        if 'journal' in job:
+            if self._segment is None:
+                self._segment_path = f"{self.base}.{job['first_seq']:012d}.log"
+                # A file already named so can only hold a batch that never
+                # committed: its sequence numbers were handed out again
+                self._segment = open(self._segment_path, 'wb')
+                self._segment.write(SEGMENT_HEADER)
+            try:
+                self._segment.write(job['journal'])
+                self._segment.flush()
+                os.fsync(self._segment.fileno())
+            except BaseException:
+                # Whatever part of the batch got out stays uncommitted; the
+                # engine retries the job into a fresh segment
+                with contextlib.suppress(OSError):
+                    self._segment.close()
+                self._segment = None
+                raise
+            written += len(job['journal'])
+            self.records_written += job['records']
+        if 'snapshot' in job:
+            written += self._compact(job['snapshot'], job['seq'])
+        return written
+
+    def _compact(self, snapshot, seq):
+        start = time.perf_counter()
+        # Everything journaled so far is <= seq; later records start a new segment
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+        stale = segment_paths(self.base)
+        snapshot['journal_seq'] = seq
+        written = write_atomic(self.snapshot_path, encode_state(snapshot, self.snapshot_format, self.compression))
+        for path in stale:
+            if self.archive_dir:
+                os.makedirs(self.archive_dir, exist_ok=True)
+                shutil.move(path, os.path.join(self.archive_dir, os.path.basename(path)))
+            else:
+                os.remove(path)
+        fsync_dir(self.snapshot_path)
+        self.compactions += 1
+        self.last_compaction_ms = (time.perf_counter() - start) * 1000
+        return written
+
+    def stats(self):
+        return {
+            'journal_seq': self.seq,
+            'journal_records': self.records_written,
+            'journal_pending_bytes': self._pending_bytes,
+            'compactions': self.compactions,
+            'last_compaction_ms': self.last_compaction_ms,
+        }
+
+
+def recover(snapshot_path, base, until=None, archive_dir=None, base_snapshot=None):
+    """Rebuild the economy as of ``until`` (a datetime, or None for latest).
+
+    Archived segments are only useful together with an older ``base_snapshot``
+    (or none at all, which replays from an empty economy).
+    """
+    paths = segment_paths(base)
+    if archive_dir:
+        paths = segment_paths(os.path.join(archive_dir, os.path.basename(base))) + paths
+        snapshot = read_json(base_snapshot) if base_snapshot else {}
+    else:
+        snapshot = read_json(base_snapshot or snapshot_path)
+    until_ms = int(until.timestamp() * 1000) if until else None
+    state = replay(snapshot, paths, until_ms)
+    for name in TABLES:
+        state.setdefault(name, {})
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soul Society economy journal tools")
+    sub = parser.add_subparsers(dest='command', required=True)
+    rec = sub.add_parser('recover', help="Rebuild the economy state at a point in time")
+    rec.add_argument('--snapshot', default='economy_data.json')
+    rec.add_argument('--base', default=None, help="Journal base name (default <snapshot>_journal)")
+    rec.add_argument('--archive', default=None, help="Directory with archived segments")
+    rec.add_argument('--from-snapshot', default=None, help="Older snapshot to replay archived segments onto")
+    rec.add_argument('--until', default=None, help="ISO timestamp to stop at (local time)")
+    rec.add_argument('--out', default='economy_recovered.json')
+    args = parser.parse_args()
+
+    base = args.base or os.path.splitext(args.snapshot)[0] + '_journal'
+    until = datetime.fromisoformat(args.until) if args.until else None
+    state = recover(args.snapshot, base, until, args.archive, args.from_snapshot)
+    with open(args.out, 'w') as f:
+        json.dump(state, f, indent=2)
+    print(f"Recovered {len(state['user_data'])} users up to journal seq {state['journal_seq']} -> {args.out}")
+
+
+if __name__ == '__main__':
+    main()
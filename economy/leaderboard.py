@@ -0,0 +1,295 @@
+"""Leaderboard indexes kept current as user fields change.
+
+A leaderboard ``Metric`` is a user field, or a value derived from several
+fields (battle power), that ``UserRepository`` recomputes whenever one of
+those fields is written and feeds to the metric's index.  Entries are
+``(-value, user_id)`` so the natural sort order is best first with ties
+broken by user id.
+
+``OrderIndex`` holds every user: a sorted list split into blocks of a few
+hundred (the layout sortedcontainers uses), so insert/remove cost a bisect
+plus a short ``list.insert`` in one block and a user's position is a bisect
+inside their block plus the sizes of the blocks before it.  It backs
+``!rank``.
+
+``TopK`` holds only the best ``size`` users and a bound that every user
+outside it is known to be at or below.  Updates are O(log size); the set is
+rebuilt with one scan only when a leaderboard is requested deeper than the
+entries known to beat that bound, i.e. when a user evicted earlier could
+have climbed back in.  The scan can also run elsewhere - on the storage
+worker for a lazy repository - between ``begin_rebuild()`` and
+``finish_rebuild()``; changes made meanwhile are recorded and applied on
+top of its result.
+"""
+import heapq
+from bisect import bisect_left, bisect_right, insort
+from itertools import accumulate, islice
+
+from economy.columns import apply_op
+
+BLOCK_SIZE = 512
+
+
+class Metric:
+    """A leaderboard value: ``value(record)``, recomputed when ``fields`` change."""
+
+    __slots__ = ('name', 'value', 'fields', 'plain', 'index')
+
+    def __init__(self, name, value, fields, plain, index=None):
+        self.name = name
+        self.value = value
+        self.fields = fields
+        # Plain metrics are a single field, so bulk ops can be applied to the index
+        self.plain = plain
+        self.index = index
+
+
+class OrderIndex:
+    """Sorted ``(-value, user_id)`` entries with rank lookup.
+
+    ``source`` returns every ``(value, user_id)``; it is scanned to build
+    the index and again only after ``bulk_changed()`` without an op.
+    """
+
+    def __init__(self, source=None, entries=(), block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self.source = source
+        self._stale = source is not None
+        if source is None:
+            self._load(entries)
+        else:
+            self._fresh()
+
+    def _load(self, entries):
+        entries = sorted(entries)
+        size = self.block_size
+        self._blocks = [entries[i:i + size] for i in range(0, len(entries), size)]
+        self._maxes = [block[-1] for block in self._blocks]
+        self._offsets = None
+        self._len = len(entries)
+        self._stale = False
+
+    def __len__(self):
+        self._fresh()
+        return self._len
+
+    def _fresh(self):
+        if self._stale:
+            self._load((-value, key) for value, key in self.source())
+
+    # Metric index interface ---------------------------------------------
+
+    def insert(self, key, value):
+        if not self._stale:
+            self.add((-value, key))
+
+    def remove(self, key, value):
+        if not self._stale:
+            self.discard((-value, key))
+
+    def move(self, key, old, new):
+        if not self._stale:
+            self.discard((-old, key))
+            self.add((-new, key))
+
+    def keys(self, count):
+        """User ids of the best ``count`` entries."""
+        self._fresh()
+        return [key for _, key in self.head(count)]
+
+    def rank(self, key, value):
+        """0-based position of ``key`` at ``value``."""
+        self._fresh()
+        return self.position((-value, key))
+
+    def bulk_changed(self, op=None):
+        """Every value changed by ``op`` (economy/columns.py), or unknown."""
+        if op is None or self._stale:
+            self._stale = True
+            return
+        # add/scale are monotonic: the order holds up to new ties (or is
+        # reversed by a negative multiplier), so timsort is close to linear
+        self._load((-apply_op(-value, op), key) for value, key in self)
+
+    # Sorted list ----------------------------------------------------------
+
+    def add(self, entry):
+        if not self._blocks:
+            self._blocks.append([entry])
+            self._maxes.append(entry)
+        else:
+            pos = bisect_left(self._maxes, entry)
+            if pos == len(self._maxes):
+                pos -= 1
+                self._blocks[pos].append(entry)
+                self._maxes[pos] = entry
+            else:
+                insort(self._blocks[pos], entry)
+            if len(self._blocks[pos]) > 2 * self.block_size:
+                block = self._blocks[pos]
+                half = len(block) // 2
+                self._blocks[pos:pos + 1] = [block[:half], block[half:]]
+                self._maxes[pos:pos + 1] = [block[half - 1], block[-1]]
+        self._len += 1
+        self._offsets = None
+
+    def discard(self, entry):
+        pos = bisect_left(self._maxes, entry)
+        if pos == len(self._maxes):
+            return False
+        block = self._blocks[pos]
+        i = bisect_left(block, entry)
+        if i == len(block) or block[i] != entry:
+            return False
+        del block[i]
+        if not block:
+            del self._blocks[pos]
+            del self._maxes[pos]
+        elif i == len(block):
+            self._maxes[pos] = block[-1]
+        self._len -= 1
+        self._offsets = None
+        return True
+
+    def position(self, entry):
+        """0-based position of ``entry`` (or where it would go)."""
+        if not self._blocks:
+            return 0
+        if self._offsets is None:
+            self._offsets = [0] + list(accumulate(len(block) for block in self._blocks))
+        pos = bisect_left(self._maxes, entry)
+        if pos == len(self._maxes):
+            return self._len
+        return self._offsets[pos] + bisect_left(self._blocks[pos], entry)
+
+    def head(self, count):
+        """First ``count`` entries in order."""
+        result = []
+        for block in self._blocks:
+            if len(result) >= count:
+                break
+            result.extend(islice(block, count - len(result)))
+        return result
+
+    def __iter__(self):
+        for block in self._blocks:
+            yield from block
+
+    def __contains__(self, entry):
+        pos = bisect_left(self._maxes, entry)
+        if pos == len(self._maxes):
+            return False
+        block = self._blocks[pos]
+        i = bisect_right(block, entry)
+        return i > 0 and block[i - 1] == entry
+
+
+def best_entries(size, pairs):
+    """The ``size + 1`` best ``(-value, user_id)`` of ``(value, user_id)`` pairs: a ``TopK`` scan."""
+    return heapq.nsmallest(size + 1, ((-value, key) for value, key in pairs))
+
+
+class TopK:
+    """The best ``size`` entries plus a bound on everyone else; see module doc."""
+
+    def __init__(self, size, source):
+        self.size = size
+        self.source = source
+        self._entries = []  # sorted (-value, user_id)
+        self._members = {}  # user_id -> entry
+        # Best entry that may be outside the set; None when nobody is
+        self._bound = None
+        self._stale = True
+        # user_id -> new value (None: removed) while a scan runs elsewhere;
+        # None when no scan runs or a bulk change voided it
+        self._changes = None
+        self.rebuilds = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def rebuild(self):
+        self._install(best_entries(self.size, self.source()))
+
+    def _install(self, best):
+        self._entries = best[:self.size]
+        self._members = {entry[1]: entry for entry in self._entries}
+        self._bound = best[self.size] if len(best) > self.size else None
+        self._stale = False
+        self.rebuilds += 1
+
+    def begin_rebuild(self):
+        """Record changes from now on for ``finish_rebuild()``."""
+        self._changes = {}
+
+    def finish_rebuild(self, best):
+        """Install ``best_entries()`` of a scan started after ``begin_rebuild()``."""
+        changes, self._changes = self._changes, None
+        if changes is None:
+            return  # a bulk change made the scan stale too
+        self._install(best)
+        for key, value in changes.items():
+            self._drop(key)
+            if value is not None:
+                self._offer((-value, key))
+
+    def abort_rebuild(self):
+        self._changes = None
+
+    def needs_rebuild(self, count):
+        """Whether ``keys(count)`` would have to scan first."""
+        if self._stale:
+            return True
+        if count <= len(self._entries):
+            return self._bound is not None and not self._entries[count - 1] < self._bound
+        return self._bound is not None
+
+    def _offer(self, entry):
+        if self._bound is not None and entry >= self._bound:
+            return  # outsiders stay at or below the bound
+        insort(self._entries, entry)
+        self._members[entry[1]] = entry
+        if len(self._entries) > self.size:
+            evicted = self._entries.pop()
+            del self._members[evicted[1]]
+            if self._bound is None or evicted < self._bound:
+                self._bound = evicted
+
+    def _drop(self, key):
+        entry = self._members.pop(key, None)
+        if entry is not None:
+            del self._entries[bisect_left(self._entries, entry)]
+
+    def insert(self, key, value):
+        if self._changes is not None:
+            self._changes[key] = value
+        if not self._stale:
+            # A lazy repository can replace a user it doesn't hold, so the
+            # key may already be a member
+            self._drop(key)
+            self._offer((-value, key))
+
+    def remove(self, key, value):
+        if self._changes is not None:
+            self._changes[key] = None
+        if not self._stale:
+            self._drop(key)
+
+    def move(self, key, old, new):
+        if self._changes is not None:
+            self._changes[key] = new
+        if not self._stale:
+            self._drop(key)
+            self._offer((-new, key))
+
+    def keys(self, count):
+        """User ids of the best ``count`` users (``count`` <= ``size``)."""
+        if self.needs_rebuild(count):
+            # Stale, or a member dropped or left and someone outside may now rank higher
+            self._stale = True
+            self.rebuild()
+        return [key for _, key in self._entries[:count]]
+
+    def bulk_changed(self, op=None):
+        self._stale = True
+        self._changes = None
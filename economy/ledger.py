@@ -0,0 +1,342 @@
+"""Append-only double-entry ledger of every currency movement.
+
+Each posting moves ``amount`` of one currency from a ``source`` account to
+a ``dest`` account for a ``reason``::
+
+    (seq, ts, reason, currency, source, dest, amount, ref)
+
+Users are accounts under their id; the rest of the economy is a handful of
+system accounts (``MINT`` for rewards and admin grants, ``FEES``,
+``HOUSE`` for betting profit and losses, ``SHOP``, one escrow account per
+betting offer) and ``ALL_USERS`` for bulk operations, which are recorded as
+one posting with the total instead of one per user.  Every posting debits
+one account and credits another by the same amount, so the ledger always
+balances; a user's net flow is the change in their balance since the
+ledger started (or since they joined).
+
+``post()`` only appends a tuple to an in-memory buffer and updates the
+indexes - a few microseconds, cheap enough for every command.  The buffer
+is handed over by ``prepare()`` and encoded and written as JSON lines by
+``commit()`` on the persistence worker: the ``PersistenceEngine`` runs the
+ledger as an extra writer before each flush of the economy state, one
+append with one fsync per batch.
+
+The reader keeps, per posting, its file offset and timestamp, and per
+account and per reason the list of sequence numbers - a few dozen bytes per
+posting.  A posting is read back from the recent in-memory tail or with a
+single ``pread`` at its offset, so ``history()`` and ``audit()`` touch only
+the postings they return.
+
+The file is written in segments so that startup doesn't have to index the
+whole history.  Once the active segment reaches ``segment_bytes``, the
+flush that crosses it also writes a checkpoint (``<path>.checkpoint``,
+atomically): the last sequence number it covers and every account's net
+amount at that point.  Later postings go to a new segment named after its
+first sequence number (``<path>.000000123457``); the first segment is
+``path`` itself.  ``load()`` starts from the checkpoint and indexes only
+the segments after it, so ``balance()`` still covers the whole ledger
+while ``history()``, ``select()`` and ``audit()`` reach back to the
+checkpoint the process started from.  Older segments stay on disk,
+untouched, for offline audits.
+"""
+import json
+import os
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from operator import itemgetter
+
+from economy.persistence import write_atomic
+
+MINT = '@mint'
+FEES = '@fees'
+HOUSE = '@house'
+SHOP = '@shop'
+ALL_USERS = '*'
+# Postings kept in memory after they were written
+RECENT_POSTINGS = 4096
+# Size at which the active segment is checkpointed and a new one started
+SEGMENT_BYTES = 64 * 1024 * 1024
+
+Posting = namedtuple('Posting', 'seq ts reason currency source dest amount ref')
+
+
+def escrow(match_id):
+    """Account holding the stakes of a betting offer until it settles."""
+    return f'@bet:{match_id}'
+
+
+def is_user(account):
+    return not account.startswith('@') and account != ALL_USERS
+
+
+def segment_path(path, first_seq):
+    return f'{path}.{first_seq:012d}'
+
+
+class Ledger:
+    """Buffered appender plus indexed reader over one ledger file."""
+
+    def __init__(self, path=None, clock=time.time, recent=RECENT_POSTINGS, segment_bytes=SEGMENT_BYTES):
+        self.path = path
+        self.clock = clock
+        self.recent_size = recent
+        self.segment_bytes = segment_bytes
+        self.seq = 0
+        # Last posting of the checkpoint loaded at startup: summed into
+        # ``net`` but not indexed
+        self.base = 0
+        # offsets[seq - base - 1] is where posting ``seq`` starts in the
+        # segments laid end to end; offsets[seq - base] ends it
+        self.offsets = array('q', [0])
+        # (first seq, start in that layout, file) per segment, oldest first;
+        # the last one is appended to
+        self.segments = [(1, 0, path)] if path is not None else []
+        self.times = array('d')
+        self.by_account = {}
+        self.by_reason = {}
+        # (account, currency) -> net amount received
+        self.net = {}
+        self.buffer = []  # not yet handed to prepare()
+        self.recent = []  # newest postings, in seq order
+        self.recent_first = 1
+        self.written = 0  # last seq known to be on disk
+        self._fds = {}
+
+        self.batches = 0
+        self.bytes_written = 0
+        self.checkpoints = 0
+
+    # Writing --------------------------------------------------------------
+
+    def post(self, reason, source, dest, amount, currency='reiatsu', ref=None):
+        """Record ``amount`` moving from ``source`` to ``dest``; returns the seq.
+
+        A negative amount is recorded as the positive reverse movement and a
+        zero amount is not recorded (returns None).
+        """
+        if amount < 0:
+            source, dest, amount = dest, source, -amount
+        elif not amount:
+            return None
+        self.seq = seq = self.seq + 1
+        ts = self.clock()
+        if self.times and ts < self.times[-1]:
+            ts = self.times[-1]  # keep time order for range queries
+        posting = (seq, ts, reason, currency, source, dest, amount, ref)
+        self.buffer.append(posting)
+        self.recent.append(posting)
+        self._index(posting)
+        return seq
+
+    def _index(self, posting):
+        seq, ts, reason, currency, source, dest, amount = posting[:7]
+        self.times.append(ts)
+        for account in (source, dest):
+            seqs = self.by_account.get(account)
+            if seqs is None:
+                seqs = self.by_account[account] = array('L')
+            seqs.append(seq)
+        seqs = self.by_reason.get(reason)
+        if seqs is None:
+            seqs = self.by_reason[reason] = array('L')
+        seqs.append(seq)
+        net = self.net
+        net[source, currency] = net.get((source, currency), 0) - amount
+        net[dest, currency] = net.get((dest, currency), 0) + amount
+
+    def prepare(self):
+        """Hand the buffered postings to the writer (loop thread); None when empty.
+
+        Returns ``(postings, checkpoint)``; ``checkpoint`` is set when the
+        active segment is full and holds ``net`` as of the batch's last
+        posting (a dict copy, the encoding is left to the worker).
+        """
+        if not self.buffer:
+            return None
+        postings = self.buffer
+        self.buffer = []
+        self._trim()
+        checkpoint = None
+        if self.path is not None and self.segment_bytes and self._active_size() >= self.segment_bytes:
+            checkpoint = {'net': dict(self.net), 'reasons': list(self.by_reason)}
+        return postings, checkpoint
+
+    def commit(self, job):
+        """Encode and append one batch, then checkpoint if asked (worker thread); safe to retry."""
+        postings, checkpoint = job
+        last = postings[-1][0]
+        written = 0
+        if last > self.written:  # a failed attempt may have got past the append
+            lines = [json.dumps(posting, separators=(',', ':')).encode('utf-8') + b'\n' for posting in postings]
+            payload = b''.join(lines)
+            if self.path is not None:
+                with open(self.segments[-1][2], 'ab') as f:
+                    # Drop whatever a failed attempt left behind
+                    f.truncate(self._active_size())
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+            # Only this thread appends offsets; readers use the ones below ``written``
+            end = self.offsets[-1]
+            for line in lines:
+                end += len(line)
+                self.offsets.append(end)
+            self.written = last
+            self.batches += 1
+            self.bytes_written += len(payload)
+            written = len(payload)
+        if checkpoint is not None and self.segments[-1][0] <= last:
+            written += self._checkpoint(last, checkpoint)
+        return written
+
+    def _active_size(self):
+        return self.offsets[-1] - self.segments[-1][1] if self.segments else 0
+
+    def _checkpoint(self, seq, checkpoint):
+        record = {
+            'seq': seq,
+            'net': [[account, currency, amount] for (account, currency), amount in checkpoint['net'].items()],
+            'reasons': checkpoint['reasons'],
+        }
+        size = write_atomic(self.path + '.checkpoint', json.dumps(record, separators=(',', ':')).encode('utf-8'))
+        # The next append creates the new segment
+        self.segments.append((seq + 1, self.offsets[-1], segment_path(self.path, seq + 1)))
+        self.checkpoints += 1
+        return size
+
+    def _trim(self):
+        if self.path is None:
+            return  # memory only: the tail is all there is
+        # Keep the newest postings, and anything not yet on disk
+        keep_from = min(self.seq - self.recent_size, self.written) + 1
+        drop = keep_from - self.recent_first
+        if drop > 0:
+            del self.recent[:drop]
+            self.recent_first = keep_from
+
+    def load(self):
+        """Start from the checkpoint and index the segments after it; a torn last line is dropped."""
+        if self.path is None:
+            return
+        checkpoint_path = self.path + '.checkpoint'
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, 'rb') as f:
+                checkpoint = json.load(f)
+            self.base = self.seq = checkpoint['seq']
+            for account, currency, amount in checkpoint['net']:
+                self.net[account, currency] = amount
+            for reason in checkpoint['reasons']:
+                self.by_reason[reason] = array('L')
+        self.segments = []
+        for first, path in self._segment_files():
+            if first <= self.base:
+                continue  # covered by the checkpoint
+            self.segments.append((first, self.offsets[-1], path))
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        posting = tuple(json.loads(line))
+                    except ValueError:
+                        print(f"Ledger: ignoring torn posting at end of {path}")
+                        break
+                    self.seq = posting[0]
+                    self.offsets.append(self.offsets[-1] + len(line))
+                    self._index(posting)
+        if not self.segments:
+            first = self.base + 1
+            self.segments.append((first, 0, segment_path(self.path, first) if self.base else self.path))
+        self.written = self.seq
+        self.recent_first = self.seq + 1
+
+    def _segment_files(self):
+        """``(first seq, path)`` of every segment on disk, oldest first."""
+        directory, name = os.path.split(self.path)
+        files = [(1, self.path)] if os.path.exists(self.path) else []
+        for entry in os.listdir(directory or '.'):
+            suffix = entry[len(name) + 1:]
+            if entry.startswith(name + '.') and suffix.isdigit():
+                files.append((int(suffix), os.path.join(directory, entry)))
+        files.sort()
+        return files
+
+    # Reading --------------------------------------------------------------
+
+    def get(self, seq):
+        if seq >= self.recent_first:
+            return Posting._make(self.recent[seq - self.recent_first])
+        if seq <= self.base:
+            raise KeyError(f"posting {seq} is before the ledger checkpoint")
+        _, segment_start, path = self.segments[bisect_right(self.segments, seq, key=itemgetter(0)) - 1]
+        fd = self._fds.get(path)
+        if fd is None:
+            fd = self._fds[path] = os.open(path, os.O_RDONLY)
+        start = self.offsets[seq - self.base - 1]
+        line = os.pread(fd, self.offsets[seq - self.base] - start, start - segment_start)
+        return Posting._make(json.loads(line))
+
+    def history(self, account, limit=10, include_bulk=True):
+        """Newest postings touching ``account`` (and bulk ones), newest first."""
+        seqs = list(self.by_account.get(account, ())[-limit:])
+        if include_bulk and is_user(account):
+            seqs.extend(self.by_account.get(ALL_USERS, ())[-limit:])
+            seqs.sort()
+        return [self.get(seq) for seq in reversed(seqs[-limit:])]
+
+    def select(self, start=None, end=None, reason=None, account=None):
+        """Sequence numbers of postings with ``start <= ts < end``,
+        optionally of one reason and/or account, oldest first."""
+        first = self.base + 1 + (0 if start is None else bisect_left(self.times, start))
+        last = self.seq if end is None else self.base + bisect_left(self.times, end)
+        if reason is not None and account is not None:
+            by_account = self.by_account.get(account, ())
+            return [seq for seq in self._window(self.by_reason.get(reason, ()), first, last)
+                    if _contains(by_account, seq)]
+        if reason is not None:
+            return self._window(self.by_reason.get(reason, ()), first, last)
+        if account is not None:
+            return self._window(self.by_account.get(account, ()), first, last)
+        return range(first, last + 1)
+
+    def audit(self, start=None, end=None, reason=None, account=None, limit=None):
+        """Postings matching ``select()``; the newest ``limit`` if given."""
+        seqs = self.select(start, end, reason, account)
+        if limit is not None:
+            seqs = seqs[len(seqs) - limit:] if limit < len(seqs) else seqs
+        return [self.get(seq) for seq in seqs]
+
+    @staticmethod
+    def _window(seqs, first, last):
+        return seqs[bisect_left(seqs, first):bisect_right(seqs, last)]
+
+    def balance(self, account, currency='reiatsu'):
+        """Net amount ``account`` received over the whole ledger (checkpoint included)."""
+        return self.net.get((account, currency), 0)
+
+    def stats(self):
+        return {
+            'postings': self.seq,
+            'unwritten': self.seq - self.written,
+            'accounts': len(self.by_account),
+            'batches': self.batches,
+            'bytes_written': self.bytes_written,
+            'indexed_from': self.base + 1,
+            'segments': len(self.segments),
+            'checkpoints': self.checkpoints,
+        }
+
+
+def _contains(seqs, seq):
+    index = bisect_left(seqs, seq)
+    return index < len(seqs) and seqs[index] == seq
+
+
+def summarize(postings):
+    """{(reason, currency): [count, total]} for audit reports."""
+    totals = {}
+    for posting in postings:
+        entry = totals.setdefault((posting.reason, posting.currency), [0, 0])
+        entry[0] += 1
+        entry[1] += posting.amount
+    return totals
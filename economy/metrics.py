@@ -0,0 +1,142 @@
+"""Counters and histograms for the ``/metrics`` endpoint.
+
+The HTTP server runs on the bot's own event loop, so a scrape is just a
+coroutine that reads the counters below and the engines' ``stats()`` and
+renders them in the Prometheus text format (``MetricsWriter``).  Recording
+is a dict lookup, a ``bisect`` and a few additions; nothing is locked and
+no thread is involved.
+
+``Histogram`` keeps cumulative-bucket counts per label value (a command
+name, say), the way Prometheus expects them; ``LoopLagMonitor`` measures
+how late the event loop wakes a sleeping task, the delay every command and
+gateway event sees on top of its own work.
+"""
+import asyncio
+import math
+from bisect import bisect_left
+
+# Seconds; commands range from sub-millisecond reads to multi-second !result
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class Counter:
+    """Monotonic counts per tuple of label values."""
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Histogram:
+    """Bucketed observations per tuple of label values."""
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [count per bucket (+Inf last), sum, count]
+        self.series = {}
+
+    def observe(self, value, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+
+class LoopLagMonitor:
+    """Samples event-loop lag: how much later than asked a sleep returns."""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.last = 0.0
+        self.max = 0.0
+        self.histogram = Histogram('soulbot_event_loop_lag_seconds', "Event loop wake-up delay",
+                                   buckets=LAG_BUCKETS)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            self.last = lag
+            self.max = max(self.max, lag)
+            self.histogram.observe(lag)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if isinstance(value, float):
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(int(value))
+
+
+class MetricsWriter:
+    """Builds one scrape in the Prometheus text exposition format."""
+
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self.lines = []
+
+    def _header(self, name, help, kind):
+        self.lines.append(f'# HELP {name} {help}')
+        self.lines.append(f'# TYPE {name} {kind}')
+
+    def gauge(self, name, help, samples, labels=()):
+        """``samples``: a single value, or ``{label values: value}``."""
+        self._samples(name, help, 'gauge', samples, labels)
+
+    def counter(self, name, help, samples, labels=()):
+        self._samples(name, help, 'counter', samples, labels)
+
+    def _samples(self, name, help, kind, samples, labels):
+        self._header(name, help, kind)
+        if not isinstance(samples, dict):
+            samples = {(): samples}
+        for values, value in samples.items():
+            self.lines.append(f'{name}{_labels(labels, values)} {_number(value)}')
+
+    def add_counter(self, counter):
+        self.counter(counter.name, counter.help, counter.values, counter.labels)
+
+    def add_histogram(self, histogram):
+        name = histogram.name
+        self._header(name, histogram.help, 'histogram')
+        bounds = [_number(float(bound)) for bound in histogram.buckets] + ['+Inf']
+        for values, (counts, total, count) in histogram.series.items():
+            cumulative = 0
+            for bound, bucket in zip(bounds, counts):
+                cumulative += bucket
+                labels = _labels(histogram.labels + ('le',), values + (bound,))
+                self.lines.append(f'{name}_bucket{labels} {cumulative}')
+            labels = _labels(histogram.labels, values)
+            self.lines.append(f'{name}_sum{labels} {_number(float(total))}')
+            self.lines.append(f'{name}_count{labels} {count}')
+
+    def render(self):
+        return '\n'.join(self.lines) + '\n'
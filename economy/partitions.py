@@ -0,0 +1,235 @@
+"""Per-guild economy partitions.
+
+A partition is one complete economy: the six tables, the ledger, the
+engines that work on them (settlement, transactions, purchases, cooldowns,
+embed cache) and a ``PersistenceEngine`` with its own storage files.  With
+``per_guild`` every guild gets its own partition - its own users,
+leaderboards, shop and offers - keyed by the guild id; otherwise there is
+a single ``GLOBAL`` partition shared by every guild, as before.
+
+Loading reads the partition's storage and builds its indexes, which takes
+long enough on a big economy to stall the gateway; ``ensure()`` runs it in
+a worker thread and then ``start``s the partition's background work on the
+loop.  Every caller asking for a partition that is still loading awaits
+the same load: the gateway handler that announced the guild, and any
+command or event for it that arrives meanwhile.
+
+Partitions are loaded on first use, so a process only ever holds the
+guilds it serves: under ``AutoShardedBot`` the gateway only delivers the
+guilds of the process's shards, and memory and flush cost grow with those
+guilds rather than with every guild the bot is in.
+
+Commands keep using module-level names such as ``user_data``: those are
+``PartitionProxy`` objects that forward to the partition bound to the
+running task.  The binding is a ``ContextVar``; each command invocation
+and each background task runs in its own asyncio task, so binding a
+partition at the start of one never leaks into another::
+
+    await partitions.bind(ctx.guild.id)  # before the command runs
+    user_data[user_id]['reiatsu']      # -> that guild's user table
+
+Background work of a partition is started with ``Partition.spawn()``,
+which binds the partition inside the new task.
+"""
+import asyncio
+import contextlib
+import contextvars
+import time
+
+from economy.persistence import TABLES
+
+GLOBAL = 'global'
+
+_current = contextvars.ContextVar('economy_partition', default=None)
+
+
+class Partition:
+    """One economy; ``load_partition()`` in main.py sets the tables and engines."""
+
+    def __init__(self, key):
+        self.key = key
+        self.frozen = False  # !economyfreeze
+        self.load_seconds = None
+        self.persistence = None
+        self.shared = None  # SharedStore when balances are shared across processes
+        self.tasks = set()
+        self.locks = []  # lock files claiming this partition's storage paths
+
+    def tables(self):
+        return {name: getattr(self, name) for name in TABLES}
+
+    def spawn(self, coro):
+        """Run ``coro`` as a background task bound to this partition."""
+        context = contextvars.copy_context()
+        context.run(_current.set, self)  # the new task's context only
+        task = asyncio.get_running_loop().create_task(coro, context=context)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def close(self):
+        """Stop the background tasks and write everything still pending."""
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.persistence is not None:
+            await self.persistence.stop()
+        if self.shared is not None:
+            self.shared.close()
+        for lock in self.locks:
+            lock.close()
+
+
+class PartitionRegistry:
+    """Loaded partitions by key; ``load(key)`` builds a missing one."""
+
+    def __init__(self, load, per_guild=False, start=None):
+        self.load = load
+        # Called on the loop with a freshly loaded partition (tasks, flusher)
+        self.start = start
+        self.per_guild = per_guild
+        self.partitions = {}
+        self.loading = {}  # key -> future of a load running in a thread
+        self.loads = 0
+        self.unloads = 0
+        self.load_seconds = 0.0
+
+    def key(self, guild_id):
+        return str(guild_id) if self.per_guild and guild_id is not None else GLOBAL
+
+    def get(self, guild_id=None):
+        """The partition of ``guild_id`` (or the global one), loading it if needed.
+
+        Loads in the calling thread; on the event loop use ``ensure()``.
+        """
+        key = self.key(guild_id)
+        partition = self.partitions.get(key)
+        if partition is None:
+            if key in self.loading:
+                # A second load would find the storage locked by the first
+                raise LookupError(f"economy partition {key} is still loading")
+            partition = self._started(key, self._load(key))
+        return partition
+
+    async def ensure(self, guild_id=None):
+        """``get()`` without blocking the loop: the load runs in a worker thread."""
+        key = self.key(guild_id)
+        partition = self.partitions.get(key)
+        if partition is not None:
+            return partition
+        future = self.loading.get(key)
+        if future is None:
+            future = self.loading[key] = asyncio.ensure_future(self._load_async(key))
+            future.add_done_callback(lambda _: self.loading.pop(key, None))
+        # A cancelled caller mustn't cancel the load the others wait for
+        return await asyncio.shield(future)
+
+    async def _load_async(self, key):
+        partition = await asyncio.to_thread(self._load, key)
+        return self._started(key, partition)
+
+    def _load(self, key):
+        start = time.perf_counter()
+        partition = self.load(key)
+        partition.load_seconds = round(time.perf_counter() - start, 3)
+        return partition
+
+    def _started(self, key, partition):
+        self.partitions[key] = partition
+        self.loads += 1
+        self.load_seconds += partition.load_seconds
+        if self.start is not None:
+            self.start(partition)
+        return partition
+
+    def loaded(self):
+        return list(self.partitions.values())
+
+    async def unload(self, guild_id):
+        """Flush and drop a guild's partition (the bot left the guild)."""
+        partition = self.partitions.pop(self.key(guild_id), None)
+        if partition is not None:
+            await partition.close()
+            self.unloads += 1
+        return partition
+
+    async def bind(self, guild_id=None):
+        """Make the guild's partition current for the rest of this task.
+
+        Waits for the partition if it is loading (see ``ensure()``).
+        """
+        partition = await self.ensure(guild_id)
+        _current.set(partition)
+        return partition
+
+    @contextlib.contextmanager
+    def bound(self, partition):
+        """Make ``partition`` current inside a ``with`` block."""
+        token = _current.set(partition)
+        try:
+            yield partition
+        finally:
+            _current.reset(token)
+
+    def current(self):
+        partition = _current.get()
+        if partition is not None:
+            return partition
+        if self.per_guild:
+            raise LookupError("no economy partition is bound to this task")
+        return self.get()
+
+    def proxy(self, name):
+        return PartitionProxy(self, name)
+
+    def stats(self):
+        loaded = self.loaded()
+        return {
+            'mode': 'guild' if self.per_guild else 'global',
+            'loaded': len(loaded),
+            'loading': len(self.loading),
+            'users': sum(len(partition.user_data) for partition in loaded),
+            'loads': self.loads,
+            'unloads': self.unloads,
+            'load_seconds': round(self.load_seconds, 3),
+        }
+
+
+class PartitionProxy:
+    """Stands in for attribute ``name`` of the current partition."""
+
+    __slots__ = ('_registry', '_name')
+
+    def __init__(self, registry, name):
+        self._registry = registry
+        self._name = name
+
+    def _target(self):
+        return getattr(self._registry.current(), self._name)
+
+    def __getattr__(self, attr):
+        return getattr(self._target(), attr)
+
+    def __getitem__(self, key):
+        return self._target()[key]
+
+    def __setitem__(self, key, value):
+        self._target()[key] = value
+
+    def __delitem__(self, key):
+        del self._target()[key]
+
+    def __contains__(self, key):
+        return key in self._target()
+
+    def __iter__(self):
+        return iter(self._target())
+
+    def __len__(self):
+        return len(self._target())
+
+    def __bool__(self):
+        return bool(self._target())
+
+    def __repr__(self):
+        return f"<{self._name} of the current economy partition>"
@@ -0,0 +1,311 @@
+"""Write-behind persistence for the economy state.
+
+Every mutating command calls ``save_data()``.  Rewriting the whole economy
+file on each of those calls stalls the event loop, so the engine only marks
+the state dirty and a background task flushes at most once per interval.
+Bursts of saves inside one interval are coalesced into a single write.
+
+The engine is storage-agnostic.  A backend splits each flush in two:
+
+* ``prepare(tables)`` runs on the loop thread, drains the tables' changed
+  paths and returns a detached job (or ``None`` when there is nothing to do);
+* ``commit(job)`` runs on the engine's dedicated worker thread and does the
+  encoding and I/O, returning the number of bytes written.
+
+``load()`` returns the stored tables as plain dicts.
+
+Extra writers (``add_writer()``, e.g. the ledger in economy/ledger.py) have
+the same ``prepare()``/``commit(job)`` split minus the tables; their jobs
+are committed before the backend's in every flush.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from economy.snapshot import encode_state, read_state
+from economy.tracking import snapshot_tables
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, nothing is checked
+    fcntl = None
+
+TABLES = ('user_data', 'active_offers', 'offer_results', 'shop_items', 'daily_missions', 'tournaments')
+
+
+class StorageInUse(RuntimeError):
+    """Another process already writes to a storage path."""
+
+
+def lock_path(path):
+    """Claim ``path`` for this process through an exclusive lock on ``<path>.lock``.
+
+    Returns the open lock file, which holds the claim until it is closed;
+    raises ``StorageInUse`` if another process has claimed the path.  Two
+    processes appending to one ledger or journal would truncate each
+    other's entries.
+    """
+    lock = open(os.path.normpath(path) + '.lock', 'a')
+    if fcntl is None:
+        return lock
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        raise StorageInUse(f'{path} is used by another process; give each process its own storage paths') from None
+    return lock
+
+
+def fsync_dir(path):
+    """Flush a directory entry so a rename inside it survives a crash."""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path, payload):
+    """Atomically replace ``path`` with ``payload`` bytes."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_dir(path)
+    return len(payload)
+
+
+def write_json_atomic(path, data):
+    """Encode ``data`` as compact JSON and atomically replace ``path``."""
+    return write_atomic(path, encode_state(data))
+
+
+def read_json(path):
+    """Read a JSON (or binary snapshot) file, {} if it does not exist."""
+    return read_state(path)
+
+
+class JsonFileBackend:
+    """Whole-economy snapshot file, rewritten on every flush.
+
+    ``snapshot_format`` is 'json' or 'binary' (see economy/snapshot.py);
+    loading auto-detects either.
+    """
+
+    name = 'json'
+
+    def __init__(self, path, snapshot_format='json', compression='none'):
+        self.path = path
+        self.snapshot_format = snapshot_format
+        self.compression = compression
+
+    def load(self):
+        return read_state(self.path)
+
+    def prepare(self, tables, force_snapshot=False):
+        changed = False
+        for table in tables.values():
+            bulk = table.drain_bulk()
+            if table.drain() or bulk:
+                changed = True
+        if not changed and not force_snapshot:
+            return None
+        return snapshot_tables(tables)
+
+    def commit(self, job):
+        return write_atomic(self.path, encode_state(job, self.snapshot_format, self.compression))
+
+
+class PersistenceEngine:
+    """Coalescing, off-loop writer in front of a storage backend.
+
+    ``tables`` is a callable returning the live ``TrackedTable`` objects by
+    name; it is called on every flush because ``load_data()`` rebinds them.
+    """
+
+    def __init__(self, backend, tables, interval=2.0):
+        self.backend = backend
+        self.interval = interval
+        self._tables = tables
+        self.writers = []
+        self._dirty = False
+        self._wakeup = None
+        self._task = None
+        self._flush_lock = None
+        # Job whose commit failed; retried before anything newer is written
+        self._failed_job = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='soul-save')
+
+        # Counters
+        self.save_requests = 0
+        self.coalesced_writes = 0
+        self.flush_count = 0
+        self.failed_flushes = 0
+        self.bytes_written = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+    def load(self):
+        """Read the stored tables (blocking, on the worker thread)."""
+        return self._executor.submit(self.backend.load).result()
+
+    def add_writer(self, writer):
+        self.writers.append(writer)
+
+    def mark_dirty(self):
+        """Record that the state changed; the next flush will persist it."""
+        self.save_requests += 1
+        if self._dirty:
+            self.coalesced_writes += 1
+        self._dirty = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        """Start the background flusher on the running event loop."""
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        if self._dirty:
+            self._wakeup.set()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and persist anything still pending."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush(force_snapshot=True)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Let the burst that woke us settle before writing once
+            await asyncio.sleep(self.interval)
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self, force_snapshot=False):
+        """Persist pending changes; ``force_snapshot`` also compacts where supported."""
+        if self._flush_lock is None:
+            self.flush_now(force_snapshot)
+            return
+        async with self._flush_lock:
+            if not self._dirty and not force_snapshot:
+                return
+            self._dirty = False
+            start = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            written = 0
+            try:
+                for job in self._jobs(force_snapshot):
+                    written += await loop.run_in_executor(self._executor, self._commit, job)
+            except Exception as e:
+                self._dirty = True
+                self.failed_flushes += 1
+                print(f"Save failed: {e}")
+                return
+            self._record_flush(start, written)
+
+    async def run_in_store(self, func, *args):
+        """Run ``func(*args)`` on the worker once pending changes are written.
+
+        For whole-table statements (``UPDATE users ...``) that must see every
+        change and must not interleave with a flush.
+        """
+        if self._flush_lock is None:
+            self.flush_now()
+            return self._executor.submit(func, *args).result()
+        await self.flush()
+        async with self._flush_lock:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def read(self, func, *args):
+        """Run a read-only ``func(*args)`` on the worker, without flushing first.
+
+        The reads see what the store has committed; callers keep unflushed
+        state in memory (see ``UserRepository.prefetch()``).
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def flush_now(self, force_snapshot=False):
+        """Synchronously write pending state (shutdown and scripts)."""
+        if not self._dirty and not force_snapshot:
+            return
+        self._dirty = False
+        start = time.perf_counter()
+        written = 0
+        try:
+            for job in self._jobs(force_snapshot):
+                written += self._executor.submit(self._commit, job).result()
+        except Exception:
+            self._dirty = True
+            self.failed_flushes += 1
+            raise
+        self._record_flush(start, written)
+
+    def _jobs(self, force_snapshot):
+        # Preparing drains the tables, so a failed job must be kept and retried
+        if self._failed_job is not None:
+            yield self._failed_job
+        for writer in self.writers:
+            job = writer.prepare()
+            if job is not None:
+                yield writer, job
+        job = self.backend.prepare(self._tables(), force_snapshot)
+        if job is not None:
+            yield self.backend, job
+
+    def _commit(self, item):
+        self._failed_job = item
+        writer, job = item
+        written = writer.commit(job)
+        self._failed_job = None
+        return written
+
+    def _record_flush(self, start, written):
+        for table in self._tables().values():
+            table.flushed()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.flush_count += 1
+        self.bytes_written += written
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+
+    def stats(self):
+        stats = {
+            'backend': self.backend.name,
+            'save_requests': self.save_requests,
+            'coalesced_writes': self.coalesced_writes,
+            'flushes': self.flush_count,
+            'failed_flushes': self.failed_flushes,
+            'bytes_written': self.bytes_written,
+            'last_flush_ms': self.last_flush_ms,
+            'max_flush_ms': self.max_flush_ms,
+            'avg_flush_ms': self.total_flush_ms / self.flush_count if self.flush_count else 0.0,
+            'pending': self._dirty,
+            'interval': self.interval,
+        }
+        if hasattr(self.backend, 'stats'):
+            stats.update(self.backend.stats())
+        return stats
@@ -0,0 +1,122 @@
+"""On-demand CPU and memory profiling of the running bot.
+
+Nothing here runs unless an admin asks for it: with no profile active
+there is no hook installed and no tracing, so the cost is zero.
+
+``CpuProfile`` is ``cProfile`` switched on for a window.  Everything the
+bot does runs on the event-loop thread, so enabling the profiler there
+captures every command, event and background task until it is stopped.
+``MemoryWindow`` starts ``tracemalloc`` (unless something else already
+did), waits, and compares two snapshots: what was allocated and is still
+alive after the window, by source line.
+
+Both write a gzip-compressed text report to the report directory (the CPU
+profile also as raw pstats data, loadable after ``gunzip``) and return the
+top entries for the chat reply.  Report writing and stats sorting happen
+in a worker thread after profiling has stopped.
+"""
+import asyncio
+import cProfile
+import gzip
+import io
+import marshal
+import os
+import pstats
+import time
+import tracemalloc
+from datetime import datetime
+
+TOP = 8
+REPORT_LINES = 100
+
+
+def _stamp():
+    return datetime.now().strftime('%Y%m%d_%H%M%S')
+
+
+def _short(filename):
+    return os.path.relpath(filename) if filename.startswith(os.getcwd()) else os.path.basename(filename)
+
+
+class CpuProfile:
+    """One cProfile window; ``stop()`` returns the summary rows."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.profile = cProfile.Profile()
+        self.started = time.time()
+        self.profile.enable()
+
+    @property
+    def seconds(self):
+        return time.time() - self.started
+
+    async def stop(self, focus='main.py'):
+        """Stop profiling; returns (report path, hottest ``focus`` functions, hottest overall)."""
+        self.profile.disable()
+        seconds = self.seconds
+        return await asyncio.to_thread(self._report, seconds, focus)
+
+    def _report(self, seconds, focus):
+        stats = pstats.Stats(self.profile)
+        rows = []
+        # (file, line, function) -> (primitive calls, calls, own time, cumulative time, callers)
+        for (filename, line, function), (_, calls, own, cumulative, _) in stats.stats.items():
+            rows.append((_short(filename), line, function, calls, own, cumulative))
+        focused = sorted((row for row in rows if row[0].endswith(focus)), key=lambda row: row[5], reverse=True)
+        overall = sorted(rows, key=lambda row: row[4], reverse=True)
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'cpu_{_stamp()}.txt.gz')
+        text = io.StringIO()
+        text.write(f"CPU profile over {seconds:.1f}s\n\n")
+        pstats.Stats(self.profile, stream=text).sort_stats('cumulative').print_stats(REPORT_LINES)
+        pstats.Stats(self.profile, stream=text).sort_stats('tottime').print_stats(REPORT_LINES)
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            f.write(text.getvalue())
+        with gzip.open(path.replace('.txt.gz', '.prof.gz'), 'wb') as f:
+            self.profile.create_stats()
+            f.write(marshal.dumps(self.profile.stats))
+        return path, focused[:TOP], overall[:TOP]
+
+
+class MemoryWindow:
+    """Allocations made during a window that are still alive at its end."""
+
+    def __init__(self, directory, frames=1):
+        self.directory = directory
+        self.frames = frames
+
+    async def run(self, seconds):
+        """Trace for ``seconds``; returns (report path, top sites, traced bytes)."""
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start(self.frames)
+        try:
+            before = tracemalloc.take_snapshot()
+            await asyncio.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+            traced, _ = tracemalloc.get_traced_memory()
+        finally:
+            if started_here:
+                tracemalloc.stop()
+        path, top = await asyncio.to_thread(self._report, before, after, seconds)
+        return path, top, traced
+
+    def _report(self, before, after, seconds):
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen *>')]
+        differences = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'lineno')
+        grown = [diff for diff in differences if diff.size_diff > 0]
+        grown.sort(key=lambda diff: diff.size_diff, reverse=True)
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'mem_{_stamp()}.txt.gz')
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            f.write(f"Allocations alive after a {seconds:.0f}s window, by growth\n\n")
+            for diff in grown[:REPORT_LINES * 2]:
+                f.write(f"{diff}\n")
+        top = []
+        for diff in grown[:TOP]:
+            frame = diff.traceback[0]
+            top.append((_short(frame.filename), frame.lineno, diff.size_diff, diff.count_diff))
+        return path, top
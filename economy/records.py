@@ -0,0 +1,328 @@
+"""Compact in-memory user record.
+
+A user used to be a 16-key dict plus three containers of its own, even for
+members who never ran a command.  ``UserRecord`` keeps the same fields in
+``__slots__`` instead:
+
+* ``rank`` is an ordinal into ``SOUL_REAPER_RANKS``;
+* ``last_daily``/``last_work``/``last_train`` are epoch seconds (or None);
+* ``inventory``/``active_bets``/``achievements`` are None until first
+  used, standing in for one shared empty container.
+
+Item access (``record['rank']``, ``record.get(...)``, ``items()``...) is a
+dict-compatible shim that speaks the old representation - rank names and
+ISO timestamps - so commands and every storage backend keep working and the
+stored format is unchanged.  Item writes are change-tracked like a
+``TrackedDict``; attribute access reads/writes the compact values directly
+and is not tracked.
+
+The numeric balances in ``COLUMN_FIELDS`` of a record that belongs to a
+``UserRepository`` are stored in the repository's ``BalanceColumns``
+(economy/columns.py) at the record's slot; detached records keep them in a
+small local list.
+"""
+from datetime import datetime
+
+from economy.columns import COLUMN_FIELDS
+from economy.tracking import MISSING, unwrap, wrap
+
+SOUL_REAPER_RANKS = (
+    "Academy Student", "Unseated Officer", "20th Seat", "15th Seat",
+    "10th Seat", "5th Seat", "3rd Seat", "Lieutenant", "Captain", "Captain Commander"
+)
+RANK_ORDINALS = {name: ordinal for ordinal, name in enumerate(SOUL_REAPER_RANKS)}
+
+SCALAR_FIELDS = ('reiatsu', 'soul_fragments', 'zanpakuto', 'stand', 'level', 'exp',
+                 'daily_streak', 'total_winnings', 'battles_won')
+TIME_FIELDS = ('last_daily', 'last_work', 'last_train')
+CONTAINER_FIELDS = {'inventory': dict, 'active_bets': list, 'achievements': list}
+
+# Field order of the legacy dict
+FIELDS = ('reiatsu', 'soul_fragments', 'zanpakuto', 'stand', 'rank', 'level', 'exp',
+          'daily_streak', 'last_daily', 'last_work', 'last_train', 'inventory',
+          'active_bets', 'total_winnings', 'battles_won', 'achievements')
+FIELD_SET = frozenset(FIELDS)
+
+
+def rank_ordinal(rank):
+    """Ordinal for a rank name; unknown names are kept as strings."""
+    return RANK_ORDINALS.get(rank, rank)
+
+
+def rank_name(rank):
+    return SOUL_REAPER_RANKS[rank] if isinstance(rank, int) else rank
+
+
+def to_epoch(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    return int(datetime.fromisoformat(value).timestamp())
+
+
+def to_iso(value):
+    return None if value is None else datetime.fromtimestamp(value).isoformat()
+
+
+class ColumnField:
+    """Descriptor for a balance stored in the owning repository's columns."""
+
+    __slots__ = ('field', 'index')
+
+    def __init__(self, field, index):
+        self.field = field
+        self.index = index
+
+    def __get__(self, record, owner=None):
+        if record is None:
+            return self
+        if record._slot is None:
+            return record._local[self.index]
+        return int(record._root.columns.arrays[self.field][record._slot])
+
+    def __set__(self, record, value):
+        if record._slot is None:
+            record._local[self.index] = value
+        else:
+            record._root.columns.arrays[self.field][record._slot] = value
+
+
+class UserRecord:
+    """One user's economy state; see the module docstring."""
+
+    __slots__ = tuple(field for field in FIELDS if field not in COLUMN_FIELDS) + (
+        '_extra', '_root', '_key', '_slot', '_local')
+
+    def __init__(self):
+        self._slot = None
+        self._local = [0] * len(COLUMN_FIELDS)
+        # A new member's starting state
+        self.reiatsu = 5000  # Main currency (instead of credits)
+        self.soul_fragments = 0  # Premium currency
+        self.zanpakuto = None
+        self.stand = None
+        self.rank = 0
+        self.level = 1
+        self.exp = 0
+        self.daily_streak = 0
+        self.last_daily = None
+        self.last_work = None
+        self.last_train = None
+        self.inventory = None
+        self.active_bets = None
+        self.total_winnings = 0
+        self.battles_won = 0
+        self.achievements = None
+        self._extra = None
+        self._root = None
+        self._key = None
+
+    @classmethod
+    def from_dict(cls, data, root=None, key=None):
+        """Build a record from a legacy user dict (rank names, ISO timestamps)."""
+        if isinstance(data, UserRecord):
+            data = data.to_dict()
+        record = cls()
+        record._root = root
+        record._key = key
+        for field in SCALAR_FIELDS:
+            if field in data:
+                setattr(record, field, data[field])
+        if 'rank' in data:
+            record.rank = rank_ordinal(data['rank'])
+        for field in TIME_FIELDS:
+            setattr(record, field, to_epoch(data.get(field)))
+        for field in CONTAINER_FIELDS:
+            setattr(record, field, record._container(field, data.get(field)))
+        for name, value in data.items():
+            if name not in FIELD_SET:
+                if record._extra is None:
+                    record._extra = {}
+                record._extra[name] = record._wrap(name, value)
+        if getattr(root, 'columns', None) is not None:
+            record.attach_columns()
+        return record
+
+    def attach_columns(self):
+        """Move the balances into the owning repository's columns."""
+        columns = self._root.columns
+        slot = columns.allocate()
+        for field, value in zip(COLUMN_FIELDS, self._local):
+            columns.arrays[field][slot] = value
+        self._slot = slot
+        self._local = None
+
+    def detach_columns(self):
+        """Free the column slot, keeping the values locally.
+
+        Called when the record leaves its repository; anyone still holding
+        it keeps reading the values it had.
+        """
+        if self._slot is None:
+            return
+        columns = self._root.columns
+        self._local = [columns.get(field, self._slot) for field in COLUMN_FIELDS]
+        columns.release(self._slot)
+        self._slot = None
+
+    def _wrap(self, field, value):
+        # Detached records hold plain containers
+        if self._root is None:
+            return value
+        return wrap(value, self._root, (self._key, field))
+
+    def _container(self, field, value):
+        # Empty containers are not stored; None means "shared empty"
+        if not value:
+            return None
+        return self._wrap(field, value)
+
+    def _touch(self, field):
+        if self._root is not None:
+            self._root.touch((self._key, field))
+
+    # Legacy representation ----------------------------------------------
+
+    def persisted(self, field):
+        """Value of ``field`` as stored on disk, or ``MISSING``."""
+        if field in CONTAINER_FIELDS:
+            value = getattr(self, field)
+            return CONTAINER_FIELDS[field]() if value is None else value
+        if field == 'rank':
+            return rank_name(self.rank)
+        if field in TIME_FIELDS:
+            return to_iso(getattr(self, field))
+        if field in FIELD_SET:
+            return getattr(self, field)
+        if self._extra is not None and field in self._extra:
+            return self._extra[field]
+        return MISSING
+
+    def to_dict(self):
+        """Legacy user dict; containers are shared, not copied."""
+        data = {field: self.persisted(field) for field in FIELDS}
+        if self._extra:
+            data.update(self._extra)
+        return data
+
+    def copy(self):
+        """Detached copy (untracked) for off-loop encoding; containers are copied too."""
+        record = UserRecord.__new__(UserRecord)
+        record._slot = None
+        record._local = [getattr(self, field) for field in COLUMN_FIELDS]
+        for field in FIELDS:
+            if field not in COLUMN_FIELDS:
+                setattr(record, field, unwrap(getattr(self, field)))
+        record._extra = unwrap(self._extra) if self._extra else None
+        record._root = None
+        record._key = self._key
+        return record
+
+    def set_untracked(self, field, value):
+        """Write a scalar field without recording a change."""
+        setattr(self, field, value)
+
+    # Dict-compatible shim -----------------------------------------------
+
+    def __getitem__(self, field):
+        if field in CONTAINER_FIELDS:
+            value = getattr(self, field)
+            if value is None:
+                # Created on first use so callers can mutate it in place
+                value = self._wrap(field, CONTAINER_FIELDS[field]())
+                setattr(self, field, value)
+            return value
+        value = self.persisted(field)
+        if value is MISSING:
+            raise KeyError(field)
+        return value
+
+    def __setitem__(self, field, value):
+        # Leaderboard metrics derived from this field (UserRepository.add_index)
+        metrics = self._root.watchers.get(field) if self._root is not None else None
+        if metrics:
+            before = [metric.value(self) for metric in metrics]
+        if field in CONTAINER_FIELDS:
+            setattr(self, field, self._container(field, value))
+        elif field == 'rank':
+            self.rank = rank_ordinal(value)
+        elif field in TIME_FIELDS:
+            setattr(self, field, to_epoch(value))
+        elif field in FIELD_SET:
+            setattr(self, field, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[field] = self._wrap(field, value)
+        self._touch(field)
+        if metrics:
+            self._root.metrics_changed(self, metrics, before)
+
+    def __delitem__(self, field):
+        if field in FIELD_SET or self._extra is None or field not in self._extra:
+            raise KeyError(field)
+        del self._extra[field]
+        self._touch(field)
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def setdefault(self, field, default=None):
+        if field not in self:
+            self[field] = default
+        return self[field]
+
+    def pop(self, field, *default):
+        if field in FIELD_SET:
+            raise KeyError(f"cannot remove user field {field!r}")
+        if field in self:
+            value = self._extra[field]
+            del self[field]
+            return value
+        if default:
+            return default[0]
+        raise KeyError(field)
+
+    def update(self, *args, **kwargs):
+        for field, value in dict(*args, **kwargs).items():
+            self[field] = value
+
+    def __contains__(self, field):
+        return field in FIELD_SET or (self._extra is not None and field in self._extra)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self.persisted(field) for field in self]
+
+    def items(self):
+        return [(field, self.persisted(field)) for field in self]
+
+    def __iter__(self):
+        yield from FIELDS
+        if self._extra:
+            yield from list(self._extra)
+
+    def __len__(self):
+        return len(FIELDS) + (len(self._extra) if self._extra else 0)
+
+    def __eq__(self, other):
+        if isinstance(other, UserRecord):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"UserRecord({self._key!r}, {self.to_dict()!r})"
+
+
+for _index, _field in enumerate(COLUMN_FIELDS):
+    setattr(UserRecord, _field, ColumnField(_field, _index))
+
+del _index, _field
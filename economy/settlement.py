@@ -0,0 +1,182 @@
+"""Bet bookkeeping and resumable, chunked settlement of betting offers.
+
+``BetIndex`` remembers where each user's bet on a match sits in their
+``active_bets`` list, so a bet is found without a scan and removed by
+swapping the last bet into its place instead of rebuilding the list.  The
+index is a hint: a stale or missing position (after a restart, or in a
+lazily loaded user) falls back to a scan of that user's few bets.
+
+``SettlementEngine.settle()`` pays out an offer ``chunk_size`` bettors at a
+time, yielding to the event loop between chunks and reporting progress, so
+a final with thousands of bettors does not stall the bot.  Each bettor is
+settled in one synchronous step that credits the user, drops the active
+bet and stamps the offer's bet with ``settled``; a flush captures either
+all of that or none of it, and every storage backend commits a flush as a
+unit (one framed journal batch, one manifest swap for the shards, one file
+rename for json, one SQLite transaction), so the credit is never persisted
+without its stamp.  The offer stays in ``active_offers`` with
+status ``settling`` until the last chunk, so after a crash ``pending()``
+lists it and ``settle()`` carries on with the bets not yet stamped, using
+the result recorded when settlement started.
+
+With a ``ledger`` (economy/ledger.py) every settled bet is posted in that
+same step: a winner's stake comes back from the offer's escrow account and
+the profit from ``HOUSE``; a losing stake goes from escrow to ``HOUSE``.
+"""
+import asyncio
+from datetime import datetime
+
+from economy.ledger import HOUSE, escrow
+
+SETTLEMENT_CHUNK = 500
+
+
+class BetIndex:
+    """match_id -> {user_id: position in that user's active_bets}."""
+
+    def __init__(self):
+        self.positions = {}
+
+    def add(self, user_id, bets, bet):
+        bets.append(bet)
+        self.positions.setdefault(bet['match_id'], {})[user_id] = len(bets) - 1
+
+    def find(self, user_id, bets, match_id):
+        position = self.positions.get(match_id, {}).get(user_id)
+        if position is not None and position < len(bets) and bets[position].get('match_id') == match_id:
+            return position
+        for position, bet in enumerate(bets):
+            if bet.get('match_id') == match_id:
+                return position
+        return None
+
+    def remove(self, user_id, bets, match_id):
+        """Remove and return the user's bet on ``match_id`` (None if absent)."""
+        position = self.find(user_id, bets, match_id)
+        users = self.positions.get(match_id)
+        if users is not None:
+            users.pop(user_id, None)
+            if not users:
+                del self.positions[match_id]
+        if position is None:
+            return None
+        bet = bets[position]
+        last = bets.pop()
+        if position < len(bets):
+            bets[position] = last
+            if 'match_id' in last:
+                self.positions.setdefault(last['match_id'], {})[user_id] = position
+        return bet
+
+
+def summarize(offer):
+    """Totals and winners of a settled (or partly settled) offer."""
+    winners = []
+    losers = 0
+    total_distributed = 0
+    total_lost = 0
+    for bet in offer['bets'].values():
+        outcome = bet.get('settled')
+        if outcome == 'paid':
+            winners.append({
+                'name': bet['user_name'],
+                'bet': bet['amount'],
+                'return': bet['potential_return'],
+                'profit': bet['potential_return'] - bet['amount']
+            })
+            total_distributed += bet['potential_return']
+        elif outcome == 'lost':
+            losers += 1
+            total_lost += bet['amount']
+    return {
+        'winners': winners,
+        'losers': losers,
+        'total_distributed': total_distributed,
+        'total_lost': total_lost,
+    }
+
+
+class SettlementEngine:
+    """Settles offers from ``offers`` into ``results``; see module docstring."""
+
+    def __init__(self, users, offers, results, index=None, chunk_size=SETTLEMENT_CHUNK, ledger=None):
+        self.users = users
+        self.offers = offers
+        self.results = results
+        self.ledger = ledger
+        self.index = index if index is not None else BetIndex()
+        self.chunk_size = chunk_size
+        self.running = set()
+        self.settled_bets = 0
+
+    def pending(self):
+        """Offers whose settlement was started but not finished."""
+        return [match_id for match_id, offer in self.offers.items() if offer.get('status') == 'settling']
+
+    async def settle(self, match_id, winning_team=None, progress=None):
+        """Settle ``match_id`` and move it to ``results``.
+
+        ``winning_team`` is ignored when resuming.  ``progress`` is an
+        optional coroutine function called as ``progress(done, total)``
+        after every chunk.  Returns ``summarize()`` of the offer.
+        """
+        if match_id in self.running:
+            raise RuntimeError(f"offer {match_id} is already being settled")
+        self.running.add(match_id)
+        try:
+            offer = self.offers[match_id]
+            if offer.get('status') != 'settling':
+                offer['status'] = 'settling'
+                offer['winning_team'] = winning_team
+            winning_key = f"team{offer['winning_team']}"
+            bets = offer['bets']
+            remaining = [user_id for user_id, bet in bets.items() if 'settled' not in bet]
+            total = len(bets)
+            done = total - len(remaining)
+            for start in range(0, len(remaining), self.chunk_size):
+                for user_id in remaining[start:start + self.chunk_size]:
+                    self._settle_bet(match_id, user_id, bets[user_id], winning_key)
+                done += len(remaining[start:start + self.chunk_size])
+                if progress is not None:
+                    await progress(done, total)
+                # Let other commands (and the persistence flush) run
+                await asyncio.sleep(0)
+
+            offer['status'] = 'completed'
+            offer['completed_at'] = datetime.now().isoformat()
+            self.results[match_id] = offer
+            del self.offers[match_id]
+            return summarize(offer)
+        finally:
+            self.running.discard(match_id)
+
+    def _settle_bet(self, match_id, user_id, bet, winning_key):
+        # No await in here: the credit and the 'settled' stamp are flushed together
+        record = self.users.get(user_id)
+        ledger = self.ledger
+        if bet['team'] != winning_key:
+            outcome = 'lost'  # the stake was taken when the bet was placed
+            if ledger is not None:
+                ledger.post('bet_lost', escrow(match_id), HOUSE, bet['amount'], ref=match_id)
+        elif record is None:
+            outcome = 'unclaimed'
+            if ledger is not None:
+                ledger.post('bet_unclaimed', escrow(match_id), HOUSE, bet['amount'], ref=match_id)
+        else:
+            winnings = bet['potential_return']
+            record['reiatsu'] += winnings
+            record['total_winnings'] += winnings - bet['amount']  # Only count profit
+            outcome = 'paid'
+            if ledger is not None:
+                ledger.post('bet_payout', escrow(match_id), user_id, bet['amount'], ref=match_id)
+                ledger.post('bet_profit', HOUSE, user_id, winnings - bet['amount'], ref=match_id)
+        if record is not None:
+            self.index.remove(user_id, record['active_bets'], match_id)
+        bet['settled'] = outcome
+        self.settled_bets += 1
+
+    def stats(self):
+        return {
+            'settling': len(self.running),
+            'settled_bets': self.settled_bets,
+        }
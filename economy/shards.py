@@ -0,0 +1,200 @@
+"""Sharded JSON storage: only segments holding changed entities are rewritten.
+
+Layout under the shard directory::
+
+    manifest.json                  bucket counts, generation, segment -> file
+    users-<bucket>.<gen>.json      users whose id hashes to <bucket>
+    results-<bucket>.<gen>.json    completed offers (offer_results) by match id
+    active_offers.<gen>.json
+    shop_items.<gen>.json
+    misc.<gen>.json                daily_missions and tournaments
+
+A flush maps the tracked changed paths to the segments that contain them and
+writes just those, as new files tagged with the next generation.  Only then
+is ``manifest.json`` atomically replaced to point at them, so a flush is
+committed as a whole by that one rename: after a crash the old manifest
+still names the previous, complete set, and files it doesn't name are
+removed on load.  Users who never change are never re-encoded.  On first
+start without a manifest the legacy snapshot (or the older unversioned
+shard layout with ``meta.json``) is read and every segment is written once.
+"""
+import contextlib
+import os
+import zlib
+
+from economy.persistence import TABLES, read_json, write_json_atomic
+from economy.tracking import detach
+
+SINGLE_SEGMENTS = {'active_offers': 'active_offers', 'shop_items': 'shop_items',
+                   'daily_missions': 'misc', 'tournaments': 'misc'}
+
+
+def bucket_of(key, buckets):
+    """Stable bucket for a user id or match id."""
+    if key.isdigit():
+        return int(key) % buckets
+    return zlib.crc32(key.encode('utf-8')) % buckets
+
+
+class ShardedBackend:
+    """Per-bucket user and result segments plus small fixed segments."""
+
+    name = 'sharded'
+
+    def __init__(self, directory, legacy_path=None, user_buckets=256, result_buckets=16):
+        self.directory = directory
+        self.legacy_path = legacy_path
+        self.user_buckets = user_buckets
+        self.result_buckets = result_buckets
+        # bucket -> ids, so a dirty bucket is encoded without scanning the table
+        self._members = {'user_data': {}, 'offer_results': {}}
+        self._write_all = False
+        # Manifest: segment -> file of the committed generation
+        self.files = {}
+        self.generation = 0
+        self.segments_written = 0
+        self.last_segments = 0
+
+    def _path(self, segment):
+        return os.path.join(self.directory, f"{segment}.json")
+
+    def _bucket_count(self, table):
+        return self.user_buckets if table == 'user_data' else self.result_buckets
+
+    def _segment(self, table, key):
+        if table == 'user_data':
+            return f"users-{bucket_of(key, self.user_buckets):03d}"
+        if table == 'offer_results':
+            return f"results-{bucket_of(key, self.result_buckets):02d}"
+        return SINGLE_SEGMENTS[table]
+
+    def load(self):
+        manifest = read_json(self._path('manifest'))
+        meta = manifest or read_json(self._path('meta'))
+        if meta:
+            self.user_buckets = meta['user_buckets']
+            self.result_buckets = meta['result_buckets']
+        if manifest:
+            self.generation = manifest['generation']
+            self.files = dict(manifest['segments'])
+            state = {name: {} for name in TABLES}
+            for segment, filename in sorted(self.files.items()):
+                for name, entries in read_json(os.path.join(self.directory, filename)).items():
+                    state.setdefault(name, {}).update(entries)
+            # Written by a flush that never reached its manifest
+            self._remove_unlisted()
+        elif meta:
+            # Unversioned layout: every file is current; rewrite it under a manifest
+            state = {name: {} for name in TABLES}
+            for filename in sorted(os.listdir(self.directory)):
+                if not filename.endswith('.json') or filename == 'meta.json':
+                    continue
+                for name, entries in read_json(os.path.join(self.directory, filename)).items():
+                    state.setdefault(name, {}).update(entries)
+            self._write_all = True
+        else:
+            # First start on this layout: read the legacy snapshot, write everything
+            state = {}
+            if self.legacy_path:
+                from economy.journal import JournalBackend
+                state = JournalBackend(self.legacy_path).load()
+            self._write_all = True
+
+        for table, members in self._members.items():
+            members.clear()
+            buckets = self._bucket_count(table)
+            for key in state.get(table, {}):
+                members.setdefault(bucket_of(key, buckets), set()).add(key)
+        return state
+
+    def prepare(self, tables, force_snapshot=False):
+        dirty = set()
+        for name, table in tables.items():
+            if table.drain_bulk() and name in self._members:
+                # A bulk op touches every record of the table
+                self._dirty_all(name, dirty)
+            for path in table.drain():
+                key = path[0]
+                dirty.add(self._segment(name, key))
+                if name in self._members and len(path) == 1:
+                    members = self._members[name].setdefault(bucket_of(key, self._bucket_count(name)), set())
+                    if key in table:
+                        members.add(key)
+                    else:
+                        members.discard(key)
+
+        if self._write_all:
+            self._dirty_all('user_data', dirty)
+            self._dirty_all('offer_results', dirty)
+            dirty.update(set(SINGLE_SEGMENTS.values()))
+            self._write_all = False
+            full = True
+        else:
+            full = False
+        if not dirty:
+            return None
+
+        # Detach just the dirty segments on the loop thread
+        segments = {}
+        for segment in dirty:
+            if segment.startswith('users-'):
+                segments[segment] = {'user_data': self._detach(tables['user_data'], 'user_data', segment)}
+            elif segment.startswith('results-'):
+                segments[segment] = {'offer_results': self._detach(tables['offer_results'], 'offer_results', segment)}
+            else:
+                segments[segment] = {
+                    name: {key: detach(value) for key, value in tables[name].items()}
+                    for name, target in SINGLE_SEGMENTS.items() if target == segment
+                }
+        return {'segments': segments, 'full': full}
+
+    def _dirty_all(self, table, dirty):
+        if table == 'user_data':
+            dirty.update(f"users-{b:03d}" for b in range(self.user_buckets))
+        else:
+            dirty.update(f"results-{b:02d}" for b in range(self.result_buckets))
+
+    def _detach(self, table, name, segment):
+        bucket = int(segment.split('-')[1])
+        return {key: detach(dict.__getitem__(table, key))
+                for key in self._members[name].get(bucket, ()) if key in table}
+
+    def commit(self, job):
+        os.makedirs(self.directory, exist_ok=True)
+        generation = self.generation + 1
+        files = dict(self.files)
+        written = 0
+        for segment, data in job['segments'].items():
+            files[segment] = f"{segment}.{generation:08d}.json"
+            written += write_json_atomic(os.path.join(self.directory, files[segment]), data)
+        # The commit point: until this rename the previous manifest is current
+        manifest = {'user_buckets': self.user_buckets, 'result_buckets': self.result_buckets,
+                    'generation': generation, 'segments': files}
+        written += write_json_atomic(self._path('manifest'), manifest)
+        superseded = [name for segment, name in self.files.items() if files[segment] != name]
+        self.files = files
+        self.generation = generation
+        if job['full']:
+            # Migration: the unversioned files and meta.json go too
+            self._remove_unlisted()
+        else:
+            for name in superseded:
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(self.directory, name))
+        self.segments_written += len(job['segments'])
+        self.last_segments = len(job['segments'])
+        return written
+
+    def _remove_unlisted(self):
+        keep = set(self.files.values()) | {'manifest.json'}
+        for filename in os.listdir(self.directory):
+            if filename.endswith(('.json', '.tmp')) and filename not in keep:
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(self.directory, filename))
+
+    def stats(self):
+        return {
+            'shard_segments_written': self.segments_written,
+            'shard_last_segments': self.last_segments,
+            'shard_user_buckets': self.user_buckets,
+        }
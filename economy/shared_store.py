@@ -0,0 +1,556 @@
+"""Balances shared by several bot processes on one host.
+
+Each process keeps its economy in memory and flushes it through its own
+persistence engine, so two processes serving the same users would each
+write back their own copy of a balance and the last flush would win.
+``SharedStore`` makes the balances - the money - live in one SQLite
+database in WAL mode that every process opens:
+
+* a balance change is a single statement, ``amount = amount + ?``, so
+  concurrent changes from different processes add up instead of
+  overwriting each other;
+* a spend is conditional (``... WHERE amount >= ?``): it either takes the
+  whole amount or fails with ``InsufficientFunds``, whatever the other
+  processes did meanwhile;
+* ``apply()`` runs all changes of one transaction under ``BEGIN
+  IMMEDIATE``, SQLite's cross-process write lock, so a transfer is applied
+  completely or not at all.
+
+The in-memory records stay a cache of the store.  ``attach()`` registers a
+``BalanceSync`` per currency with the ``UserRepository`` like a leaderboard
+index: every write to a record's balance is forwarded to the store as the
+delta it made (decreases conditionally - a failed one restores the record
+and raises ``InsufficientFunds`` from the write), and bulk operations are
+repeated in the store.  ``refresh()`` brings a record back in line with
+the store before it is relied on; commands refresh their author, and
+``TransactionManager`` the users it locks.
+
+Writes run on the event loop, so they never wait long for another
+process's write lock: after ``BUSY_TIMEOUT`` a write raises ``StoreBusy``
+having changed nothing.  Callers that can wait retry it with ``retry()``,
+which sleeps between attempts instead of blocking the loop (transactions,
+refreshes, ``!buy``).  Writes that can't fail - credits, seeding, deletes,
+bulk operations - are queued instead and replayed in order by a background
+task; later writes and every ``apply()`` run the queue first, so the store
+sees changes in the order they were made.  A spend made by a direct record
+write still fails with ``StoreBusy`` (after undoing the write) if the lock
+stays taken.
+
+Limited shop stock lives in the store too.  ``purchase()`` takes the
+price and decrements the stock in one transaction, both conditionally, so
+the processes together can't sell more units than there are; admin edits
+go through ``set_stock()``.
+
+Reads go through a per-user cache with a short TTL.  After every change a
+process sends the changed user ids to its peers over unix datagram sockets
+in ``channel_dir`` (``Notifier``); a peer drops those users from its cache
+before its next read, so the TTL only matters if a notification is lost.
+Everything else - levels, inventories, offers, the shop's item list - is
+still owned by each process's own storage.
+"""
+import asyncio
+import contextlib
+import os
+import socket
+import sqlite3
+import time
+from collections import deque
+
+from economy.transactions import InsufficientFunds
+
+CURRENCIES = ('reiatsu', 'soul_fragments')
+# Seconds a cached balance is trusted without a notification
+DEFAULT_TTL = 0.5
+# Notification payloads stay well below the datagram size limit
+MAX_DATAGRAM = 8192
+ALL = '*'
+# Seconds a write on the event loop waits for another process's lock
+BUSY_TIMEOUT = 0.05
+# retry(): first and longest sleep between attempts
+RETRY_DELAY = 0.01
+MAX_RETRY_DELAY = 0.25
+# Seconds the list of peer sockets is reused before the directory is read again
+PEER_REFRESH = 5.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS balances (
+    user_id TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    PRIMARY KEY (user_id, currency)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stock (
+    item_id TEXT PRIMARY KEY,
+    amount INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class StoreBusy(Exception):
+    """Another process held the store's write lock; nothing was changed."""
+
+
+class SoldOut(Exception):
+    """A purchase asked for more of an item than the store has left."""
+
+    def __init__(self, item_id, left):
+        super().__init__(f'{item_id}: {left} left')
+        self.item_id = item_id
+        self.left = left
+
+
+def connect(path, timeout=BUSY_TIMEOUT):
+    # Opened by the thread loading the partition, then used on the loop
+    conn = sqlite3.connect(path, isolation_level=None, timeout=timeout, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class Notifier:
+    """Invalidation messages between the processes sharing a store."""
+
+    def __init__(self, directory, clock=time.monotonic):
+        self.directory = directory
+        self.clock = clock
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f'{os.getpid()}-{id(self):x}.sock')
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.setblocking(False)
+        # Other processes' sockets, listed at most every PEER_REFRESH seconds;
+        # one that starts meanwhile misses notifications until then, which
+        # its cache TTL covers
+        self._peers = []
+        self._listed = None
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+
+    def peers(self):
+        now = self.clock()
+        if self._listed is None or now - self._listed >= PEER_REFRESH:
+            self._peers = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                           if name.endswith('.sock')]
+            self._peers = [path for path in self._peers if path != self.path]
+            self._listed = now
+        return self._peers
+
+    def publish(self, keys):
+        """Tell every other process that ``keys`` changed (``ALL`` for everyone)."""
+        payloads = []
+        chunk = []
+        size = 0
+        for key in keys:
+            if size + len(key) + 1 > MAX_DATAGRAM and chunk:
+                payloads.append('\n'.join(chunk).encode())
+                chunk, size = [], 0
+            chunk.append(key)
+            size += len(key) + 1
+        if chunk:
+            payloads.append('\n'.join(chunk).encode())
+        for path in list(self.peers()):
+            for payload in payloads:
+                try:
+                    self.sock.sendto(payload, path)
+                    self.sent += 1
+                except ConnectionRefusedError:
+                    # Nobody bound any more: a process that exited
+                    with contextlib.suppress(OSError):
+                        os.unlink(path)
+                    self._peers.remove(path)
+                    break
+                except FileNotFoundError:
+                    self._peers.remove(path)
+                    break
+                except BlockingIOError:
+                    self.dropped += 1  # peer's queue full; the TTL covers it
+
+    def drain(self):
+        """Keys other processes reported since the last call."""
+        keys = []
+        while True:
+            try:
+                payload = self.sock.recv(MAX_DATAGRAM)
+            except BlockingIOError:
+                return keys
+            self.received += 1
+            keys.extend(payload.decode().split('\n'))
+
+    def close(self):
+        self.sock.close()
+        with contextlib.suppress(OSError):
+            os.unlink(self.path)
+
+
+class SharedStore:
+    """Balances in a shared WAL-mode SQLite file; see the module docstring."""
+
+    currencies = CURRENCIES
+
+    def __init__(self, path, ttl=DEFAULT_TTL, channel_dir=None, clock=time.monotonic):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self.conn = connect(path)
+        self.notifier = Notifier(channel_dir or f'{path}.notify', clock)
+        self.cache = {}  # user_id -> (expires, {currency: amount})
+        self._quiet = 0
+        # Writes that found the lock taken: (func, args), replayed in order
+        self.backlog = deque()
+        self._replay = None
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.transactions = 0
+        self.conflicts = 0
+        self.busy = 0
+        self.deferred = 0
+
+    # Reading --------------------------------------------------------------
+
+    def balances(self, user_id):
+        """``{currency: amount}`` of ``user_id`` (empty if unknown), cached."""
+        self._invalidate(self.notifier.drain())
+        entry = self.cache.get(user_id)
+        if entry is not None and entry[0] > self.clock():
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        rows = self.conn.execute("SELECT currency, amount FROM balances WHERE user_id = ?", (user_id,))
+        values = dict(rows.fetchall())
+        self.cache[user_id] = (self.clock() + self.ttl, values)
+        return values
+
+    def all_balances(self):
+        """Every stored balance as ``{user_id: {currency: amount}}`` (startup)."""
+        balances = {}
+        for user_id, currency, amount in self.conn.execute("SELECT user_id, currency, amount FROM balances"):
+            balances.setdefault(user_id, {})[currency] = amount
+        return balances
+
+    def total(self, currency='reiatsu'):
+        return self.conn.execute("SELECT COALESCE(SUM(amount), 0) FROM balances WHERE currency = ?",
+                                 (currency,)).fetchone()[0]
+
+    def _invalidate(self, keys):
+        if not keys:
+            return
+        if ALL in keys:
+            self.invalidations += len(self.cache)
+            self.cache.clear()
+            return
+        for key in keys:
+            if self.cache.pop(key, None) is not None:
+                self.invalidations += 1
+
+    # Writing --------------------------------------------------------------
+
+    @contextlib.contextmanager
+    def _write_lock(self):
+        conn = self.conn
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+        except sqlite3.OperationalError as error:
+            self.busy += 1
+            raise StoreBusy(str(error)) from error
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    async def retry(self, func, *args):
+        """``func(*args)``, called again after a short sleep while it raises ``StoreBusy``."""
+        delay = RETRY_DELAY
+        while True:
+            try:
+                return func(*args)
+            except StoreBusy:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    def settle(self):
+        """Run queued writes now; raises ``StoreBusy`` if the lock is still taken."""
+        while self.backlog:
+            func, args = self.backlog[0]
+            func(*args)
+            self.backlog.popleft()
+
+    def _settle_blocking(self):
+        while True:
+            try:
+                return self.settle()
+            except StoreBusy:
+                time.sleep(RETRY_DELAY)
+
+    def _queue(self, func, *args):
+        """Run ``func(*args)`` now, or after the writes already queued."""
+        if not self.backlog:
+            try:
+                func(*args)
+                return
+            except StoreBusy:
+                pass
+        self.backlog.append((func, args))
+        self.deferred += 1
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Scripts and benchmarks: no event loop to keep responsive
+            self._settle_blocking()
+            return
+        if self._replay is None or self._replay.done():
+            self._replay = loop.create_task(self.retry(self.settle))
+
+    def seed(self, balances):
+        """Add users the store doesn't know yet; existing rows are kept."""
+        rows = [(user_id, currency, amount) for user_id, values in balances.items()
+                for currency, amount in values.items()]
+        self._queue(self._seed, rows)
+
+    def _seed(self, rows):
+        with self._write_lock() as conn:
+            conn.executemany("INSERT OR IGNORE INTO balances (user_id, currency, amount) VALUES (?, ?, ?)", rows)
+
+    def apply(self, changes):
+        """Apply ``{(user_id, currency): (value or None, delta)}`` atomically.
+
+        ``value`` sets the balance (then adds ``delta``); ``None`` adds
+        ``delta`` to whatever the store holds, and a negative ``delta`` only
+        if the balance covers it.  Returns ``{(user_id, currency): new
+        balance}``; raises ``InsufficientFunds`` and changes nothing if a
+        spend isn't covered, ``StoreBusy`` if the lock is taken (queued
+        writes may have run).
+        """
+        self.settle()
+        return self._apply(changes)
+
+    def _apply(self, changes):
+        results = {}
+        try:
+            with self._write_lock() as conn:
+                for (user_id, currency), (value, delta) in changes.items():
+                    results[user_id, currency] = self._change(conn, user_id, currency, value, delta)
+        except InsufficientFunds:
+            self.conflicts += 1
+            raise
+        self.transactions += 1
+        self._applied(results)
+        return results
+
+    @staticmethod
+    def _change(conn, user_id, currency, value, delta):
+        if value is not None:
+            row = conn.execute(
+                "INSERT INTO balances (user_id, currency, amount) VALUES (?, ?, ?) "
+                "ON CONFLICT DO UPDATE SET amount = excluded.amount RETURNING amount",
+                (user_id, currency, value + delta)).fetchone()
+        elif delta >= 0:
+            row = conn.execute(
+                "INSERT INTO balances (user_id, currency, amount) VALUES (?, ?, ?) "
+                "ON CONFLICT DO UPDATE SET amount = amount + excluded.amount RETURNING amount",
+                (user_id, currency, delta)).fetchone()
+        else:
+            row = conn.execute(
+                "UPDATE balances SET amount = amount + ? "
+                "WHERE user_id = ? AND currency = ? AND amount >= ? RETURNING amount",
+                (delta, user_id, currency, -delta)).fetchone()
+            if row is None:
+                balance = conn.execute(
+                    "SELECT amount FROM balances WHERE user_id = ? AND currency = ?",
+                    (user_id, currency)).fetchone()
+                raise InsufficientFunds(user_id, currency, balance[0] if balance else 0, -delta)
+        return row[0]
+
+    def add(self, user_id, currency, delta):
+        """Atomic ``balance += delta`` (conditional when negative); the new balance."""
+        return self.apply({(user_id, currency): (None, delta)})[user_id, currency]
+
+    def credit(self, user_id, currency, amount):
+        """Add a non-negative ``amount``, queued if the lock is taken."""
+        self._queue(self._apply, {(user_id, currency): (None, amount)})
+
+    def bulk(self, op):
+        """Repeat a bulk op (economy/columns.py) on every stored balance."""
+        self._queue(self._bulk, op)
+
+    def _bulk(self, op):
+        field = op['field']
+        if op['op'] != 'add':
+            assignment, params = "amount = CAST(amount * ? AS INTEGER)", (op['multiplier'],)
+        elif op['floor'] is None:
+            assignment, params = "amount = amount + ?", (op['amount'],)
+        else:
+            assignment, params = "amount = MAX(?, amount + ?)", (op['floor'], op['amount'])
+        with self._write_lock() as conn:
+            conn.execute(f"UPDATE balances SET {assignment} WHERE currency = ?", params + (field,))
+        self.transactions += 1
+        self.cache.clear()
+        self.notifier.publish([ALL])
+
+    def delete(self, user_id):
+        self._queue(self._delete, user_id)
+
+    def _delete(self, user_id):
+        with self._write_lock() as conn:
+            conn.execute("DELETE FROM balances WHERE user_id = ?", (user_id,))
+        self.cache.pop(user_id, None)
+        self.notifier.publish([user_id])
+
+    # Shop stock -----------------------------------------------------------
+
+    def stock_levels(self):
+        """``{item_id: stock}`` of every limited item the store tracks."""
+        return dict(self.conn.execute("SELECT item_id, amount FROM stock"))
+
+    def purchase(self, user_id, currency, total, item_id, quantity, stock=None):
+        """Take ``total`` from a balance and ``quantity`` from the item's stock at once.
+
+        The store tracks an item's stock once some process sold it as a
+        limited item; ``stock`` is this process's count, used if the store
+        has none yet (``None`` for an unlimited item).  Returns ``(new
+        balance, stock left or None)``; raises ``InsufficientFunds`` or
+        ``SoldOut`` and changes nothing if either isn't covered,
+        ``StoreBusy`` if the lock is taken.
+        """
+        self.settle()
+        try:
+            with self._write_lock() as conn:
+                left = None
+                if stock is not None:
+                    conn.execute("INSERT OR IGNORE INTO stock (item_id, amount) VALUES (?, ?)", (item_id, stock))
+                row = conn.execute("UPDATE stock SET amount = amount - ? WHERE item_id = ? AND amount >= ? "
+                                   "RETURNING amount", (quantity, item_id, quantity)).fetchone()
+                if row is not None:
+                    left = row[0]
+                else:
+                    row = conn.execute("SELECT amount FROM stock WHERE item_id = ?", (item_id,)).fetchone()
+                    if row is not None:
+                        raise SoldOut(item_id, row[0])
+                balance = self._change(conn, user_id, currency, None, -total)
+        except (InsufficientFunds, SoldOut):
+            self.conflicts += 1
+            raise
+        self.transactions += 1
+        self._applied({(user_id, currency): balance})
+        return balance, left
+
+    def set_stock(self, item_id, amount):
+        """Set an item's stock (admin edits); ``None`` stops tracking it."""
+        self._queue(self._set_stock, item_id, amount)
+
+    def _set_stock(self, item_id, amount):
+        with self._write_lock() as conn:
+            if amount is None:
+                conn.execute("DELETE FROM stock WHERE item_id = ?", (item_id,))
+            else:
+                conn.execute("INSERT INTO stock (item_id, amount) VALUES (?, ?) "
+                             "ON CONFLICT DO UPDATE SET amount = excluded.amount", (item_id, amount))
+
+    def _applied(self, results):
+        expires = self.clock() + self.ttl
+        for (user_id, currency), amount in results.items():
+            entry = self.cache.get(user_id)
+            if entry is not None:
+                entry[1][currency] = amount
+            else:
+                self.cache[user_id] = (expires, {currency: amount})
+        self.notifier.publish(dict.fromkeys(user_id for user_id, _ in results))
+
+    # In-memory records ----------------------------------------------------
+
+    @contextlib.contextmanager
+    def quiet(self):
+        """Write store values into records without sending them back."""
+        self._quiet += 1
+        try:
+            yield
+        finally:
+            self._quiet -= 1
+
+    def attach(self, users):
+        """Mirror ``users`` (a ``UserRepository``) into the store.
+
+        Call it before any other index is added, so a rejected spend is
+        undone before leaderboards or aggregates see it.
+        """
+        self.seed({key: {currency: record[currency] for currency in CURRENCIES}
+                   for key, record in users.records()})
+        for currency in CURRENCIES:
+            users.add_aggregate(currency, BalanceSync(self, users, currency))
+
+    def refresh(self, user_id, record):
+        """Bring ``record``'s balances in line with the store.
+
+        Runs queued writes first (they may be ahead of the store), so it can
+        raise ``StoreBusy``; call it through ``retry()`` on the event loop.
+        """
+        self.settle()
+        stored = self.balances(user_id)
+        if not stored:
+            self._seed([(user_id, currency, record[currency]) for currency in CURRENCIES])
+            return
+        with self.quiet():
+            for currency, amount in stored.items():
+                if record[currency] != amount:
+                    record[currency] = amount
+
+    def close(self):
+        if self._replay is not None:
+            self._replay.cancel()
+        # Nothing will replay queued writes any more; wait for the lock instead
+        self._settle_blocking()
+        self.notifier.close()
+        self.conn.close()
+
+    def stats(self):
+        return {
+            'cached_users': len(self.cache),
+            'cache_hits': self.hits,
+            'cache_misses': self.misses,
+            'invalidations': self.invalidations,
+            'store_transactions': self.transactions,
+            'insufficient': self.conflicts,
+            'store_busy': self.busy,
+            'deferred_writes': self.deferred,
+            'queued_writes': len(self.backlog),
+            'notifications_sent': self.notifier.sent,
+            'notifications_received': self.notifier.received,
+        }
+
+
+class BalanceSync:
+    """Repository index that forwards one currency's changes to the store."""
+
+    def __init__(self, store, users, currency):
+        self.store = store
+        self.users = users
+        self.currency = currency
+
+    def insert(self, key, value):
+        self.store.seed({key: {self.currency: value}})
+
+    def remove(self, key, value):
+        if not self.store._quiet:
+            self.store.delete(key)
+
+    def move(self, key, old, new):
+        if self.store._quiet or new == old:
+            return
+        if new > old:
+            self.store.credit(key, self.currency, new - old)
+            return
+        try:
+            self.store.add(key, self.currency, new - old)
+        except (InsufficientFunds, StoreBusy):
+            # Nothing else has seen the write yet (see attach()); undo it
+            dict.__getitem__(self.users, key).set_untracked(self.currency, old)
+            raise
+
+    def bulk_changed(self, op=None):
+        if op is not None and not self.store._quiet:
+            self.store.bulk(op)
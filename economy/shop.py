@@ -0,0 +1,149 @@
+"""Shop purchases: balance check, stock and inventory in one step.
+
+``PurchaseEngine.buy()`` checks the item, takes the price from the buyer's
+balance in the item's currency, decrements limited stock and adds to the
+buyer's inventory counter without awaiting anything in between.  Commands
+run on one event loop, so a burst of concurrent ``!buy`` calls is applied
+one purchase at a time: the stock check and the decrement can't be split
+by another buyer and an item can't be oversold.  A flush captures either
+the whole purchase or none of it.
+
+The inventory is the record's ``inventory`` dict used as ``{item_id:
+count}``; each purchase changes one key, so change tracking persists just
+``(user, 'inventory', item_id)``.  Stock of ``UNLIMITED_STOCK`` or more
+means "not limited" (the shop doesn't display it either) and is never
+decremented.  With a ``ledger`` the payment is posted to ``SHOP`` in the
+same step.
+
+With a ``shared`` store (economy/shared_store.py) several processes sell
+from the same stock: the store decrements it together with the payment in
+one conditional transaction, and the item's local ``stock`` only mirrors
+what the store returned.  ``restock()`` forwards admin edits of an item's
+stock to the store.
+"""
+from economy.ledger import SHOP
+from economy.shared_store import SoldOut
+from economy.transactions import InsufficientFunds
+
+UNLIMITED_STOCK = 999
+CURRENCIES = ('reiatsu', 'soul_fragments')
+
+
+class PurchaseError(Exception):
+    """A rejected purchase; ``reason`` is one of the codes below."""
+
+    UNKNOWN = 'unknown'
+    UNAVAILABLE = 'unavailable'
+    SOLD_OUT = 'sold_out'
+    INSUFFICIENT = 'insufficient'
+    QUANTITY = 'quantity'
+
+    def __init__(self, reason, item=None, detail=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.item = item
+        # Stock left for SOLD_OUT, balance for INSUFFICIENT
+        self.detail = detail
+
+
+def limited(item):
+    return item['stock'] < UNLIMITED_STOCK
+
+
+class PurchaseEngine:
+    """Applies purchases from ``items`` (the shop table) to user records."""
+
+    def __init__(self, items, on_stock_change=None, ledger=None, shared=None):
+        self.items = items
+        self.ledger = ledger
+        self.shared = shared
+        # Called with the item id when limited stock moves (shop listings)
+        self.on_stock_change = on_stock_change
+        self.sold = {}  # item_id -> units sold since start
+        self.rejected = {}  # reason -> count
+
+    def buy(self, user_id, record, item_id, quantity=1):
+        """Buy ``quantity`` of ``item_id`` for ``record`` (user ``user_id``).
+
+        Returns ``(item, total_price, owned)``; raises ``PurchaseError``
+        and changes nothing if the purchase isn't possible.
+        """
+        # No await in here: check and apply are one step for the event loop
+        item = self.items.get(item_id)
+        if item is None:
+            raise self._reject(PurchaseError.UNKNOWN)
+        if quantity < 1:
+            raise self._reject(PurchaseError.QUANTITY, item)
+        if not item.get('purchasable', True) or item['currency'] not in CURRENCIES:
+            raise self._reject(PurchaseError.UNAVAILABLE, item)
+        is_limited = limited(item)
+        # With a shared store its stock decides; the local count may be stale
+        if self.shared is None and is_limited and item['stock'] < quantity:
+            raise self._reject(PurchaseError.SOLD_OUT, item, item['stock'])
+        currency = item['currency']
+        total = item['price'] * quantity
+        balance = record[currency]
+        if balance < total:
+            raise self._reject(PurchaseError.INSUFFICIENT, item, balance)
+
+        if self.shared is not None:
+            # StoreBusy propagates with nothing changed; the caller retries
+            try:
+                balance, left = self.shared.purchase(user_id, currency, total, item_id, quantity,
+                                                     stock=item['stock'] if is_limited else None)
+            except InsufficientFunds as error:
+                raise self._reject(PurchaseError.INSUFFICIENT, item, error.balance) from None
+            except SoldOut as error:
+                self._set_stock(item, item_id, error.left)
+                raise self._reject(PurchaseError.SOLD_OUT, item, error.left) from None
+            with self.shared.quiet():
+                record[currency] = balance
+            is_limited = left is not None
+            if is_limited:
+                item['stock'] = left
+        else:
+            record[currency] = balance - total
+            if is_limited:
+                item['stock'] -= quantity
+        inventory = record['inventory']
+        owned = inventory.get(item_id, 0) + quantity
+        inventory[item_id] = owned
+        self.sold[item_id] = self.sold.get(item_id, 0) + quantity
+        if self.ledger is not None:
+            self.ledger.post('purchase', user_id, SHOP, total, currency, ref=item_id)
+        if is_limited and self.on_stock_change is not None:
+            self.on_stock_change(item_id)
+        return item, total, owned
+
+    def restock(self, item_id):
+        """Forward an admin edit of ``item_id``'s stock (or its removal) to the shared store."""
+        if self.shared is None:
+            return
+        item = self.items.get(item_id)
+        self.shared.set_stock(item_id, item['stock'] if item is not None and limited(item) else None)
+
+    def sync_stock(self):
+        """Take the shared store's stock for the items it tracks (startup)."""
+        if self.shared is None:
+            return
+        for item_id, left in self.shared.stock_levels().items():
+            item = self.items.get(item_id)
+            if item is not None:
+                self._set_stock(item, item_id, left)
+
+    def _set_stock(self, item, item_id, left):
+        if item['stock'] != left:
+            item['stock'] = left
+            if self.on_stock_change is not None:
+                self.on_stock_change(item_id)
+
+    def _reject(self, reason, item=None, detail=None):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        return PurchaseError(reason, item, detail)
+
+    def stats(self):
+        return {
+            'units_sold': sum(self.sold.values()),
+            'sold': dict(self.sold),
+            'rejected': dict(self.rejected),
+        }
@@ -0,0 +1,234 @@
+"""Versioned binary snapshot format for fast cold loads.
+
+Layout (all integers big-endian)::
+
+    8s   magic  b'SOULSNP\\0'
+    H    format version
+    B    codec        0 = compact JSON, 1 = marshal, 2 = msgpack
+    B    compression  0 = none, 1 = zlib, 2 = zstd
+    B    marshal version used by the writer (codec 1 only)
+    3x   reserved
+    I    section count
+    then per section:
+    H    name length, name (utf-8)
+    Q    payload length, payload
+
+Each economy table is its own section so it can be decoded on its own.
+``marshal`` is the default codec: it is stdlib, C-speed in both directions
+and decodes plain dicts several times faster than ``json.load``.  msgpack
+and zstd are used only when their modules are installed.  Snapshots are
+trusted local files; do not load ones from elsewhere.
+
+``read_state()`` sniffs the magic, so JSON and binary snapshots load through
+the same call.  Converter::
+
+    python -m economy.snapshot to-binary economy_data.json economy_data.snap
+    python -m economy.snapshot to-json economy_data.snap economy_data.json
+"""
+import argparse
+import gc
+import json
+import marshal
+import struct
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b'SOULSNP\0'
+VERSION = 1
+HEADER = struct.Struct('>8sHBBB3xI')
+SECTION_NAME = struct.Struct('>H')
+SECTION_SIZE = struct.Struct('>Q')
+
+CODECS = {'json': 0, 'marshal': 1, 'msgpack': 2}
+COMPRESSIONS = {'none': 0, 'zlib': 1, 'zstd': 2}
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def json_default(value):
+    """``default=`` hook for record types (economy/records.py) in JSON/msgpack."""
+    to_dict = getattr(value, 'to_dict', None)
+    if to_dict is None:
+        raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+    return to_dict()
+
+
+def _plain(value):
+    """Tracked containers and records -> plain dicts/lists (marshal only takes exact types)."""
+    if isinstance(value, dict):
+        return {k: v if isinstance(v, (str, int, float, bool, type(None))) else _plain(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [v if isinstance(v, (str, int, float, bool, type(None))) else _plain(v) for v in value]
+    if hasattr(value, 'to_dict'):
+        return _plain(value.to_dict())
+    return value
+
+
+def _encode(codec, table):
+    if codec == 'json':
+        return json.dumps(table, separators=(',', ':'), default=json_default).encode('utf-8')
+    if codec == 'marshal':
+        try:
+            return marshal.dumps(table)
+        except ValueError:
+            # Live tables still hold tracked containers
+            return marshal.dumps(_plain(table))
+    if msgpack is None:
+        raise SnapshotError("msgpack codec requested but msgpack is not installed")
+    return msgpack.packb(table, use_bin_type=True, default=json_default)
+
+
+def _decode(codec, payload):
+    if codec == 0:
+        return json.loads(bytes(payload))
+    if codec == 1:
+        return marshal.loads(payload)
+    if codec == 2:
+        if msgpack is None:
+            raise SnapshotError("snapshot uses msgpack but msgpack is not installed")
+        return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+    raise SnapshotError(f"unknown snapshot codec {codec}")
+
+
+def _compress(compression, payload):
+    if compression == 'none':
+        return payload
+    if compression == 'zlib':
+        return zlib.compress(payload, 1)
+    if zstandard is None:
+        raise SnapshotError("zstd compression requested but zstandard is not installed")
+    return zstandard.ZstdCompressor(level=3).compress(payload)
+
+
+def _decompress(compression, payload):
+    if compression == 0:
+        return payload
+    if compression == 1:
+        return zlib.decompress(payload)
+    if compression == 2:
+        if zstandard is None:
+            raise SnapshotError("snapshot is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    raise SnapshotError(f"unknown snapshot compression {compression}")
+
+
+def encode_snapshot(state, codec='marshal', compression='none'):
+    """Encode a ``{table: {...}}`` state into snapshot bytes."""
+    if codec not in CODECS:
+        raise SnapshotError(f"unknown codec {codec!r}")
+    if compression not in COMPRESSIONS:
+        raise SnapshotError(f"unknown compression {compression!r}")
+    parts = [HEADER.pack(MAGIC, VERSION, CODECS[codec], COMPRESSIONS[compression],
+                         marshal.version, len(state))]
+    for name, table in state.items():
+        payload = _compress(compression, _encode(codec, table))
+        encoded_name = name.encode('utf-8')
+        parts.append(SECTION_NAME.pack(len(encoded_name)))
+        parts.append(encoded_name)
+        parts.append(SECTION_SIZE.pack(len(payload)))
+        parts.append(payload)
+    return b''.join(parts)
+
+
+def decode_snapshot(data, tables=None):
+    """Decode snapshot bytes; ``tables`` limits which sections are decoded."""
+    magic, version, codec, compression, marshal_version, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise SnapshotError("not a Soul Society snapshot")
+    if version > VERSION:
+        raise SnapshotError(f"snapshot format v{version} is newer than this bot (v{VERSION})")
+    if codec == 1 and marshal_version > marshal.version:
+        raise SnapshotError("snapshot was written by a newer Python; convert it with to-json")
+
+    state = {}
+    offset = HEADER.size
+    view = memoryview(data)
+    for _ in range(count):
+        (name_length,) = SECTION_NAME.unpack_from(data, offset)
+        offset += SECTION_NAME.size
+        name = bytes(view[offset:offset + name_length]).decode('utf-8')
+        offset += name_length
+        (size,) = SECTION_SIZE.unpack_from(data, offset)
+        offset += SECTION_SIZE.size
+        if tables is None or name in tables:
+            state[name] = _decode(codec, _decompress(compression, view[offset:offset + size]))
+        offset += size
+    return state
+
+
+def is_snapshot(data):
+    return data[:len(MAGIC)] == MAGIC
+
+
+def read_state(path):
+    """Load a JSON or binary snapshot from ``path`` ({} if it does not exist)."""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return {}
+    # Millions of fresh dicts would otherwise trigger repeated full GC passes
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        if is_snapshot(data):
+            return decode_snapshot(data)
+        return json.loads(data)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def encode_state(state, fmt='json', compression='none'):
+    """Snapshot bytes for ``state`` in the configured format ('json', 'binary' or 'msgpack').
+
+    Called on the save worker, so ``state`` must be detached from the live
+    tables (``snapshot_tables()`` in economy/tracking.py).
+    """
+    if fmt == 'json':
+        return json.dumps(state, separators=(',', ':'), default=json_default).encode('utf-8')
+    if fmt == 'binary':
+        return encode_snapshot(state, 'marshal', compression)
+    if fmt == 'msgpack':
+        return encode_snapshot(state, 'msgpack', compression)
+    raise SnapshotError(f"unknown snapshot format {fmt!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert economy snapshots between JSON and binary")
+    sub = parser.add_subparsers(dest='command', required=True)
+    to_binary = sub.add_parser('to-binary')
+    to_binary.add_argument('source')
+    to_binary.add_argument('target')
+    to_binary.add_argument('--codec', choices=sorted(CODECS), default='marshal')
+    to_binary.add_argument('--compression', choices=sorted(COMPRESSIONS), default='none')
+    to_json = sub.add_parser('to-json')
+    to_json.add_argument('source')
+    to_json.add_argument('target')
+    to_json.add_argument('--indent', type=int, default=2)
+    args = parser.parse_args()
+
+    state = read_state(args.source)
+    if args.command == 'to-binary':
+        payload = encode_snapshot(state, args.codec, args.compression)
+        with open(args.target, 'wb') as f:
+            f.write(payload)
+    else:
+        with open(args.target, 'w') as f:
+            json.dump(state, f, indent=args.indent or None)
+    print(f"Converted {args.source} -> {args.target} ({len(state.get('user_data', {}))} users)")
+
+
+if __name__ == '__main__':
+    main()
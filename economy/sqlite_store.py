@@ -0,0 +1,573 @@
+"""SQLite storage backend (stdlib ``sqlite3``, WAL mode).
+
+Users, offers, bets and shop items live in real tables with indexes.  Each
+flush turns the changed paths recorded by the tracked tables into per-row
+upserts/deletes inside one transaction, so a ``!work`` costs a single-row
+write instead of a rewrite of the whole economy.  The writing connection
+is owned by the persistence engine's worker thread; load, commit and the
+bulk updates run there.  With ``lazy_users`` set, users are not loaded up
+front and a separate read connection serves them to the event loop on
+demand.
+
+One-shot migration from the JSON snapshot (plus any journal tail)::
+
+    python -m economy.sqlite_store migrate --json economy_data.json --db economy.db
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+from economy.columns import check_add, check_scale
+from economy.tracking import MISSING
+
+# Seconds a read on the event loop waits for a lock before failing
+READ_TIMEOUT = 0.1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    reiatsu INTEGER NOT NULL DEFAULT 0,
+    soul_fragments INTEGER NOT NULL DEFAULT 0,
+    zanpakuto TEXT,
+    stand TEXT,
+    rank TEXT,
+    level INTEGER NOT NULL DEFAULT 1,
+    exp INTEGER NOT NULL DEFAULT 0,
+    daily_streak INTEGER NOT NULL DEFAULT 0,
+    last_daily TEXT,
+    last_work TEXT,
+    last_train TEXT,
+    inventory TEXT NOT NULL DEFAULT '{}',
+    active_bets TEXT NOT NULL DEFAULT '[]',
+    total_winnings INTEGER NOT NULL DEFAULT 0,
+    battles_won INTEGER NOT NULL DEFAULT 0,
+    achievements TEXT NOT NULL DEFAULT '[]',
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS users_reiatsu ON users (reiatsu DESC);
+CREATE INDEX IF NOT EXISTS users_level ON users (level DESC);
+
+CREATE TABLE IF NOT EXISTS offers (
+    archived INTEGER NOT NULL,
+    match_id TEXT NOT NULL,
+    id TEXT,
+    team1 TEXT,
+    team2 TEXT,
+    profit_percentage INTEGER,
+    created_at TEXT,
+    total_team1_bets INTEGER NOT NULL DEFAULT 0,
+    total_team2_bets INTEGER NOT NULL DEFAULT 0,
+    total_bets_count INTEGER NOT NULL DEFAULT 0,
+    status TEXT,
+    locked_at TEXT,
+    completed_at TEXT,
+    winning_team INTEGER,
+    extra TEXT,
+    PRIMARY KEY (archived, match_id)
+);
+CREATE INDEX IF NOT EXISTS offers_status ON offers (archived, status);
+
+CREATE TABLE IF NOT EXISTS bets (
+    archived INTEGER NOT NULL,
+    match_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    team TEXT,
+    amount INTEGER,
+    potential_return INTEGER,
+    user_name TEXT,
+    extra TEXT,
+    PRIMARY KEY (archived, match_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS bets_user ON bets (user_id);
+
+CREATE TABLE IF NOT EXISTS shop_items (
+    item_id TEXT PRIMARY KEY,
+    name TEXT,
+    description TEXT,
+    price INTEGER,
+    currency TEXT,
+    category TEXT,
+    stock INTEGER,
+    purchasable INTEGER,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS shop_category ON shop_items (category);
+
+CREATE TABLE IF NOT EXISTS misc (
+    table_name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (table_name, key)
+);
+"""
+
+
+class RowSpec:
+    """Maps a record dict to a table row and back.
+
+    ``json_columns`` hold nested containers, ``optional_columns`` are left out
+    of the record when NULL, and keys without a column go to ``extra``.
+    """
+
+    def __init__(self, table, key_column, columns, json_columns=(), optional_columns=(), bool_columns=(),
+                 prefix_columns=()):
+        self.table = table
+        self.key_column = key_column
+        self.columns = columns
+        self.prefix_columns = list(prefix_columns)
+        self.json_columns = set(json_columns)
+        self.optional_columns = set(optional_columns)
+        self.bool_columns = set(bool_columns)
+        self.column_set = set(columns)
+        names = self.prefix_columns + [key_column] + list(columns) + ['extra']
+        self.upsert_sql = (
+            f"INSERT OR REPLACE INTO {table} ({', '.join(names)}) "
+            f"VALUES ({', '.join('?' * len(names))})"
+        )
+        self.select_sql = f"SELECT {', '.join(names)} FROM {table}"
+
+    def to_row(self, key, record, prefix=()):
+        if hasattr(record, 'to_dict'):
+            record = record.to_dict()
+        row = list(prefix) + [key]
+        for column in self.columns:
+            value = record.get(column)
+            if column in self.json_columns:
+                value = json.dumps(value if value is not None else {}, separators=(',', ':'))
+            elif column in self.bool_columns and value is not None:
+                value = int(bool(value))
+            row.append(value)
+        extra = {k: v for k, v in record.items() if k not in self.column_set}
+        row.append(json.dumps(extra, separators=(',', ':')) if extra else None)
+        return row
+
+    def from_row(self, row):
+        """Return ``(prefix_values, key, record)`` for a row of ``select_sql``."""
+        prefix = tuple(row[:len(self.prefix_columns)])
+        row = row[len(self.prefix_columns):]
+        record = {}
+        for column, value in zip(self.columns, row[1:]):
+            if column in self.optional_columns and value is None:
+                continue
+            if column in self.json_columns:
+                value = json.loads(value)
+            elif column in self.bool_columns and value is not None:
+                value = bool(value)
+            record[column] = value
+        if row[-1]:
+            record.update(json.loads(row[-1]))
+        return prefix, row[0], record
+
+
+USERS = RowSpec('users', 'user_id', [
+    'reiatsu', 'soul_fragments', 'zanpakuto', 'stand', 'rank', 'level', 'exp',
+    'daily_streak', 'last_daily', 'last_work', 'last_train', 'inventory',
+    'active_bets', 'total_winnings', 'battles_won', 'achievements'
+], json_columns=('inventory', 'active_bets', 'achievements'))
+
+# 'bets' is stored in its own table; archived=1 rows belong to offer_results
+OFFERS = RowSpec('offers', 'match_id', [
+    'id', 'team1', 'team2', 'profit_percentage', 'created_at', 'total_team1_bets',
+    'total_team2_bets', 'total_bets_count', 'status', 'locked_at', 'completed_at', 'winning_team'
+], optional_columns=('id', 'locked_at', 'completed_at', 'winning_team'), prefix_columns=('archived',))
+
+BETS = RowSpec('bets', 'user_id', ['team', 'amount', 'potential_return', 'user_name'],
+               prefix_columns=('archived', 'match_id'))
+
+SHOP = RowSpec('shop_items', 'item_id', [
+    'name', 'description', 'price', 'currency', 'category', 'stock', 'purchasable'
+], optional_columns=('category',), bool_columns=('purchasable',))
+
+OFFER_TABLES = {'active_offers': 0, 'offer_results': 1}
+
+
+def connect(path, timeout=5.0):
+    # A partition may be loaded in a worker thread and then used on the loop
+    # (economy/partitions.py); no connection is used by two threads at once
+    conn = sqlite3.connect(path, isolation_level=None, timeout=timeout, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA foreign_keys=OFF')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def offer_ops(match_id, offer, archived, with_bets=True):
+    """Statements that store ``offer`` (and optionally all of its bets)."""
+    record = {k: v for k, v in offer.items() if k != 'bets'}
+    ops = [(OFFERS.upsert_sql, OFFERS.to_row(match_id, record, prefix=(archived,)))]
+    if with_bets:
+        ops.extend(bets_replace_ops(match_id, offer.get('bets', {}), archived))
+    return ops
+
+
+def bets_replace_ops(match_id, bets, archived):
+    ops = [("DELETE FROM bets WHERE archived = ? AND match_id = ?", (archived, match_id))]
+    ops.extend(bet_upsert_op(match_id, user_id, bet, archived) for user_id, bet in bets.items())
+    return ops
+
+
+def bet_upsert_op(match_id, user_id, bet, archived):
+    return BETS.upsert_sql, BETS.to_row(user_id, bet, prefix=(archived, match_id))
+
+
+def bulk_op_statement(op):
+    """UPDATE equivalent of a bulk op on users (see economy/columns.py)."""
+    field = op['field']
+    if op['op'] == 'add':
+        if op['floor'] is None:
+            return f"UPDATE users SET {field} = {field} + ?", (op['amount'],)
+        return f"UPDATE users SET {field} = MAX(?, {field} + ?)", (op['floor'], op['amount'])
+    return f"UPDATE users SET {field} = CAST({field} * ? AS INTEGER)", (op['multiplier'],)
+
+
+def state_ops(state):
+    """Statements that write a whole plain-dict economy (used by the migrator)."""
+    ops = []
+    for user_id, record in state.get('user_data', {}).items():
+        ops.append((USERS.upsert_sql, USERS.to_row(user_id, record)))
+    for name, archived in OFFER_TABLES.items():
+        for match_id, offer in state.get(name, {}).items():
+            ops.extend(offer_ops(match_id, offer, archived))
+    for item_id, item in state.get('shop_items', {}).items():
+        ops.append((SHOP.upsert_sql, SHOP.to_row(item_id, item)))
+    for name in ('daily_missions', 'tournaments'):
+        for key, value in state.get(name, {}).items():
+            ops.append(("INSERT OR REPLACE INTO misc (table_name, key, value) VALUES (?, ?, ?)",
+                        (name, key, json.dumps(value))))
+    return ops
+
+
+class SqliteBackend:
+    """Per-row upserts into a WAL-mode SQLite database."""
+
+    name = 'sqlite'
+
+    def __init__(self, path, lazy_users=False):
+        self.path = path
+        # When set, load() leaves users out and they are read on demand
+        # through the reader methods below (see economy/users.py)
+        self.lazy_users = lazy_users
+        self._conn = None
+        self._reader = None
+        self.rows_written = 0
+        self.transactions = 0
+        self.last_commit_ms = 0.0
+
+    @property
+    def conn(self):
+        # Created lazily so it belongs to the engine's worker thread
+        if self._conn is None:
+            self._conn = connect(self.path)
+        return self._conn
+
+    def load(self):
+        conn = self.conn
+        state = {'user_data': {}, 'active_offers': {}, 'offer_results': {}, 'shop_items': {},
+                 'daily_missions': {}, 'tournaments': {}}
+        if not self.lazy_users:
+            for row in conn.execute(USERS.select_sql):
+                _, user_id, record = USERS.from_row(row)
+                state['user_data'][user_id] = record
+
+        bets = {}
+        for row in conn.execute(f"{BETS.select_sql} ORDER BY rowid"):
+            prefix, user_id, bet = BETS.from_row(row)
+            bets.setdefault(prefix, {})[user_id] = bet
+        for row in conn.execute(f"{OFFERS.select_sql} ORDER BY rowid"):
+            (archived,), match_id, offer = OFFERS.from_row(row)
+            offer['bets'] = bets.get((archived, match_id), {})
+            table = 'offer_results' if archived else 'active_offers'
+            state[table][match_id] = offer
+
+        for row in conn.execute(SHOP.select_sql):
+            _, item_id, item = SHOP.from_row(row)
+            state['shop_items'][item_id] = item
+        for name, key, value in conn.execute("SELECT table_name, key, value FROM misc"):
+            state.setdefault(name, {})[key] = json.loads(value)
+        return state
+
+    # User reads ------------------------------------------------------------
+    #
+    # Commands make their users resident first with get_users() on the
+    # engine's worker (UserRepository.prefetch()), where a read may wait out
+    # a lock with SQLite's normal busy timeout.  A second connection serves
+    # whatever still misses on the event loop, and the streaming reads.
+    # WAL lets it read while the worker writes; it only ever sees committed
+    # rows, which is why the repository pins unflushed records.  WAL readers
+    # normally never wait, but a checkpoint that resets the log or another
+    # process holding an exclusive lock can make them; the reader's busy
+    # timeout is READ_TIMEOUT rather than SQLite's 5 s, after which the
+    # lookup raises sqlite3.OperationalError and only that command fails.
+
+    def get_users(self, user_ids, chunk=500):
+        """``{user_id: record}`` for the stored ones of ``user_ids`` (worker thread)."""
+        found = {}
+        for start in range(0, len(user_ids), chunk):
+            keys = user_ids[start:start + chunk]
+            placeholders = ', '.join('?' * len(keys))
+            for row in self.conn.execute(f"{USERS.select_sql} WHERE user_id IN ({placeholders})", keys):
+                _, user_id, record = USERS.from_row(row)
+                found[user_id] = record
+        return found
+
+    @property
+    def reader(self):
+        if self._reader is None:
+            self._reader = connect(self.path, timeout=READ_TIMEOUT)
+        return self._reader
+
+    def get_user(self, user_id):
+        row = self.reader.execute(f"{USERS.select_sql} WHERE user_id = ?", (user_id,)).fetchone()
+        return USERS.from_row(row)[2] if row else None
+
+    def user_exists(self, user_id):
+        return self.reader.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone() is not None
+
+    def count_users(self):
+        return self.reader.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def iter_users(self, batch=1000, conn=None):
+        """Yield ``(user_id, record)`` for every user, ``batch`` rows per query.
+
+        Reads through ``conn`` (default: the loop's reader connection).
+        """
+        conn = conn or self.reader
+        last = ''
+        while True:
+            rows = conn.execute(
+                f"{USERS.select_sql} WHERE user_id > ? ORDER BY user_id LIMIT ?", (last, batch)
+            ).fetchall()
+            for row in rows:
+                _, user_id, record = USERS.from_row(row)
+                yield user_id, record
+            if len(rows) < batch:
+                return
+            last = rows[-1][0]
+
+    def top_users(self, field, count):
+        """The ``count`` users with the highest numeric ``field``."""
+        if field not in USERS.column_set or field in USERS.json_columns:
+            raise ValueError(f"cannot rank users by {field!r}")
+        rows = self.reader.execute(f"{USERS.select_sql} ORDER BY {field} DESC LIMIT ?", (count,))
+        return [USERS.from_row(row)[1:] for row in rows]
+
+    # Bulk user updates (worker thread, via PersistenceEngine.run_in_store) --
+
+    def bulk_add(self, field, amount):
+        """Add ``amount`` to ``field`` for every user, clamping at zero."""
+        self._check_numeric(field)
+        # SQLite turns an overflowing sum into a REAL instead of failing
+        check_add(field, *self._bounds(field), amount)
+        return self._bulk(f"UPDATE users SET {field} = MAX(0, {field} + ?)", (amount,), [field])
+
+    def bulk_scale(self, fields, multiplier):
+        """Multiply ``fields`` by ``multiplier``, truncating like ``int()``."""
+        for field in fields:
+            self._check_numeric(field)
+            check_scale(field, *self._bounds(field), multiplier)
+        assignments = ', '.join(f"{field} = CAST({field} * ? AS INTEGER)" for field in fields)
+        return self._bulk(f"UPDATE users SET {assignments}", (multiplier,) * len(fields), fields)
+
+    def _bounds(self, field):
+        # Only this process writes the table (the worker), so nothing moves
+        # between this read and the UPDATE
+        return self.conn.execute(f"SELECT MIN({field}), MAX({field}) FROM users").fetchone()
+
+    def sum_users(self, fields):
+        """(user count, {field: sum}) straight from the table."""
+        for field in fields:
+            self._check_numeric(field)
+        sums = ', '.join(f"COALESCE(SUM({field}), 0)" for field in fields)
+        row = self.conn.execute(f"SELECT COUNT(*), {sums} FROM users").fetchone()
+        return row[0], dict(zip(fields, row[1:]))
+
+    def user_figures(self):
+        """``scan()`` inputs (economy/aggregates.py) from aggregate queries.
+
+        Returns (users, sums, power counts, rank counts, active bets, bet
+        amount), taken in one read transaction.
+        """
+        conn = self.conn
+        conn.execute('BEGIN')
+        try:
+            users, reiatsu, fragments, level, bets = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(reiatsu), 0), COALESCE(SUM(soul_fragments), 0), "
+                "COALESCE(SUM(level), 0), COALESCE(SUM(json_array_length(active_bets)), 0) FROM users"
+            ).fetchone()
+            power_counts = {(bool(zanpakuto), bool(stand)): count for zanpakuto, stand, count in conn.execute(
+                "SELECT COALESCE(zanpakuto, '') != '', COALESCE(stand, '') != '', COUNT(*) FROM users GROUP BY 1, 2"
+            )}
+            ranks = dict(conn.execute("SELECT rank, COUNT(*) FROM users GROUP BY rank"))
+            amount = conn.execute(
+                "SELECT COALESCE(SUM(json_extract(bet.value, '$.amount')), 0) "
+                "FROM users, json_each(users.active_bets) AS bet WHERE users.active_bets != '[]'"
+            ).fetchone()[0]
+        finally:
+            conn.execute('COMMIT')
+        sums = {'reiatsu': reiatsu, 'soul_fragments': fragments, 'level': level}
+        return users, sums, power_counts, ranks, bets, amount
+
+    def rank_user(self, field, user_id):
+        """(1-based position by ``field`` desc then user_id, user count), or None.
+
+        The users_<field> index makes this a range count rather than a sort.
+        """
+        self._check_numeric(field)
+        conn = self.conn
+        row = conn.execute(f"SELECT {field} FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        value = row[0] or 0
+        ahead = conn.execute(
+            f"SELECT COUNT(*) FROM users WHERE {field} > ? OR ({field} = ? AND user_id < ?)",
+            (value, value, user_id)).fetchone()[0]
+        return ahead + 1, conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def _check_numeric(self, field):
+        if field not in ('reiatsu', 'soul_fragments', 'level', 'exp', 'daily_streak',
+                         'total_winnings', 'battles_won'):
+            raise ValueError(f"cannot bulk-update users.{field}")
+
+    def _bulk(self, sql, params, fields):
+        """Run one UPDATE; returns (rows affected, {field: total change})."""
+        conn = self.conn
+        totals = ', '.join(f"COALESCE(SUM({field}), 0)" for field in fields)
+        conn.execute('BEGIN')
+        try:
+            before = conn.execute(f"SELECT {totals} FROM users").fetchone()
+            affected = conn.execute(sql, params).rowcount
+            after = conn.execute(f"SELECT {totals} FROM users").fetchone()
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self.rows_written += affected
+        self.transactions += 1
+        return affected, {field: after[i] - before[i] for i, field in enumerate(fields)}
+
+    # Flushing (prepare on the loop, commit on the worker) ----------------
+
+    def prepare(self, tables, force_snapshot=False):
+        ops = []
+        for name, table in tables.items():
+            # Bulk ops first: the row upserts below carry final values
+            ops.extend(bulk_op_statement(op) for op in table.drain_bulk())
+            changes = table.drain()
+            if not changes:
+                continue
+            if name == 'user_data':
+                ops.extend(self._keyed_ops(table, changes, USERS))
+            elif name in OFFER_TABLES:
+                ops.extend(self._offer_ops(table, changes, OFFER_TABLES[name]))
+            elif name == 'shop_items':
+                ops.extend(self._keyed_ops(table, changes, SHOP))
+            else:
+                for key in dict.fromkeys(path[0] for path in changes):
+                    value = table.resolve((key,))
+                    if value is MISSING:
+                        ops.append(("DELETE FROM misc WHERE table_name = ? AND key = ?", (name, key)))
+                    else:
+                        ops.append(("INSERT OR REPLACE INTO misc (table_name, key, value) VALUES (?, ?, ?)",
+                                    (name, key, json.dumps(value))))
+        return ops or None
+
+    def _keyed_ops(self, table, changes, spec):
+        # Whole-row upsert per changed record; rows are small
+        ops = []
+        for key in dict.fromkeys(path[0] for path in changes):
+            record = table.resolve((key,))
+            if record is MISSING:
+                ops.append((f"DELETE FROM {spec.table} WHERE {spec.key_column} = ?", (key,)))
+            else:
+                ops.append((spec.upsert_sql, spec.to_row(key, record)))
+        return ops
+
+    def _offer_ops(self, table, changes, archived):
+        ops = []
+        offer_rows = {}
+        for path in changes:
+            match_id = path[0]
+            offer = table.resolve((match_id,))
+            if offer is MISSING:
+                if len(path) == 1:
+                    ops.append(("DELETE FROM offers WHERE archived = ? AND match_id = ?", (archived, match_id)))
+                    ops.append(("DELETE FROM bets WHERE archived = ? AND match_id = ?", (archived, match_id)))
+                continue
+            if len(path) == 1:
+                ops.extend(offer_ops(match_id, offer, archived))
+            elif path[1] != 'bets':
+                offer_rows[match_id] = offer
+            elif len(path) == 2:
+                ops.extend(bets_replace_ops(match_id, offer.get('bets', {}), archived))
+            else:
+                bet = table.resolve(path)
+                if bet is MISSING:
+                    ops.append(("DELETE FROM bets WHERE archived = ? AND match_id = ? AND user_id = ?",
+                                (archived, match_id, path[2])))
+                else:
+                    ops.append(bet_upsert_op(match_id, path[2], bet, archived))
+        for match_id, offer in offer_rows.items():
+            ops.extend(offer_ops(match_id, offer, archived, with_bets=False))
+        return ops
+
+    def commit(self, ops):
+        start = time.perf_counter()
+        conn = self.conn
+        conn.execute('BEGIN')
+        try:
+            for sql, params in ops:
+                conn.execute(sql, params)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self.rows_written += len(ops)
+        self.transactions += 1
+        self.last_commit_ms = (time.perf_counter() - start) * 1000
+        # Row count stands in for bytes; SQLite owns the page writes
+        return len(ops)
+
+    def stats(self):
+        return {
+            'sqlite_rows_written': self.rows_written,
+            'sqlite_transactions': self.transactions,
+            'sqlite_last_commit_ms': self.last_commit_ms,
+        }
+
+
+def migrate(json_path, db_path):
+    """Copy the JSON snapshot (plus journal tail) into a fresh SQLite database."""
+    from economy.journal import JournalBackend
+
+    state = JournalBackend(json_path).load()
+    if os.path.exists(db_path):
+        raise SystemExit(f"{db_path} already exists; refusing to overwrite it")
+    conn = connect(db_path)
+    conn.execute('BEGIN')
+    for sql, params in state_ops(state):
+        conn.execute(sql, params)
+    conn.execute('COMMIT')
+    conn.close()
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soul Society SQLite storage tools")
+    sub = parser.add_subparsers(dest='command', required=True)
+    mig = sub.add_parser('migrate', help="One-shot import of economy_data.json into SQLite")
+    mig.add_argument('--json', default='economy_data.json')
+    mig.add_argument('--db', default='economy.db')
+    args = parser.parse_args()
+
+    state = migrate(args.json, args.db)
+    print(
+        f"Migrated {len(state.get('user_data', {}))} users, "
+        f"{len(state.get('active_offers', {})) + len(state.get('offer_results', {}))} offers and "
+        f"{len(state.get('shop_items', {}))} shop items -> {args.db}"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""Per-command latency with a breakdown into phases, for ``!perf``.
+
+Every command invocation gets an ``Invocation`` (``Timings.start()`` in
+the bot's before-invoke hook, ``finish()`` in the after-invoke hook).
+Code inside the command marks phases with ``Timings.phase(name)`` - the
+bot times ``init_user``, ``save_data``, the ``ctx.send`` round-trip to
+Discord and reaction waits this way - and whatever is left of the
+command's run time is recorded as the ``state`` phase: reading and
+mutating the economy plus any other awaits.
+
+The current invocation is found through a ``ContextVar``, like the economy
+partition (economy/partitions.py): each command runs in its own task, so
+phases of concurrent commands never mix, and phases outside any command
+(a background save, say) are still recorded globally.
+
+Samples go into ``RollingHistogram``s: a fixed ring of the most recent
+durations per command and per phase, so recording is an index update and
+percentiles are computed only when ``!perf`` asks, over recent traffic.
+"""
+import contextlib
+import contextvars
+import functools
+import time
+from array import array
+
+from economy.transactions import percentile
+
+WINDOW = 1024
+STATE = 'state'
+
+_invocation = contextvars.ContextVar('command_invocation', default=None)
+
+
+class RollingHistogram:
+    """The last ``window`` samples plus all-time count, total and max."""
+
+    __slots__ = ('samples', 'window', 'next', 'count', 'total', 'max')
+
+    def __init__(self, window=WINDOW):
+        self.samples = array('d')
+        self.window = window
+        self.next = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        if len(self.samples) < self.window:
+            self.samples.append(seconds)
+        else:
+            self.samples[self.next] = seconds
+            self.next = (self.next + 1) % self.window
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def summary(self):
+        ordered = sorted(self.samples)
+        return {
+            'count': self.count,
+            'avg_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'p50_ms': percentile(ordered, 0.50) * 1000,
+            'p95_ms': percentile(ordered, 0.95) * 1000,
+            'p99_ms': percentile(ordered, 0.99) * 1000,
+            'max_ms': self.max * 1000,
+        }
+
+
+class Invocation:
+    """One running command and the time its phases took so far."""
+
+    __slots__ = ('name', 'started', 'phases')
+
+    def __init__(self, name, started):
+        self.name = name
+        self.started = started
+        self.phases = {}
+
+
+class Timings:
+    """Rolling histograms per command and per phase."""
+
+    def __init__(self, window=WINDOW, clock=time.perf_counter, on_phase=None):
+        self.window = window
+        self.clock = clock
+        # Called with (phase, seconds) for every phase sample, e.g. /metrics
+        self.on_phase = on_phase
+        self.commands = {}
+        self.phases = {}
+        # command -> {phase: total seconds}
+        self.breakdown = {}
+
+    def _histogram(self, table, name):
+        histogram = table.get(name)
+        if histogram is None:
+            histogram = table[name] = RollingHistogram(self.window)
+        return histogram
+
+    def start(self, name):
+        invocation = Invocation(name, self.clock())
+        _invocation.set(invocation)
+        return invocation
+
+    def finish(self, invocation=None):
+        """Record the command; returns its run time in seconds."""
+        invocation = invocation or _invocation.get()
+        if invocation is None:
+            return None
+        elapsed = self.clock() - invocation.started
+        self._histogram(self.commands, invocation.name).add(elapsed)
+        state = max(0.0, elapsed - sum(invocation.phases.values()))
+        self._phase(STATE, state)
+        breakdown = self.breakdown.setdefault(invocation.name, {})
+        for name, seconds in invocation.phases.items():
+            breakdown[name] = breakdown.get(name, 0.0) + seconds
+        breakdown[STATE] = breakdown.get(STATE, 0.0) + state
+        _invocation.set(None)
+        return elapsed
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.add_phase(name, self.clock() - start)
+
+    def add_phase(self, name, seconds):
+        invocation = _invocation.get()
+        if invocation is not None:
+            invocation.phases[name] = invocation.phases.get(name, 0.0) + seconds
+        self._phase(name, seconds)
+
+    def _phase(self, name, seconds):
+        self._histogram(self.phases, name).add(seconds)
+        if self.on_phase is not None:
+            self.on_phase(name, seconds)
+
+    def timed(self, name):
+        """Decorator recording every call of a function as phase ``name``."""
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def slowest_commands(self, count=10, key='p95_ms'):
+        rows = [(name, histogram.summary()) for name, histogram in self.commands.items()]
+        rows.sort(key=lambda row: row[1][key], reverse=True)
+        return rows[:count]
+
+    def phase_summaries(self):
+        rows = [(name, histogram.summary()) for name, histogram in self.phases.items()]
+        rows.sort(key=lambda row: row[1]['p95_ms'], reverse=True)
+        return rows
+
+    def share(self, command):
+        """{phase: fraction of ``command``'s total time}."""
+        breakdown = self.breakdown.get(command, {})
+        total = sum(breakdown.values())
+        return {name: seconds / total for name, seconds in breakdown.items()} if total else {}
+
+    def reset(self):
+        self.commands.clear()
+        self.phases.clear()
+        self.breakdown.clear()
@@ -0,0 +1,301 @@
+"""Change-tracking containers for the economy tables.
+
+``user_data``, ``active_offers``, ``offer_results`` and ``shop_items`` are
+wrapped in a ``TrackedTable``.  Every write below a table, however deep,
+records the *path* that changed so storage backends can persist just that
+piece instead of the whole economy.  Paths are capped at three keys::
+
+    ('123',)                        # whole user record added/removed
+    ('123', 'reiatsu')              # one field of a record
+    ('M102', 'bets', '123')         # one bettor inside an offer
+
+Anything deeper (or inside a list) is reported as its nearest capped
+ancestor, e.g. appending to ``active_bets`` marks ``('123', 'active_bets')``.
+The containers subclass ``dict``/``list`` so existing command code and
+``json.dumps`` keep working unchanged.
+"""
+
+MAX_DEPTH = 3
+MISSING = object()
+
+
+def wrap(value, root, path, leaf=False):
+    """Return ``value`` as a tracked container attached to ``root`` at ``path``."""
+    if isinstance(value, TrackedDict):
+        if value._root is root and value._path == path and value._leaf == leaf:
+            return value
+        return TrackedDict(value, root, path, leaf)
+    if isinstance(value, TrackedList):
+        if value._root is root and value._path == path:
+            return value
+        return TrackedList(value, root, path)
+    if isinstance(value, dict):
+        return TrackedDict(value, root, path, leaf)
+    if isinstance(value, list):
+        return TrackedList(value, root, path)
+    return value
+
+
+def unwrap(value):
+    """Deep copy ``value`` into plain dicts and lists."""
+    if isinstance(value, dict):
+        return {k: unwrap(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [unwrap(v) for v in value]
+    return value
+
+
+class TrackedDict(dict):
+    """Nested mapping that reports writes to its table."""
+
+    __slots__ = ('_root', '_path', '_leaf')
+
+    def __init__(self, data, root, path, leaf=False):
+        super().__init__()
+        self._root = root
+        self._path = path
+        self._leaf = leaf
+        for key, value in data.items():
+            dict.__setitem__(self, key, self._wrap_child(key, value))
+
+    def _child_path(self, key):
+        if self._leaf:
+            return self._path, True
+        path = self._path + (key,)
+        return path, len(path) >= MAX_DEPTH
+
+    def _wrap_child(self, key, value):
+        path, leaf = self._child_path(key)
+        return wrap(value, self._root, path, leaf)
+
+    def _touch(self, key):
+        self._root.touch(self._path if self._leaf else self._path + (key,))
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, self._wrap_child(key, value))
+        self._touch(key)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._touch(key)
+
+    def pop(self, key, *default):
+        had_key = key in self
+        value = dict.pop(self, key, *default)
+        if had_key:
+            self._touch(key)
+        return value
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self._touch(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        keys = list(self)
+        dict.clear(self)
+        for key in keys:
+            self._touch(key)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+class TrackedList(list):
+    """Nested list; any change marks the whole list as changed."""
+
+    __slots__ = ('_root', '_path')
+
+    def __init__(self, data, root, path):
+        super().__init__(wrap(v, root, path, True) for v in data)
+        self._root = root
+        self._path = path
+
+    def _wrap_all(self, values):
+        return [wrap(v, self._root, self._path, True) for v in values]
+
+    def _touch(self):
+        self._root.touch(self._path)
+
+    def append(self, value):
+        list.append(self, wrap(value, self._root, self._path, True))
+        self._touch()
+
+    def extend(self, values):
+        list.extend(self, self._wrap_all(values))
+        self._touch()
+
+    def insert(self, index, value):
+        list.insert(self, index, wrap(value, self._root, self._path, True))
+        self._touch()
+
+    def remove(self, value):
+        list.remove(self, value)
+        self._touch()
+
+    def pop(self, *args):
+        value = list.pop(self, *args)
+        self._touch()
+        return value
+
+    def clear(self):
+        list.clear(self)
+        self._touch()
+
+    def sort(self, *args, **kwargs):
+        list.sort(self, *args, **kwargs)
+        self._touch()
+
+    def reverse(self):
+        list.reverse(self)
+        self._touch()
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = self._wrap_all(value)
+        else:
+            value = wrap(value, self._root, self._path, True)
+        list.__setitem__(self, index, value)
+        self._touch()
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self._touch()
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+class TrackedTable(dict):
+    """Top-level economy table that collects changed paths until drained."""
+
+    def __init__(self, name, data=None):
+        super().__init__()
+        self.name = name
+        # Insertion-ordered set of changed paths
+        self.changes = {}
+        # Whole-table operations (economy/columns.py) since the last drain;
+        # backends persist these before the changed paths
+        self.bulk_ops = []
+        for key, value in (data or {}).items():
+            dict.__setitem__(self, key, self.wrap_record(key, value))
+
+    def wrap_record(self, key, value):
+        """Attach a top-level value; tables with a record type override this."""
+        return wrap(value, self, (key,))
+
+    def touch(self, path):
+        self.changes[path] = None
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, self.wrap_record(key, value))
+        self.touch((key,))
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.touch((key,))
+
+    def pop(self, key, *default):
+        had_key = key in self
+        value = dict.pop(self, key, *default)
+        if had_key:
+            self.touch((key,))
+        return value
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self.touch((key,))
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        keys = list(self)
+        dict.clear(self)
+        for key in keys:
+            self.touch((key,))
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+    def resolve(self, path):
+        """Current value at ``path`` or ``MISSING`` if it no longer exists."""
+        if path[0] not in self:
+            return MISSING
+        node = dict.__getitem__(self, path[0])
+        for key in path[1:]:
+            if isinstance(node, dict):
+                if key not in node:
+                    return MISSING
+                node = dict.__getitem__(node, key)
+            elif hasattr(node, 'persisted'):
+                # Record types (economy/records.py) resolve to their stored form
+                node = node.persisted(key)
+                if node is MISSING:
+                    return MISSING
+            else:
+                return MISSING
+        return node
+
+    def drain(self):
+        """Return and reset the changed paths, dropping ones covered by a shorter path."""
+        changes, self.changes = self.changes, {}
+        return [
+            path for path in changes
+            if not any(path[:i] in changes for i in range(1, len(path)))
+        ]
+
+    def record_bulk(self, op):
+        self.bulk_ops.append(op)
+
+    def drain_bulk(self):
+        ops, self.bulk_ops = self.bulk_ops, []
+        return ops
+
+    def flushed(self):
+        """Called by the persistence engine once drained changes are committed."""
+
+
+def snapshot_tables(tables):
+    """Detached view for off-loop encoding: tables and their records are copied.
+
+    Runs on the loop thread.  The copy goes all the way down (bets, inventories,
+    an offer's ``bets``), so the worker encodes exactly the state of this moment
+    and never iterates a container the loop is still changing; copying is
+    still much cheaper than encoding.
+    """
+    return {
+        name: {key: detach(value) for key, value in table.items()}
+        for name, table in tables.items()
+    }
+
+
+def detach(value):
+    """Deep copy of a table value: records via ``copy()``, containers via ``unwrap()``."""
+    if hasattr(value, 'persisted'):
+        return value.copy()
+    return unwrap(value)
@@ -0,0 +1,55 @@
+"""Opt-in log of the traffic the bot receives, for load replays.
+
+With ``TRAFFIC_LOG`` set the bot appends one JSON line per incoming
+message and per reaction a member adds.  benchmarks/traffic.py turns that
+log into an anonymized trace and benchmarks/replay.py plays it back
+against a local fake Discord.  Only messages starting with the command
+prefix are kept verbatim; anything else is recorded by length, so ordinary
+chat never reaches the log.  IDs are kept as they are here; anonymizing
+happens when the trace is made.
+"""
+import json
+import time
+
+
+class TrafficLog:
+    def __init__(self, path, prefix='!'):
+        self.path = path
+        self.prefix = prefix
+        # Line-buffered: a crash loses at most the line being written
+        self.file = open(path, 'a', encoding='utf-8', buffering=1)
+        self.lines = 0
+
+    def _write(self, record):
+        record['ts'] = round(time.time(), 3)
+        self.file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        self.lines += 1
+
+    def message(self, message):
+        record = {
+            'kind': 'message',
+            'guild': message.guild.id if message.guild else None,
+            'channel': message.channel.id,
+            'author': message.author.id,
+        }
+        permissions = getattr(message.author, 'guild_permissions', None)
+        record['admin'] = bool(permissions and permissions.administrator)
+        if message.content.startswith(self.prefix):
+            record['content'] = message.content
+        else:
+            record['kind'] = 'chatter'
+            record['length'] = len(message.content)
+        self._write(record)
+
+    def reaction(self, payload):
+        self._write({
+            'kind': 'reaction',
+            'guild': payload.guild_id,
+            'channel': payload.channel_id,
+            'author': payload.user_id,
+            'message': payload.message_id,
+            'emoji': str(payload.emoji),
+        })
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,279 @@
+"""Per-user locks and all-or-nothing balance changes.
+
+A command that reads a balance, awaits something (a reaction, a lock, the
+network) and then writes back can act on numbers that are no longer true.
+``TransactionManager.transaction(*user_ids)`` takes one ``asyncio.Lock``
+per user involved - always in sorted order, so two transactions over the
+same users can't deadlock - and hands out a ``Transaction`` that stages
+changes::
+
+    async with transactions.transaction(sender, receiver) as txn:
+        txn.add(sender, 'reiatsu', -amount)
+        txn.add(receiver, 'reiatsu', amount - fee)
+
+``transfer()`` stages a movement and its ledger posting (economy/ledger.py)
+in one go; only the legs that are locked users change a balance, system
+accounts such as ``FEES`` exist in the ledger only::
+
+    txn.transfer('give', sender, receiver, amount - fee)
+    txn.transfer('fee', sender, FEES, fee)
+
+Staged changes are applied together when the block exits (or at an
+explicit ``commit()``): every record is looked up again, every resulting
+balance is checked first, and if one would go negative ``InsufficientFunds``
+is raised and nothing is written.  Applying is a single synchronous step,
+so a flush sees all of a transaction or none of it.  An exception inside
+the block discards the staged changes.
+
+With a ``shared`` store (economy/shared_store.py) the balances are checked
+and applied there, atomically across processes, and the locked records are
+refreshed from it first; the asyncio locks only order this process's own
+transactions.  While another process holds the store's write lock the
+refresh and the commit are retried after a short sleep, so an explicit
+commit inside the block is ``await transactions.commit(txn)``.
+
+Only the users named are locked; unrelated users never wait on each other.
+Locks are not re-entrant - don't open a transaction on a user inside
+another one that already holds it.  ``LockManager`` keeps lock wait times
+for ``!savestats``.
+"""
+import asyncio
+import contextlib
+import time
+from collections import deque
+
+from economy.ledger import is_user
+
+# Balances a transaction may not take below zero
+NON_NEGATIVE = ('reiatsu', 'soul_fragments')
+WAIT_WINDOW = 1024
+
+
+class InsufficientFunds(Exception):
+    """A staged change would leave ``field`` of ``user_id`` negative."""
+
+    def __init__(self, user_id, field, balance, needed):
+        super().__init__(f"{user_id} has {balance} {field}, needs {needed}")
+        self.user_id = user_id
+        self.field = field
+        self.balance = balance
+        self.needed = needed
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class LockManager:
+    """One ``asyncio.Lock`` per key, created on demand and dropped when idle."""
+
+    def __init__(self, window=WAIT_WINDOW):
+        self.locks = {}
+        self.refs = {}  # key -> holders and waiters
+        self.waits = deque(maxlen=window)  # recent wait times, seconds
+        self.acquisitions = 0
+        self.contended = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @contextlib.asynccontextmanager
+    async def hold(self, *keys):
+        """Hold the locks of ``keys``, taken in sorted order."""
+        ordered = sorted(set(keys))
+        for key in ordered:
+            if key not in self.locks:
+                self.locks[key] = asyncio.Lock()
+                self.refs[key] = 0
+            self.refs[key] += 1
+        held = []
+        start = time.perf_counter()
+        contended = False
+        try:
+            for key in ordered:
+                lock = self.locks[key]
+                contended = contended or lock.locked()
+                await lock.acquire()
+                held.append(lock)
+            self._waited(time.perf_counter() - start, contended)
+            yield
+        finally:
+            for lock in held:
+                lock.release()
+            for key in ordered:
+                self.refs[key] -= 1
+                if not self.refs[key]:
+                    del self.refs[key]
+                    del self.locks[key]
+
+    def _waited(self, seconds, contended):
+        self.acquisitions += 1
+        self.contended += contended
+        self.total_wait += seconds
+        self.max_wait = max(self.max_wait, seconds)
+        self.waits.append(seconds)
+
+    def stats(self):
+        ordered = sorted(self.waits)
+        return {
+            'held': len(self.locks),
+            'acquisitions': self.acquisitions,
+            'contended': self.contended,
+            'avg_wait_ms': self.total_wait / self.acquisitions * 1000 if self.acquisitions else 0.0,
+            'p50_wait_ms': percentile(ordered, 0.50) * 1000,
+            'p99_wait_ms': percentile(ordered, 0.99) * 1000,
+            'max_wait_ms': self.max_wait * 1000,
+        }
+
+
+class Transaction:
+    """Changes staged against the locked users; see the module docstring."""
+
+    def __init__(self, manager, keys):
+        self.manager = manager
+        self.keys = frozenset(keys)
+        # (key, field) -> [value set, or None for "current", delta]
+        self.changes = {}
+        self.postings = []
+        self.committed = False
+
+    def record(self, key):
+        """The user's current record (look it up again after any await)."""
+        self._check_key(key)
+        return self.manager.users[key]
+
+    def balance(self, key, field):
+        """``field`` as it will be after the staged changes."""
+        self._check_key(key)
+        base, delta = self.changes.get((key, field), (None, 0))
+        return (self.manager.users[key][field] if base is None else base) + delta
+
+    def add(self, key, field, amount):
+        self._check_key(key)
+        self.changes.setdefault((key, field), [None, 0])[1] += amount
+
+    def set(self, key, field, value):
+        self._check_key(key)
+        self.changes[(key, field)] = [value, 0]
+
+    def post(self, reason, source, dest, amount, currency='reiatsu', ref=None):
+        """Stage a ledger posting without changing any balance."""
+        self.postings.append((reason, source, dest, amount, currency, ref))
+
+    def transfer(self, reason, source, dest, amount, currency='reiatsu', ref=None):
+        """Stage ``amount`` moving from ``source`` to ``dest``, with its posting."""
+        if is_user(source):
+            self.add(source, currency, -amount)
+        if is_user(dest):
+            self.add(dest, currency, amount)
+        self.post(reason, source, dest, amount, currency, ref)
+
+    def commit(self):
+        """Apply every staged change, or raise ``InsufficientFunds`` and apply none.
+
+        With a shared store whose write lock is taken it raises ``StoreBusy``
+        (economy/shared_store.py), also having applied nothing.
+        """
+        users = self.manager.users
+        shared = self.manager.shared
+        writes = []
+        stored = {}
+        for (key, field), (base, delta) in self.changes.items():
+            if shared is not None and field in shared.currencies:
+                stored[key, field] = (base, delta)  # checked by the store
+                continue
+            record = users[key]
+            current = record[field]
+            value = (current if base is None else base) + delta
+            if field in NON_NEGATIVE and delta < 0 and value < 0:
+                self.manager.insufficient += 1
+                raise InsufficientFunds(key, field, current, current - value)
+            writes.append((record, field, value))
+        if stored:
+            try:
+                balances = shared.apply(stored)
+            except InsufficientFunds:
+                self.manager.insufficient += 1
+                raise
+            # Already in the store; the records only catch up
+            with shared.quiet():
+                for (key, field), value in balances.items():
+                    users[key][field] = value
+        for record, field, value in writes:
+            record[field] = value
+        ledger = self.manager.ledger
+        if ledger is not None:
+            for posting in self.postings:
+                ledger.post(*posting)
+        self.changes = {}
+        self.postings = []
+        self.committed = True
+        self.manager.commits += 1
+
+    def discard(self):
+        """Drop every staged change and posting."""
+        self.changes = {}
+        self.postings = []
+        self.manager.aborts += 1
+
+    def _check_key(self, key):
+        if key not in self.keys:
+            raise KeyError(f"user {key!r} is not part of this transaction")
+
+
+class TransactionManager:
+    """Opens transactions on ``users`` (a ``UserRepository``)."""
+
+    def __init__(self, users, ledger=None, shared=None):
+        self.users = users
+        self.ledger = ledger
+        # SharedStore (economy/shared_store.py) when several processes share balances
+        self.shared = shared
+        self.locks = LockManager()
+        self.commits = 0
+        self.aborts = 0
+        self.insufficient = 0
+
+    @contextlib.asynccontextmanager
+    async def transaction(self, *keys):
+        async with self.locks.hold(*keys):
+            if self.shared is not None:
+                for key in keys:
+                    record = self.users.get(key)
+                    if record is not None:
+                        await self.shared.retry(self.shared.refresh, key, record)
+            txn = Transaction(self, keys)
+            try:
+                yield txn
+            except BaseException:
+                self.aborts += 1
+                raise
+            if txn.changes or txn.postings:
+                await self.commit(txn)
+
+    async def commit(self, txn, check=None):
+        """``txn.commit()``, retried while the shared store is busy.
+
+        ``check`` is called right before every attempt, with no await in
+        between; if it returns false the staged changes are dropped and
+        ``commit()`` returns False instead of committing.
+        """
+        def attempt():
+            if check is not None and not check():
+                txn.discard()
+                return False
+            txn.commit()
+            return True
+
+        if self.shared is None:
+            return attempt()
+        return await self.shared.retry(attempt)
+
+    def stats(self):
+        return {
+            'commits': self.commits,
+            'aborts': self.aborts,
+            'insufficient': self.insufficient,
+            **self.locks.stats(),
+        }
@@ -0,0 +1,598 @@
+"""User repository: ``user_data`` served from a bounded LRU hot cache.
+
+With a store that supports point lookups (the SQLite backend) only recently
+used users are resident.  Commands ``await prefetch()`` the users they are
+about to touch: the misses are read in one query on the persistence
+engine's worker, and users the store doesn't have are remembered as
+absent, so the ``user_data[uid]`` and ``uid in user_data`` that follow are
+answered from memory.  A miss that wasn't prefetched still loads the row
+synchronously on the event loop, bounded by the store's short read timeout
+(``READ_TIMEOUT`` in economy/sqlite_store.py); ``loop_misses`` counts
+those.  Least recently used clean records are evicted once the cache holds
+more than ``capacity`` users.  Records with unflushed changes are pinned
+until the persistence engine reports them committed.
+
+Whole-economy reads stream instead of materialising every user:
+``values()``/``items()``/iteration page through the store and overlay the
+cached (newer) records, ``top()`` asks the store's index for the leaders
+of a column (derived metrics such as battle power keep a bounded ``TopK``,
+updated on writes and filled by a scan on the engine's worker when
+``prepare_top()`` finds it can't vouch for the leaders), and
+``bulk_add()``/``bulk_scale()`` run as one statement in the store.
+Records yielded while streaming are read-only snapshots unless cached.
+
+Without such a store (journal, json and sharded backends) every user stays
+resident and the same API works on the in-memory dict, and leaderboards
+registered with ``add_index()`` get an index (economy/leaderboard.py) that
+item writes keep current, so ``top()`` and ``rank()`` never sort.
+"""
+import asyncio
+import heapq
+from operator import attrgetter
+
+from economy.aggregates import AggregateRegistry, figures, scan
+from economy.columns import COLUMN_FIELDS, BalanceColumns, add_op, apply_op, scale_op
+from economy.leaderboard import Metric, OrderIndex, TopK, best_entries
+from economy.records import UserRecord
+from economy.tracking import TrackedTable
+
+EVICTION_SCAN = 64
+# Keys remembered as not stored; the set starts over beyond this
+ABSENT_LIMIT = 100_000
+
+
+class UserRepository(TrackedTable):
+    """``TrackedTable`` for users with optional lazy, bounded residency."""
+
+    def __init__(self, data=None, store=None, engine=None, capacity=50_000):
+        # Balances of resident users, filled as records are wrapped
+        self.columns = BalanceColumns(max(len(data or ()), 1024))
+        # Leaderboards: name -> Metric.  Leaderboard and aggregate metrics
+        # with an index are in _indexed, and by source field in watchers
+        # (item writes) or container_watchers (in-place container changes)
+        self.metrics = {}
+        self._indexed = []
+        self.watchers = {}
+        self.container_watchers = {}
+        self.aggregates = None
+        super().__init__('user_data', data)
+        self.store = store
+        self.engine = engine
+        self.capacity = capacity
+        self._dirty_keys = set()
+        self._in_flight = set()
+        # Handed out since the last flush; callers may still hold the record
+        self._recent = set()
+        # Created or deleted since the last commit, so the store is stale for them
+        self._created = set()
+        self._deleted = set()
+        self._committing = (set(), set())
+        # Keys loaded while a bulk statement runs, see _bulk()
+        self._bulk_loads = None
+        self._bulk_count = 0  # bulk statements finished, see prefetch()
+        # Keys prefetch() found missing in the store; only this process
+        # writes it, so they stay missing until created here
+        self._absent = set()
+        # Metric name -> running prepare_top() scan
+        self._rebuilds = {}
+        self._count = store.count_users() if store is not None else None
+        self.hits = 0
+        self.misses = 0
+        self.loop_misses = 0
+        self.evictions = 0
+
+    def wrap_record(self, key, value):
+        if isinstance(value, UserRecord) and value._root is self and value._key == key:
+            return value
+        return UserRecord.from_dict(value, self, key)
+
+    @property
+    def lazy(self):
+        return self.store is not None
+
+    # Change tracking ----------------------------------------------------
+
+    def touch(self, path):
+        super().touch(path)
+        self._dirty_keys.add(path[0])
+        if len(path) > 1 and path[1] in self.container_watchers:
+            self._container_changed(path[0], self.container_watchers[path[1]])
+
+    def drain(self):
+        self._in_flight |= self._dirty_keys
+        self._dirty_keys = set()
+        self._committing[0].update(self._created)
+        self._committing[1].update(self._deleted)
+        return super().drain()
+
+    def flushed(self):
+        created, deleted = self._committing
+        self._created -= created
+        self._deleted -= deleted
+        created.clear()
+        deleted.clear()
+        self._in_flight.clear()
+        self._recent.clear()
+        self._evict()
+
+    def _unflushed(self, key):
+        return key in self._dirty_keys or key in self._in_flight
+
+    def _pinned(self, key):
+        return self._unflushed(key) or key in self._recent
+
+    def resolve(self, path):
+        key = path[0]
+        if self.lazy and not dict.__contains__(self, key) and key in self:
+            # Evicted while a caller still held it; the store copy is current
+            self[key]
+        return super().resolve(path)
+
+    # Mapping interface --------------------------------------------------
+
+    def __getitem__(self, key):
+        try:
+            value = dict.pop(self, key)
+        except KeyError:
+            value = self._load(key)
+            if value is None:
+                raise KeyError(key) from None
+            self._evict(reserve=1)
+        else:
+            self.hits += 1
+        # Re-insert at the end: dict order doubles as the LRU order
+        dict.__setitem__(self, key, value)
+        if self.lazy:
+            if len(self._recent) >= self.capacity:
+                # No flush for a while (read-only traffic); start a new window
+                self._recent = set()
+            self._recent.add(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        if dict.__contains__(self, key):
+            return True
+        if not self.lazy or key in self._deleted or key in self._absent:
+            return False
+        self.loop_misses += 1
+        return self.store.user_exists(key)
+
+    def __setitem__(self, key, value):
+        if self.lazy:
+            self._absent.discard(key)
+            if key not in self:
+                self._count += 1
+                self._created.add(key)
+                self._deleted.discard(key)
+            self._recent.add(key)
+        old = dict.get(self, key)
+        super().__setitem__(key, value)
+        record = dict.__getitem__(self, key)
+        if self._indexed:
+            self._index_insert(key, old, record)
+        if old is not None and old is not record:
+            old.detach_columns()
+        self._evict()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def __delitem__(self, key):
+        if not self.lazy:
+            record = dict.__getitem__(self, key)
+            super().__delitem__(key)
+            if self._indexed:
+                self._index_insert(key, record, None)
+            record.detach_columns()
+            return
+        if key not in self:
+            raise KeyError(key)
+        record = dict.pop(self, key, None)
+        if record is not None:
+            record.detach_columns()
+        # Only key-based indexes watch a lazy repository: TopK and BalanceSync
+        for metric in self._indexed:
+            metric.index.remove(key, None)
+        self._count -= 1
+        self._deleted.add(key)
+        self._created.discard(key)
+        self.touch((key,))
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def __len__(self):
+        if not self.lazy:
+            return dict.__len__(self)
+        return self._count
+
+    def __iter__(self):
+        for key, _ in self.items():
+            yield key
+
+    def keys(self):
+        return list(iter(self)) if not self.lazy else iter(self)
+
+    def values(self):
+        for _, value in self.items():
+            yield value
+
+    def items(self):
+        if not self.lazy:
+            yield from list(dict.items(self))
+            return
+        created = set(self._created)
+        seen = set()
+        for key, record in self.store.iter_users():
+            if key in self._deleted:
+                continue
+            if key in created:
+                # Committed by the worker after we started streaming
+                seen.add(key)
+            if dict.__contains__(self, key):
+                record = dict.__getitem__(self, key)
+            yield key, record
+        for key in created - seen:
+            if dict.__contains__(self, key):
+                yield key, dict.__getitem__(self, key)
+
+    def resident(self):
+        """Number of users currently held in memory."""
+        return dict.__len__(self)
+
+    # Loading and eviction -----------------------------------------------
+
+    def _load(self, key):
+        if not self.lazy or key in self._deleted or key in self._absent:
+            return None
+        self.loop_misses += 1
+        record = self.store.get_user(key)
+        if record is None:
+            return None
+        self.misses += 1
+        if self._bulk_loads is not None:
+            self._bulk_loads.add(key)
+        return self.wrap_record(key, record)
+
+    async def prefetch(self, *keys):
+        """Make ``keys`` resident, reading the misses on the engine's worker."""
+        if not self.lazy:
+            return
+        missing = [key for key in dict.fromkeys(keys) if not self._known(key)]
+        if not missing:
+            return
+        bulk_count = self._bulk_count
+        found = await self.engine.read(self.store.get_users, missing)
+        if self._bulk_loads is not None or self._bulk_count != bulk_count:
+            return  # a bulk statement may have changed the rows; load them later
+        if len(self._absent) >= ABSENT_LIMIT:
+            self._absent = set()
+        for key in missing:
+            if self._known(key):
+                continue  # created, loaded or deleted meanwhile
+            record = found.get(key)
+            if record is None:
+                self._absent.add(key)
+                continue
+            self.misses += 1
+            self._evict(reserve=1)
+            dict.__setitem__(self, key, self.wrap_record(key, record))
+            self._recent.add(key)
+
+    def _known(self, key):
+        return dict.__contains__(self, key) or key in self._deleted or key in self._absent
+
+    def _evict(self, reserve=0):
+        if not self.lazy:
+            return
+        excess = dict.__len__(self) + reserve - self.capacity
+        if excess <= 0:
+            return
+        # Oldest first; pinned records are skipped, bounded scan per call.
+        # Pinning makes the capacity soft within one flush interval.
+        victims = []
+        for scanned, key in enumerate(dict.__iter__(self)):
+            if scanned >= excess + EVICTION_SCAN or len(victims) >= excess:
+                break
+            if not self._pinned(key):
+                victims.append(key)
+        for key in victims:
+            dict.pop(self, key).detach_columns()
+        self.evictions += len(victims)
+
+    # Leaderboard indexes ------------------------------------------------
+
+    def add_index(self, name, value=None, fields=None, size=None):
+        """Keep users ordered by ``name`` for ``top()``/``rank()``.
+
+        ``value(record)`` derives the metric from ``fields`` (default: the
+        field ``name`` itself).  ``size`` keeps only a bounded ``TopK``
+        instead of a full ``OrderIndex``, enough for ``top()`` but not
+        ``rank()``.  Lazy repositories serve column metrics from the store's
+        indexes; a derived metric with a ``size`` gets a ``TopK`` that
+        ``prepare_top()`` fills on the engine's worker, and refills only when
+        it can no longer vouch for the leaders (see economy/leaderboard.py).
+        """
+        if name in self.metrics:
+            return
+        plain = value is None
+        if plain:
+            value = attrgetter(name)
+        metric = Metric(name, value, tuple(fields or (name,)), plain)
+        self.metrics[name] = metric
+        if self.lazy:
+            if not plain and size is not None:
+                self._watch(metric, TopK(size, lambda: ((value(record), key) for key, record in self.items())))
+            return
+
+        def source():
+            return ((value(record), key) for key, record in dict.items(self))
+
+        if size is None:
+            self._watch(metric, OrderIndex(source))
+        else:
+            self._watch(metric, TopK(size, source))
+
+    def add_aggregate(self, name, aggregate, value=None, fields=None, container=False):
+        """Feed ``aggregate`` (economy/aggregates.py) like a leaderboard index.
+
+        ``container`` fields are lists/dicts changed in place; the aggregate
+        gets ``move(key, None, new)`` from change tracking instead.
+        """
+        plain = value is None
+        if plain:
+            value = attrgetter(name)
+        metric = Metric(name, value, tuple((name,) if fields is None else fields), plain)
+        self._watch(metric, aggregate, container)
+
+    def _watch(self, metric, index, container=False):
+        metric.index = index
+        self._indexed.append(metric)
+        watchers = self.container_watchers if container else self.watchers
+        for field in metric.fields:
+            watchers.setdefault(field, []).append(metric)
+
+    def enable_aggregates(self):
+        """Maintain ``self.aggregates``; lazy repositories ask the store instead."""
+        if not self.lazy and self.aggregates is None:
+            self.aggregates = AggregateRegistry(self)
+
+    async def economy_stats(self):
+        """Economy-wide figures (see ``AggregateRegistry.snapshot()``)."""
+        if self.aggregates is not None:
+            return self.aggregates.snapshot()
+        if self.lazy:
+            # Aggregate queries on the store's worker after pending changes are
+            # written, rather than streaming every user through the loop
+            return figures(*await self.engine.run_in_store(self.store.user_figures))
+        return scan(self.values())
+
+    def records(self):
+        """Resident ``(user_id, record)`` pairs without touching the LRU order."""
+        return dict.items(self)
+
+    def metrics_changed(self, record, metrics, before):
+        """Called by ``UserRecord`` after a write to a watched field."""
+        key = record._key
+        if dict.get(self, key) is not record:
+            return  # replaced or evicted record
+        for metric, old in zip(metrics, before):
+            new = metric.value(record)
+            if new != old:
+                metric.index.move(key, old, new)
+
+    def _container_changed(self, key, metrics):
+        record = dict.get(self, key)
+        if record is not None:
+            for metric in metrics:
+                metric.index.move(key, None, metric.value(record))
+
+    def _index_insert(self, key, old, record):
+        for metric in self._indexed:
+            if old is not None:
+                metric.index.remove(key, metric.value(old))
+            if record is not None:
+                metric.index.insert(key, metric.value(record))
+
+    def _reindex_bulk(self, op):
+        for metric in self.watchers.get(op['field'], ()):
+            metric.index.bulk_changed(op if metric.plain else None)
+
+    async def rank(self, key, name='reiatsu'):
+        """(1-based position by ``name``, user count) for ``key``, or None.
+
+        With an ``OrderIndex``: O(log n).  Lazy: a range count in the store
+        after pending changes are written.
+        """
+        if self.lazy:
+            return await self.engine.run_in_store(self.store.rank_user, name, key)
+        record = dict.get(self, key)
+        if record is None:
+            return None
+        metric = self.metrics.get(name)
+        if metric is not None and isinstance(metric.index, OrderIndex):
+            return metric.index.rank(key, metric.value(record)) + 1, dict.__len__(self)
+        value = metric.value if metric is not None else attrgetter(name)
+        entry = (-value(record), key)
+        ahead = sum(1 for other_key, other in dict.items(self) if (-value(other), other_key) < entry)
+        return ahead + 1, dict.__len__(self)
+
+    # Whole-economy operations -------------------------------------------
+
+    async def prepare_top(self, field, count):
+        """Let ``top(field, count)`` answer from memory.
+
+        Lazy only: a derived ``TopK`` that needs a rebuild gets it from one
+        scan on the engine's worker (after pending changes are written), with
+        writes made meanwhile applied on top; then the leaders are prefetched.
+        Concurrent callers share the scan.
+        """
+        metric = self.metrics.get(field)
+        if not self.lazy or metric is None or not isinstance(metric.index, TopK):
+            return
+        index = metric.index
+        if index.needs_rebuild(count):
+            task = self._rebuilds.get(field)
+            if task is None:
+                task = self._rebuilds[field] = asyncio.ensure_future(self._rebuild_top(metric))
+                task.add_done_callback(lambda _: self._rebuilds.pop(field, None))
+            await asyncio.shield(task)
+        if not index.needs_rebuild(count):
+            await self.prefetch(*index.keys(count))
+
+    async def _rebuild_top(self, metric):
+        index, value, store = metric.index, metric.value, self.store
+
+        def scan_store():
+            # On the worker, through its own connection
+            return best_entries(index.size, (
+                (value(record), key) for key, record in store.iter_users(conn=store.conn)))
+
+        index.begin_rebuild()
+        try:
+            best = await self.engine.run_in_store(scan_store)
+        except BaseException:
+            index.abort_rebuild()
+            raise
+        index.finish_rebuild(best)
+
+    def top(self, field, count):
+        """``count`` users with the highest ``field``, as (user_id, record)."""
+        metric = self.metrics.get(field)
+        if metric is not None and metric.index is not None:
+            if self.lazy:
+                # Leaders need not be resident; at most ``count`` point reads
+                return [(key, self[key]) for key in metric.index.keys(count) if key in self]
+            return [(key, dict.__getitem__(self, key)) for key in metric.index.keys(count)]
+        if metric is not None and not metric.plain:
+            # Derived metric without a size (lazy): one streaming pass
+            return heapq.nlargest(count, self.items(), key=lambda item: metric.value(item[1]))
+        if not self.lazy:
+            return sorted(dict.items(self), key=lambda item: item[1][field], reverse=True)[:count]
+        # Store values are stale only for unflushed users, so over-fetch by that many
+        unflushed = {key for key in dict.__iter__(self) if self._unflushed(key)}
+        candidates = {}
+        for key, record in self.store.top_users(field, count + len(unflushed) + len(self._deleted)):
+            if key not in self._deleted:
+                candidates[key] = dict.get(self, key, record)
+        for key in unflushed:
+            if dict.__contains__(self, key):
+                candidates[key] = dict.__getitem__(self, key)
+        return sorted(candidates.items(), key=lambda item: item[1][field], reverse=True)[:count]
+
+    async def bulk_add(self, field, amount):
+        """Add ``amount`` to ``field`` for every user, clamping at zero.
+
+        Returns (users affected, total change), the change measured around
+        the update itself so concurrent commands don't count towards it.
+        """
+        statement = (self.store.bulk_add, field, amount) if self.lazy else None
+        affected, changes = await self._bulk([add_op(field, amount)], statement)
+        return affected, changes.get(field, 0)
+
+    async def bulk_scale(self, fields, multiplier):
+        """Multiply ``fields`` of every user by ``multiplier`` (truncating).
+
+        Returns (users affected, {field: total change}).
+        """
+        statement = (self.store.bulk_scale, fields, multiplier) if self.lazy else None
+        return await self._bulk([scale_op(field, multiplier) for field in fields], statement)
+
+    async def _bulk(self, ops, statement):
+        if not self.lazy:
+            # Every user is resident: one vectorized pass per op, persisted as
+            # the op itself rather than one change per user.  All ops are
+            # checked first so an overflow leaves every field unchanged
+            for op in ops:
+                if op['field'] in COLUMN_FIELDS:
+                    self.columns.check(op)
+            changes = {}
+            for op in ops:
+                field = op['field']
+                before = self.total(field)
+                self._apply_resident(op)
+                self._reindex_bulk(op)
+                changes[field] = changes.get(field, 0) + self.total(field) - before
+                if field in COLUMN_FIELDS:
+                    self.record_bulk(op)
+            return dict.__len__(self), changes
+
+        # The engine writes pending changes first, so the statement sees every
+        # user; cached records are then brought in line without marking them
+        # dirty.  Dirty records get the op too and overwrite the row on the
+        # next flush.
+        self._bulk_loads = set()
+        try:
+            result = await self.engine.run_in_store(*statement)
+            reload = self._bulk_loads
+        finally:
+            self._bulk_loads = None
+            self._bulk_count += 1
+        fields = [op['field'] for op in ops]
+        stale = {key: dict.__getitem__(self, key) for key in reload
+                 if dict.__contains__(self, key) and key not in self._dirty_keys}
+        for op in ops:
+            self._apply_resident(op, tracked=False)
+            # Lazy watchers: derived TopKs go stale, shared-store mirrors repeat the op
+            self._reindex_bulk(op)
+        for key, record in stale.items():
+            # Loaded mid-statement, maybe before it committed: re-read it
+            fresh = self.store.get_user(key) or {}
+            for field in fields:
+                if field in fresh:
+                    record.set_untracked(field, fresh[field])
+        return result
+
+    def _apply_resident(self, op, tracked=True):
+        field = op['field']
+        if field in COLUMN_FIELDS:
+            self.columns.apply(op)
+            return
+        for record in dict.values(self):
+            value = apply_op(record[field], op)
+            if tracked:
+                record[field] = value
+            else:
+                record.set_untracked(field, value)
+
+    def total(self, field):
+        """Sum of ``field`` over resident users."""
+        if field in COLUMN_FIELDS:
+            return self.columns.total(field)
+        return sum(record[field] for record in dict.values(self))
+
+    async def totals(self, fields):
+        """(user count, {field: sum}) over every user.
+
+        Resident: column sums.  Lazy: one SUM query after pending changes are
+        written.
+        """
+        if self.lazy:
+            return await self.engine.run_in_store(self.store.sum_users, fields)
+        return dict.__len__(self), {field: self.total(field) for field in fields}
+
+    def stats(self):
+        return {
+            'users': len(self),
+            'resident': self.resident(),
+            'capacity': self.capacity if self.lazy else None,
+            'cache_hits': self.hits,
+            'cache_misses': self.misses,
+            'loop_misses': self.loop_misses,
+            'evictions': self.evictions,
+            **self.columns.stats(),
+        }
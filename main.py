@@ -5,30 +5,80 @@ import random
 import asyncio
 from datetime import datetime, timedelta
 import os
+import time
 import uuid
 
-import os
-from threading import Thread
-from flask import Flask
-
-# Create Flask app for Cloud Run health checks
-flask_app = Flask(__name__)
-
-@flask_app.route('/')
-def health_check():
-    return {'status': 'healthy', 'bot': str(bot.user) if bot.user else 'starting'}, 200
-
-@flask_app.route('/health')
-def health():
-    return {'status': 'ok'}, 200
-
-def run_flask():
-    port = int(os.environ.get('PORT', 8080))
-    flask_app.run(host='0.0.0.0', port=port, debug=False)
+from aiohttp import web
+
+from economy.cooldowns import STREAK_WINDOW, CooldownEngine
+from economy.embeds import EmbedCache
+from economy.journal import JournalBackend
+from economy.ledger import ALL_USERS, FEES, MINT, Ledger, escrow, summarize
+from economy.metrics import Counter, Histogram, LoopLagMonitor, MetricsWriter
+from economy.partitions import GLOBAL, Partition, PartitionRegistry
+from economy.persistence import JsonFileBackend, PersistenceEngine, lock_path
+from economy.profiling import CpuProfile, MemoryWindow
+from economy.records import SOUL_REAPER_RANKS, UserRecord
+from economy.settlement import SettlementEngine
+from economy.shop import PurchaseEngine, PurchaseError, limited
+from economy.shards import ShardedBackend
+from economy.shared_store import SharedStore, StoreBusy
+from economy.sqlite_store import SqliteBackend
+from economy.timing import STATE, Timings
+from economy.tracking import TrackedTable
+from economy.traffic import TrafficLog
+from economy.transactions import InsufficientFunds, TransactionManager
+from economy.users import UserRepository
+
+# HTTP server for Cloud Run health checks and Prometheus scrapes; runs on
+# the bot's own event loop (started in setup_hook), so handlers read bot
+# state without crossing threads
+async def health_check(request):
+    return web.json_response({'status': 'healthy', 'bot': str(bot.user) if bot.user else 'starting'})
+
+async def health(request):
+    # 503 until the economy is loaded so no traffic reaches a half-started bot
+    if bot_status['state'] != 'ready':
+        return web.json_response({'status': bot_status['state']}, status=503)
+    return web.json_response({
+        'status': 'ready',
+        'gateway': 'connected' if bot.is_ready() else 'reconnecting',
+        'load_seconds': bot_status['load_seconds'],
+        'partitions': len(partitions.partitions),
+        'gateway_connects': bot_status['gateway_connects']
+    })
 
-# Start Flask server in background thread
-flask_thread = Thread(target=run_flask, daemon=True)
-flask_thread.start()
+async def metrics(request):
+    return web.Response(body=render_metrics().encode('utf-8'), headers={'Content-Type': MetricsWriter.content_type})
+
+async def start_http_server():
+    app = web.Application()
+    app.add_routes([web.get('/', health_check), web.get('/health', health), web.get('/metrics', metrics)])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', int(os.environ.get('PORT', 8080))).start()
+    return runner
+
+# Startup phase reported by /health: 'loading' until setup_hook has loaded
+# the economy once, then 'ready' for the life of the process
+bot_status = {'state': 'loading', 'load_seconds': None, 'gateway_connects': 0}
+
+# Exported on /metrics (economy/metrics.py); the engines' own counters are
+# read at scrape time in render_metrics()
+command_count = Counter('soulbot_commands_total', "Commands run, by outcome", ('command', 'outcome'))
+command_errors = Counter('soulbot_command_errors_total', "Command errors, by type", ('error',))
+command_latency = Histogram('soulbot_command_duration_seconds', "Command run time", ('command',))
+loop_lag = LoopLagMonitor()
+phase_latency = Histogram('soulbot_phase_duration_seconds', "Time in init_user, save_data, ctx.send, reaction waits "
+                          "and the rest of the command (state)", ('phase',))
+# Rolling per-command and per-phase timings for !perf (economy/timing.py)
+timings = Timings(on_phase=lambda name, seconds: phase_latency.observe(seconds, name))
+
+# Context whose send() is timed as the 'send' phase: the round-trip to Discord
+class TimedContext(commands.Context):
+    async def send(self, *args, **kwargs):
+        with timings.phase('send'):
+            return await super().send(*args, **kwargs)
 
 # Bot setup with intents and disabled default help
 intents = discord.Intents.default()
@@ -36,18 +86,53 @@ intents.message_content = True
 intents.guilds = True
 intents.members = True
 
-bot = commands.Bot(command_prefix='!', intents=intents, help_command=None)
-
-# Data storage (In production, use a proper database)
-user_data = {}
-shop_items = {}
-daily_missions = {}
-tournaments = {}
-active_offers = {}  # Store available betting offers
-offer_results = {}  # Store completed offer results
-
-# Global economy state
-economy_frozen = False
+# BOT_SHARDING=auto runs an AutoShardedBot: SHARD_COUNT shards (default:
+# what Discord recommends), of which this process runs SHARD_IDS (comma
+# separated; default: all). Use it with ECONOMY_PARTITIONS=guild so each
+# process only loads the economies of its own shards' guilds.
+BOT_SHARDING = os.getenv('BOT_SHARDING', 'off')
+if BOT_SHARDING == 'auto':
+    shard_ids = os.getenv('SHARD_IDS')
+    bot = commands.AutoShardedBot(
+        command_prefix='!', intents=intents, help_command=None,
+        shard_count=int(os.environ['SHARD_COUNT']) if os.getenv('SHARD_COUNT') else None,
+        shard_ids=[int(shard) for shard in shard_ids.split(',')] if shard_ids else None
+    )
+else:
+    bot = commands.Bot(command_prefix='!', intents=intents, help_command=None)
+
+# ECONOMY_PARTITIONS: 'global' (default) keeps one economy shared by every
+# guild; 'guild' gives each guild its own users, leaderboards, offers and
+# shop, stored under GUILD_DATA_DIR/<guild id>/ (see economy/partitions.py)
+ECONOMY_PARTITIONS = os.getenv('ECONOMY_PARTITIONS', 'global')
+GUILD_DATA_DIR = os.getenv('GUILD_DATA_DIR', 'economy_guilds')
+partitions = PartitionRegistry(lambda key: load_partition(key), per_guild=ECONOMY_PARTITIONS == 'guild',
+                               start=lambda economy: start_partition(economy))
+
+# Data storage - tracked tables record which entries change so saves
+# only persist what moved (see economy/tracking.py). Each name stands for
+# the table or engine of the economy partition the command runs in.
+user_data = partitions.proxy('user_data')
+shop_items = partitions.proxy('shop_items')
+daily_missions = partitions.proxy('daily_missions')
+tournaments = partitions.proxy('tournaments')
+active_offers = partitions.proxy('active_offers')  # Store available betting offers
+offer_results = partitions.proxy('offer_results')  # Store completed offer results
+# Every currency movement as a double-entry posting (economy/ledger.py);
+# written by the persistence engine ahead of each flush
+ledger = partitions.proxy('ledger')
+# Pays out !result in chunks and keeps the per-match index of active bets
+settlement = partitions.proxy('settlement')
+# !daily/!work/!train cooldowns and the !remind timer wheel
+cooldowns = partitions.proxy('cooldowns')
+# Prebuilt !help/!shop/!offers/... embeds (economy/embeds.py); commands that
+# change a view's data invalidate it
+embed_cache = partitions.proxy('embed_cache')
+# Per-user locks and all-or-nothing balance changes (economy/transactions.py)
+transactions = partitions.proxy('transactions')
+# !buy: balance, stock and inventory in one step (economy/shop.py)
+shop_engine = partitions.proxy('shop_engine')
+persistence = partitions.proxy('persistence')
 
 # BLEACH & JOJO themed constants
 ZANPAKUTO_NAMES = [
@@ -61,38 +146,22 @@ STAND_NAMES = [
     "Hierophant Green", "Stone Free"
 ]
 
-SOUL_REAPER_RANKS = [
-    "Academy Student", "Unseated Officer", "20th Seat", "15th Seat",
-    "10th Seat", "5th Seat", "3rd Seat", "Lieutenant", "Captain", "Captain Commander"
-]
+# SOUL_REAPER_RANKS lives in economy/records.py - users store the rank's index
 
 # Initialize user data
+# Starting values are UserRecord's defaults (5000 Reiatsu, Academy Student);
+# record['field'] access works like the old per-user dict
+@timings.timed('init_user')
 def init_user(user_id):
     if str(user_id) not in user_data:
-        user_data[str(user_id)] = {
-            "reiatsu": 5000,  # Main currency (instead of credits)
-            "soul_fragments": 0,  # Premium currency
-            "zanpakuto": None,
-            "stand": None,
-            "rank": "Academy Student",
-            "level": 1,
-            "exp": 0,
-            "daily_streak": 0,
-            "last_daily": None,
-            "last_work": None,
-            "last_train": None,
-            "inventory": {},
-            "active_bets": [],
-            "total_winnings": 0,
-            "battles_won": 0,
-            "achievements": []
-        }
+        record = user_data[str(user_id)] = UserRecord()
+        ledger.post('signup', MINT, str(user_id), record.reiatsu)
 
 # Initialize shop items if not exists
 def init_shop():
-    global shop_items
     if not shop_items:
-        shop_items = {
+        embed_cache.invalidate('shop', 'shopmanage')
+        shop_items.update({
             'shinigami_robes': {
                 'name': '⚔️ Shinigami Robes',
                 'description': 'Official Soul Reaper battle attire',
@@ -147,50 +216,279 @@ def init_shop():
                 'stock': 10,
                 'purchasable': True
             }
-        }
-
-# Save data function
+        })
+
+# DATA_FILE may hold a JSON or binary snapshot; loading sniffs the format.
+# SNAPSHOT_FORMAT ('json' or 'binary') and SNAPSHOT_COMPRESSION ('none',
+# 'zlib', 'zstd') choose what compaction writes - see economy/snapshot.py
+DATA_FILE = os.getenv('DATA_FILE', 'economy_data.json')
+LEDGER_FILE = os.getenv('LEDGER_FILE', 'economy_ledger.jsonl')
+# Ledger segment size; each full one is checkpointed so startup only indexes
+# what came after (see economy/ledger.py)
+LEDGER_SEGMENT_BYTES = int(os.getenv('LEDGER_SEGMENT_BYTES', 64 * 1024 * 1024))
+SNAPSHOT_FORMAT = os.getenv('SNAPSHOT_FORMAT', 'json')
+SNAPSHOT_COMPRESSION = os.getenv('SNAPSHOT_COMPRESSION', 'none')
+SAVE_INTERVAL = float(os.getenv('SAVE_INTERVAL', 2.0))
+
+# Where a partition keeps a storage file: the configured path for the
+# global economy, the same file name in the guild's directory otherwise
+def partition_path(key, path):
+    if key == GLOBAL:
+        return path
+    return os.path.join(GUILD_DATA_DIR, key, os.path.basename(os.path.normpath(path)))
+
+# STORAGE_BACKEND: 'journal' (default) appends per-change records and
+# compacts into DATA_FILE, 'json' rewrites DATA_FILE on every flush,
+# 'sqlite' upserts changed rows into SQLITE_PATH (migrate first with
+# python -m economy.sqlite_store migrate), 'sharded' rewrites only the
+# changed user-bucket / offer / shop segments under SHARD_DIR
+def create_storage_backend(key=GLOBAL):
+    backend = os.getenv('STORAGE_BACKEND', 'journal')
+    data_file = partition_path(key, DATA_FILE)
+    if backend == 'json':
+        return JsonFileBackend(data_file, SNAPSHOT_FORMAT, SNAPSHOT_COMPRESSION)
+    if backend == 'sharded':
+        return ShardedBackend(
+            partition_path(key, os.getenv('SHARD_DIR', 'economy_shards')),
+            legacy_path=data_file,
+            user_buckets=int(os.getenv('SHARD_BUCKETS', 256))
+        )
+    if backend == 'sqlite':
+        return SqliteBackend(partition_path(key, os.getenv('SQLITE_PATH', 'economy.db')))
+    if backend == 'journal':
+        archive_dir = os.getenv('JOURNAL_ARCHIVE_DIR')
+        return JournalBackend(
+            data_file,
+            compact_bytes=int(os.getenv('JOURNAL_COMPACT_BYTES', 16 * 1024 * 1024)),
+            archive_dir=partition_path(key, archive_dir) if archive_dir else None,
+            snapshot_format=SNAPSHOT_FORMAT,
+            compression=SNAPSHOT_COMPRESSION
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+# Files a partition writes on its own; load_partition() locks them so a
+# second process pointed at the same paths refuses to start
+def storage_paths(key=GLOBAL):
+    paths = [LEDGER_FILE, DATA_FILE]
+    backend = os.getenv('STORAGE_BACKEND', 'journal')
+    if backend == 'sharded':
+        paths.append(os.getenv('SHARD_DIR', 'economy_shards'))
+    elif backend == 'sqlite':
+        paths.append(os.getenv('SQLITE_PATH', 'economy.db'))
+    return [partition_path(key, path) for path in paths]
+
+# SHARED_STORE: path of a SQLite file whose balances and limited shop stock
+# several bot processes on this host share (see economy/shared_store.py);
+# every balance change is applied there atomically. Only that file is
+# shared: each process still needs its own DATA_FILE, LEDGER_FILE and
+# SQLITE_PATH / SHARD_DIR. SHARED_CACHE_TTL bounds how stale a cached
+# balance may be if an invalidation message is lost.
+SHARED_STORE = os.getenv('SHARED_STORE')
+SHARED_CACHE_TTL = float(os.getenv('SHARED_CACHE_TTL', 0.5))
+
+# Save data function - marks the current partition dirty, its persistence
+# engine coalesces bursts and writes at most once per SAVE_INTERVAL seconds
+@timings.timed('save_data')
 def save_data():
-    data_to_save = {
-        'user_data': user_data,
-        'active_offers': active_offers,
-        'offer_results': offer_results,
-        'shop_items': shop_items,
-        'daily_missions': daily_missions,
-        'tournaments': tournaments
-    }
-    with open('economy_data.json', 'w') as f:
-        json.dump(data_to_save, f, indent=2)
+    persistence.mark_dirty()
+
+# !economyfreeze applies to the current partition only
+def economy_frozen():
+    return partitions.current().frozen
+
+# USER_CACHE_SIZE: with the sqlite backend users are loaded on demand and
+# at most this many stay resident (0 keeps every user in memory). Other
+# backends always hold every user.
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 50000))
+# How often the economy aggregates are checked against a full scan
+AGGREGATE_VERIFY_MINUTES = float(os.getenv('AGGREGATE_VERIFY_MINUTES', 60))
+
+# !leaderboard metrics: name -> (display name, aliases)
+LEADERBOARDS = {
+    'reiatsu': ("Reiatsu", ('money', 'balance')),
+    'soul_fragments': ("Soul Fragments", ('fragments', 'sf')),
+    'level': ("Level", ('lvl',)),
+    'exp': ("EXP", ('xp',)),
+    'battles_won': ("Battles Won", ('wins', 'battles')),
+    'total_winnings': ("Total Winnings", ('winnings', 'bets')),
+    'daily_streak': ("Daily Streak", ('streak',)),
+    'battle_power': ("Battle Power", ('power', 'bp')),
+}
+LEADERBOARD_ALIASES = {alias: name for name, (_, aliases) in LEADERBOARDS.items() for alias in (name, *aliases)}
+# Entries kept per bounded leaderboard; the slack over the 10 shown absorbs
+# leaders dropping out without a rescan
+LEADERBOARD_DEPTH = 50
+
+# Load one economy partition - the global one or a guild's. Runs on first use
+# of the partition, in a worker thread (see economy/partitions.py)
+def load_partition(key):
+    if key != GLOBAL:
+        os.makedirs(os.path.join(GUILD_DATA_DIR, key), exist_ok=True)
+    economy = Partition(key)
+    economy.locks = [lock_path(path) for path in storage_paths(key)]
+    ledger = economy.ledger = Ledger(partition_path(key, LEDGER_FILE), segment_bytes=LEDGER_SEGMENT_BYTES)
+    persistence = economy.persistence = PersistenceEngine(create_storage_backend(key), economy.tables,
+                                                          interval=SAVE_INTERVAL)
+    persistence.add_writer(ledger)
+    backend = persistence.backend
+    lazy_users = USER_CACHE_SIZE > 0 and hasattr(backend, 'get_user')
+    if lazy_users:
+        backend.lazy_users = True
+    # Whatever the storage backend holds: snapshot plus journal tail, the
+    # plain file, or the SQLite tables (users excluded when loaded lazily)
+    data = persistence.load()
+    if SHARED_STORE:
+        shared = economy.shared = SharedStore(partition_path(key, SHARED_STORE), ttl=SHARED_CACHE_TTL)
+        # The shared balances win over whatever this process flushed last
+        stored_users = data.get('user_data', {})
+        for user_id, balances in shared.all_balances().items():
+            if user_id in stored_users:
+                stored_users[user_id].update(balances)
+    user_data = economy.user_data = UserRepository(
+        data.get('user_data', {}),
+        store=backend if lazy_users else None,
+        engine=persistence,
+        capacity=USER_CACHE_SIZE
+    )
+    if economy.shared is not None:
+        economy.shared.attach(user_data)  # before any other index
+    # Money supply, powers, ranks and bets for !serveranalytics/!godstats
+    user_data.enable_aggregates()
+    # Kept current on every change: reiatsu fully ordered (for !rank), the
+    # other !leaderboard metrics as bounded top lists
+    user_data.add_index('reiatsu')
+    for metric in LEADERBOARDS:
+        if metric == 'battle_power':
+            user_data.add_index(metric, calculate_battle_power,
+                                fields=('level', 'rank', 'zanpakuto', 'stand'), size=LEADERBOARD_DEPTH)
+        elif metric != 'reiatsu':
+            user_data.add_index(metric, size=LEADERBOARD_DEPTH)
+    for name in ('active_offers', 'offer_results', 'shop_items', 'daily_missions', 'tournaments'):
+        setattr(economy, name, TrackedTable(name, data.get(name, {})))
+    ledger.load()
+    economy.settlement = SettlementEngine(user_data, economy.active_offers, economy.offer_results, ledger=ledger)
+    economy.cooldowns = CooldownEngine()
+    embed_cache = economy.embed_cache = EmbedCache()
+    economy.transactions = TransactionManager(user_data, ledger, economy.shared)
+    economy.shop_engine = PurchaseEngine(economy.shop_items, ledger=ledger, shared=economy.shared,
+                                         on_stock_change=lambda item_id: embed_cache.invalidate('shop', 'shopmanage'))
+
+    with partitions.bound(economy):
+        init_shop()  # Initialize shop on first load
+    economy.shop_engine.sync_stock()
+    # Cooldown reminders: re-arm opted-in users (resident users only)
+    economy.cooldowns.on_ready = send_cooldown_reminder
+    if not user_data.lazy:
+        economy.cooldowns.restore(user_data.records())
+    return economy
+
+# Start a loaded partition's background work; load_partition() may have run
+# in a worker thread, this runs on the event loop
+def start_partition(economy):
+    economy.persistence.start()
+    economy.spawn(economy.cooldowns.run())
+    # Finish settlements interrupted by a crash or restart
+    for match_id in economy.settlement.pending():
+        economy.spawn(resume_settlement(match_id))
+
+# One-time bootstrap - runs once per process before the gateway connects,
+# unlike on_ready which fires again after every reconnect. Guild partitions
+# load as their guilds become available instead.
+@bot.event
+async def setup_hook():
+    await start_http_server()
+    asyncio.create_task(loop_lag.run())
+    if not partitions.per_guild:
+        # Off the loop, so /health answers 'loading' meanwhile
+        economy = await partitions.ensure()
+        bot_status['load_seconds'] = economy.load_seconds
+        print(f"Economy loaded in {economy.load_seconds}s ({len(economy.user_data):,} users)")
+    if not daily_reset.is_running():
+        daily_reset.start()
+    if not verify_aggregates.is_running():
+        verify_aggregates.start()
+    bot_status['state'] = 'ready'
+
+# Every command runs against the economy of the guild it was sent in
+@bot.check
+async def economy_guild_only(ctx):
+    if partitions.per_guild and ctx.guild is None:
+        raise commands.NoPrivateMessage()
+    return True
+
+@bot.before_invoke
+async def bind_economy(ctx):
+    timings.start(ctx.command.qualified_name)
+    economy = await partitions.bind(ctx.guild.id if ctx.guild else None)
+    # Lazy user cache: the author and the users passed as arguments are read
+    # on the store's worker now instead of on the loop when first touched
+    users = [ctx.author, *(arg for arg in (*ctx.args, *ctx.kwargs.values()) if isinstance(arg, discord.abc.User))]
+    await economy.user_data.prefetch(*(str(user.id) for user in users))
+    if economy.shared is not None:
+        # Another process may have moved the author's balances
+        user_id = str(ctx.author.id)
+        record = economy.user_data.get(user_id)
+        if record is not None:
+            await economy.shared.retry(economy.shared.refresh, user_id, record)
+
+# Runs after every command callback, also when it raised
+@bot.after_invoke
+async def record_command(ctx):
+    name = ctx.command.qualified_name
+    command_count.inc(name, 'error' if ctx.command_failed else 'ok')
+    command_latency.observe(timings.finish(), name)
+
+# TRAFFIC_LOG: append incoming commands and reactions to this file for
+# load replays (economy/traffic.py, benchmarks/replay.py); off by default
+TRAFFIC_LOG = os.getenv('TRAFFIC_LOG')
+traffic_log = TrafficLog(TRAFFIC_LOG, bot.command_prefix) if TRAFFIC_LOG else None
+
+# Same as the default handler, with TimedContext
+@bot.event
+async def on_message(message):
+    if message.author.bot:
+        return
+    if traffic_log is not None:
+        traffic_log.message(message)
+    ctx = await bot.get_context(message, cls=TimedContext)
+    await bot.invoke(ctx)
 
-# Load data function
-def load_data():
-    global user_data, active_offers, offer_results, shop_items, daily_missions, tournaments
-    try:
-        with open('economy_data.json', 'r') as f:
-            data = json.load(f)
-            user_data = data.get('user_data', {})
-            active_offers = data.get('active_offers', {})
-            offer_results = data.get('offer_results', {})
-            shop_items = data.get('shop_items', {})
-            daily_missions = data.get('daily_missions', {})
-            tournaments = data.get('tournaments', {})
-    except FileNotFoundError:
-        user_data = {}
-        active_offers = {}
-        offer_results = {}
-        shop_items = {}
-        daily_missions = {}
-        tournaments = {}
+@bot.event
+async def on_raw_reaction_add(payload):
+    if traffic_log is not None and payload.user_id != bot.user.id:
+        traffic_log.reaction(payload)
+
+# Guild events only reach the shards (and so the process) serving the guild.
+# The partition loads in a thread; commands for the guild that arrive
+# meanwhile wait for the same load in bind_economy
+@bot.event
+async def on_guild_available(guild):
+    if partitions.per_guild:
+        await partitions.ensure(guild.id)
+
+@bot.event
+async def on_guild_join(guild):
+    if partitions.per_guild:
+        await partitions.ensure(guild.id)
+
+@bot.event
+async def on_guild_remove(guild):
+    if partitions.per_guild:
+        await partitions.unload(guild.id)
 
 @bot.event
 async def on_ready():
-    print(f'{bot.user} has awakened! The Soul Society is now online!')
-    load_data()
-    init_shop()  # Initialize shop on startup
-    daily_reset.start()
+    # In-memory state is authoritative after a reconnect; nothing to reload
+    bot_status['gateway_connects'] += 1
+    if bot_status['gateway_connects'] == 1:
+        print(f'{bot.user} has awakened! The Soul Society is now online!')
+    else:
+        print(f"{bot.user} reconnected (connect #{bot_status['gateway_connects']}), state kept in memory")
 
 @bot.event
 async def on_member_join(member):
+    economy = await partitions.bind(member.guild.id)
+    await economy.user_data.prefetch(str(member.id))
     init_user(member.id)
     channel = discord.utils.get(member.guild.channels, name='general')
     if channel:
@@ -203,8 +501,17 @@ async def on_member_join(member):
         await channel.send(embed=embed)
 
 # Help Command - Epic BLEACH x JOJO Style
-@bot.command(name='help', aliases=['h', 'commands', 'guide'])
-async def help_command(ctx):
+# Footer quotes of !help; one prebuilt embed per quote
+HELP_FOOTERS = [
+    "「If you want to control your enemy, you must first control yourself.」 - Byakuya",
+    "「Your next line is... !daily」 - Joseph Joestar",
+    "「Bankai!」 - Every Soul Reaper Ever",
+    "「ORAORAORAORAORA!」 - Star Platinum",
+    "「The heart may be weak, but bonds make us strong.」 - Sora"
+]
+
+def build_help_embeds(admin):
+    """The !help embed (with the admin section if admin), once per footer"""
     # Create main help embed
     embed = discord.Embed(
         title="⚡ SOUL SOCIETY COMMAND GUIDE ⚡",
@@ -218,7 +525,9 @@ async def help_command(ctx):
         value=(
             "`!profile` - View your Soul Reaper profile\n"
             "`!balance` - Check your Reiatsu & Soul Fragments\n"
-            "`!leaderboard` - See the strongest souls\n"
+            "`!transactions` - Your recent Reiatsu & Fragment movements\n"
+            "`!leaderboard [metric]` - See the strongest souls (level, power, wins...)\n"
+            "`!rank [@user]` - Your position on the leaderboard\n"
             "*「Know your power level before challenging others!」*"
         ),
         inline=False
@@ -231,6 +540,7 @@ async def help_command(ctx):
             "`!daily` - Daily spiritual training (24h cooldown)\n"
             "`!work` - Complete Soul Society missions (1h cooldown)\n"
             "`!train` - Intense training for EXP (30m cooldown)\n"
+            "`!remind [on|off]` - Get pinged when !daily or !work is ready\n"
             "*「The path to power requires dedication!」*"
         ),
         inline=False
@@ -266,13 +576,15 @@ async def help_command(ctx):
         name="🏪 **SOUL SOCIETY MARKETPLACE**",
         value=(
             "`!shop` - Browse spiritual items & equipment\n"
+            "`!buy <item_id> [quantity]` - Purchase an item\n"
+            "`!inventory` - See the items you own\n"
             "*「Acquire the tools needed for your journey!」*"
         ),
         inline=False
     )
 
     # Admin Section (only show if user has admin perms)
-    if ctx.author.guild_permissions.administrator:
+    if admin:
         embed.add_field(
             name="🛡️ **ADMIN COMMANDS**",
             value=(
@@ -301,17 +613,18 @@ async def help_command(ctx):
     )
 
     # Footer with cool quotes
-    footer_quotes = [
-        "「If you want to control your enemy, you must first control yourself.」 - Byakuya",
-        "「Your next line is... !daily」 - Joseph Joestar",
-        "「Bankai!」 - Every Soul Reaper Ever",
-        "「ORAORAORAORAORA!」 - Star Platinum",
-        "「The heart may be weak, but bonds make us strong.」 - Sora"
-    ]
-
-    embed.set_footer(text=random.choice(footer_quotes))
+    variants = []
+    for quote in HELP_FOOTERS:
+        variant = embed.copy()
+        variant.set_footer(text=quote)
+        variants.append(variant)
+    return variants
 
-    # Send main embed
+@bot.command(name='help', aliases=['h', 'commands', 'guide'])
+async def help_command(ctx):
+    admin = ctx.author.guild_permissions.administrator
+    # Built once per audience; only the footer is picked per call
+    embed = embed_cache.pick('help', lambda: build_help_embeds(admin), variant=admin)
     await ctx.send(embed=embed)
 
 # ===========================================
@@ -322,6 +635,9 @@ async def help_command(ctx):
 @commands.has_permissions(administrator=True)
 async def admin_help(ctx):
     """Complete admin command reference"""
+    await ctx.send(embed=embed_cache.get('adminhelp', build_admin_help_embed))
+
+def build_admin_help_embed():
     embed = discord.Embed(
         title="🛡️ GOD MODE ADMIN PANEL 🛡️",
         description="*「With great power comes great responsibility!」*\n\n⚡ **ULTIMATE ADMINISTRATIVE CONTROL** ⚡",
@@ -362,6 +678,7 @@ async def admin_help(ctx):
             "`!richestusers [count]` - Top users by wealth\n"
             "`!activebets` - All active betting positions\n"
             "`!economyreport` - Detailed economy report\n"
+            "`!audit [reason] [hours] [@user]` - Ledger audit of currency movements\n"
         ),
         inline=False
     )
@@ -394,24 +711,45 @@ async def admin_help(ctx):
             "`!backdoor` - Direct database access\n"
             "`!godstats` - Your admin statistics\n"
             "`!emergencybackup` - Create data backup\n"
+            "`!savestats` - Persistence engine statistics\n"
+            "`!perf [reset]` - Slowest commands and phases\n"
+            "`!profiler start|stop` - CPU profile of the bot\n"
+            "`!memsnap [seconds]` - Largest allocation sites\n"
         ),
         inline=False
     )
 
     embed.set_footer(text="「You have become the Soul King! Use this power wisely!」")
-    await ctx.send(embed=embed)
+    return embed
 
 # ===========================================
 # USER MANIPULATION COMMANDS
 # ===========================================
 
+# Largest balance, level or adjustment the admin commands accept. Balances
+# are int64 columns (economy/columns.py); this leaves room for sums over
+# millions of users and for repeated !massadd runs
+MAX_ADMIN_AMOUNT = 10 ** 12
+
+async def reject_admin_amount(ctx, amount):
+    """Reply and return True if ``amount`` is beyond what admins may set or add."""
+    if abs(amount) <= MAX_ADMIN_AMOUNT:
+        return False
+    await ctx.send(f"「Amounts are limited to ±{MAX_ADMIN_AMOUNT:,}!」")
+    return True
+
 @bot.command(name='setreiatsu')
 @commands.has_permissions(administrator=True)
 async def set_reiatsu(ctx, member: discord.Member, amount: int):
     """Set a user's exact Reiatsu amount"""
+    if await reject_admin_amount(ctx, amount):
+        return
     init_user(member.id)
-    old_amount = user_data[str(member.id)]['reiatsu']
-    user_data[str(member.id)]['reiatsu'] = amount
+    user_id = str(member.id)
+    async with transactions.transaction(user_id) as txn:
+        old_amount = txn.balance(user_id, 'reiatsu')
+        txn.set(user_id, 'reiatsu', amount)
+        txn.post('admin', MINT, user_id, amount - old_amount)
 
     embed = discord.Embed(
         title="💰 REIATSU MANIPULATION COMPLETE",
@@ -429,15 +767,16 @@ async def set_reiatsu(ctx, member: discord.Member, amount: int):
 @commands.has_permissions(administrator=True)
 async def add_reiatsu(ctx, member: discord.Member, amount: int):
     """Add or subtract Reiatsu from a user"""
+    if await reject_admin_amount(ctx, amount):
+        return
     init_user(member.id)
-    old_amount = user_data[str(member.id)]['reiatsu']
-    user_data[str(member.id)]['reiatsu'] += amount
-
-    # Prevent negative balance
-    if user_data[str(member.id)]['reiatsu'] < 0:
-        user_data[str(member.id)]['reiatsu'] = 0
-
-    new_amount = user_data[str(member.id)]['reiatsu']
+    user_id = str(member.id)
+    async with transactions.transaction(user_id) as txn:
+        old_amount = txn.balance(user_id, 'reiatsu')
+        # Prevent negative balance
+        new_amount = max(0, old_amount + amount)
+        txn.set(user_id, 'reiatsu', new_amount)
+        txn.post('admin', MINT, user_id, new_amount - old_amount)
 
     embed = discord.Embed(
         title="⚡ REIATSU ADJUSTMENT COMPLETE",
@@ -455,9 +794,14 @@ async def add_reiatsu(ctx, member: discord.Member, amount: int):
 @commands.has_permissions(administrator=True)
 async def set_fragments(ctx, member: discord.Member, amount: int):
     """Set a user's exact Soul Fragments amount"""
+    if await reject_admin_amount(ctx, amount):
+        return
     init_user(member.id)
-    old_amount = user_data[str(member.id)]['soul_fragments']
-    user_data[str(member.id)]['soul_fragments'] = amount
+    user_id = str(member.id)
+    async with transactions.transaction(user_id) as txn:
+        old_amount = txn.balance(user_id, 'soul_fragments')
+        txn.set(user_id, 'soul_fragments', amount)
+        txn.post('admin', MINT, user_id, amount - old_amount, 'soul_fragments')
 
     embed = discord.Embed(
         title="💎 SOUL FRAGMENTS MANIPULATION",
@@ -473,14 +817,15 @@ async def set_fragments(ctx, member: discord.Member, amount: int):
 @commands.has_permissions(administrator=True)
 async def add_fragments(ctx, member: discord.Member, amount: int):
     """Add or subtract Soul Fragments from a user"""
+    if await reject_admin_amount(ctx, amount):
+        return
     init_user(member.id)
-    old_amount = user_data[str(member.id)]['soul_fragments']
-    user_data[str(member.id)]['soul_fragments'] += amount
-
-    if user_data[str(member.id)]['soul_fragments'] < 0:
-        user_data[str(member.id)]['soul_fragments'] = 0
-
-    new_amount = user_data[str(member.id)]['soul_fragments']
+    user_id = str(member.id)
+    async with transactions.transaction(user_id) as txn:
+        old_amount = txn.balance(user_id, 'soul_fragments')
+        new_amount = max(0, old_amount + amount)
+        txn.set(user_id, 'soul_fragments', new_amount)
+        txn.post('admin', MINT, user_id, new_amount - old_amount, 'soul_fragments')
 
     embed = discord.Embed(
         title="✨ SOUL FRAGMENT ADJUSTMENT",
@@ -500,29 +845,33 @@ async def set_level(ctx, member: discord.Member, level: int):
     if level < 1:
         await ctx.send("「Level must be at least 1!」")
         return
+    if await reject_admin_amount(ctx, level):
+        return
 
     init_user(member.id)
-    old_level = user_data[str(member.id)]['level']
-    user_data[str(member.id)]['level'] = level
-    user_data[str(member.id)]['exp'] = 0  # Reset EXP when setting level
-
-    # Auto-update rank based on level
-    if level >= 50:
-        new_rank = "Captain Commander"
-    elif level >= 40:
-        new_rank = "Captain"
-    elif level >= 30:
-        new_rank = "Lieutenant"
-    elif level >= 20:
-        new_rank = "3rd Seat"
-    elif level >= 15:
-        new_rank = "5th Seat"
-    elif level >= 10:
-        new_rank = "10th Seat"
-    else:
-        new_rank = user_data[str(member.id)]['rank']  # Keep current if low level
+    user_id = str(member.id)
+    async with transactions.transaction(user_id) as txn:
+        old_level = txn.balance(user_id, 'level')
+        txn.set(user_id, 'level', level)
+        txn.set(user_id, 'exp', 0)  # Reset EXP when setting level
+
+        # Auto-update rank based on level
+        if level >= 50:
+            new_rank = "Captain Commander"
+        elif level >= 40:
+            new_rank = "Captain"
+        elif level >= 30:
+            new_rank = "Lieutenant"
+        elif level >= 20:
+            new_rank = "3rd Seat"
+        elif level >= 15:
+            new_rank = "5th Seat"
+        elif level >= 10:
+            new_rank = "10th Seat"
+        else:
+            new_rank = txn.record(user_id)['rank']  # Keep current if low level
 
-    user_data[str(member.id)]['rank'] = new_rank
+        txn.set(user_id, 'rank', new_rank)
 
     embed = discord.Embed(
         title="📈 LEVEL MANIPULATION COMPLETE",
@@ -542,10 +891,14 @@ async def set_exp(ctx, member: discord.Member, exp: int):
     """Set a user's EXP directly"""
     if exp < 0:
         exp = 0
+    if await reject_admin_amount(ctx, exp):
+        return
 
     init_user(member.id)
-    old_exp = user_data[str(member.id)]['exp']
-    user_data[str(member.id)]['exp'] = exp
+    user_id = str(member.id)
+    async with transactions.transaction(user_id) as txn:
+        old_exp = txn.balance(user_id, 'exp')
+        txn.set(user_id, 'exp', exp)
 
     embed = discord.Embed(
         title="⚡ EXP MANIPULATION COMPLETE",
@@ -570,8 +923,10 @@ async def set_rank(ctx, member: discord.Member, *, rank):
         await ctx.send(embed=embed)
         return
 
-    old_rank = user_data[str(member.id)]['rank']
-    user_data[str(member.id)]['rank'] = rank
+    user_id = str(member.id)
+    async with transactions.transaction(user_id) as txn:
+        old_rank = txn.record(user_id)['rank']
+        txn.set(user_id, 'rank', rank)
 
     embed = discord.Embed(
         title="🎖️ RANK MANIPULATION COMPLETE",
@@ -644,8 +999,10 @@ async def remove_power(ctx, member: discord.Member, power_type):
 async def set_streak(ctx, member: discord.Member, days: int):
     """Set a user's daily streak"""
     init_user(member.id)
-    old_streak = user_data[str(member.id)]['daily_streak']
-    user_data[str(member.id)]['daily_streak'] = max(0, days)
+    user_id = str(member.id)
+    async with transactions.transaction(user_id) as txn:
+        old_streak = txn.balance(user_id, 'daily_streak')
+        txn.set(user_id, 'daily_streak', max(0, days))
 
     embed = discord.Embed(
         title="🔥 STREAK MANIPULATION",
@@ -661,9 +1018,7 @@ async def reset_cooldowns(ctx, member: discord.Member):
     """Reset all cooldowns for a user"""
     init_user(member.id)
 
-    user_data[str(member.id)]['last_daily'] = None
-    user_data[str(member.id)]['last_work'] = None
-    user_data[str(member.id)]['last_train'] = None
+    cooldowns.reset(str(member.id), user_data[str(member.id)])
 
     embed = discord.Embed(
         title="⏰ COOLDOWNS RESET",
@@ -727,25 +1082,17 @@ async def user_info(ctx, member: discord.Member):
     )
 
     # Cooldown Status
-    now = datetime.now()
-    cooldowns = {}
-
+    cooldown_status = {}
     for cd_type in ['daily', 'work', 'train']:
-        last_use = data.get(f'last_{cd_type}')
-        if last_use:
-            last_time = datetime.fromisoformat(last_use)
-            cd_times = {'daily': 86400, 'work': 3600, 'train': 1800}
-            time_left = cd_times[cd_type] - (now - last_time).total_seconds()
-            cooldowns[cd_type] = "Ready" if time_left <= 0 else f"{int(time_left//60)}m"
-        else:
-            cooldowns[cd_type] = "Ready"
+        time_left = cooldowns.remaining(data, cd_type)
+        cooldown_status[cd_type] = "Ready" if time_left <= 0 else f"{time_left // 60}m"
 
     embed.add_field(
         name="⏰ **COOLDOWNS**",
         value=(
-            f"**Daily:** {cooldowns['daily']}\n"
-            f"**Work:** {cooldowns['work']}\n"
-            f"**Train:** {cooldowns['train']}"
+            f"**Daily:** {cooldown_status['daily']}\n"
+            f"**Work:** {cooldown_status['work']}\n"
+            f"**Train:** {cooldown_status['train']}"
         ),
         inline=True
     )
@@ -782,25 +1129,22 @@ async def user_info(ctx, member: discord.Member):
 @commands.has_permissions(administrator=True)
 async def server_analytics(ctx):
     """Complete server economy analysis"""
-    total_users = len(user_data)
-    total_reiatsu = sum(data['reiatsu'] for data in user_data.values())
-    total_fragments = sum(data['soul_fragments'] for data in user_data.values())
-    total_active_bets = sum(len(data['active_bets']) for data in user_data.values())
+    # Kept current on every change by the aggregate registry (aggregate
+    # queries in the store when users are loaded lazily)
+    stats = await user_data.economy_stats()
+    total_users = stats['users']
+    total_reiatsu = stats['reiatsu']
+    total_fragments = stats['soul_fragments']
+    total_levels = stats['level']
+    total_active_bets = stats['active_bets']
+    zanpakuto_users = stats['zanpakuto_users']
+    stand_users = stats['stand_users']
+    both_powers = stats['both_powers']
+    rank_counts = stats['ranks']
 
     # Calculate average stats
     avg_reiatsu = total_reiatsu // total_users if total_users > 0 else 0
-    avg_level = sum(data['level'] for data in user_data.values()) // total_users if total_users > 0 else 0
-
-    # Count power distribution
-    zanpakuto_users = len([d for d in user_data.values() if d['zanpakuto']])
-    stand_users = len([d for d in user_data.values() if d['stand']])
-    both_powers = len([d for d in user_data.values() if d['zanpakuto'] and d['stand']])
-
-    # Rank distribution
-    rank_counts = {}
-    for data in user_data.values():
-        rank = data['rank']
-        rank_counts[rank] = rank_counts.get(rank, 0) + 1
+    avg_level = total_levels // total_users if total_users > 0 else 0
 
     embed = discord.Embed(
         title="📊 SOUL SOCIETY SERVER ANALYTICS",
@@ -860,6 +1204,10 @@ async def server_analytics(ctx):
 @commands.has_permissions(administrator=True)
 async def god_stats(ctx):
     """Show admin statistics"""
+    stats = await user_data.economy_stats()
+    total_reiatsu = stats['reiatsu']
+    total_fragments = stats['soul_fragments']
+
     embed = discord.Embed(
         title="👑 SOUL KING STATISTICS",
         description=f"**Admin:** {ctx.author.mention}",
@@ -880,9 +1228,9 @@ async def god_stats(ctx):
     embed.add_field(
         name="💎 **REALM WEALTH**",
         value=(
-            f"**Total Reiatsu:** {sum(d['reiatsu'] for d in user_data.values()):,}\n"
-            f"**Total Fragments:** {sum(d['soul_fragments'] for d in user_data.values()):,}\n"
-            f"**Economic Activity:** {'🧊 Frozen' if economy_frozen else '🔥 Active'}\n"
+            f"**Total Reiatsu:** {total_reiatsu:,}\n"
+            f"**Total Fragments:** {total_fragments:,}\n"
+            f"**Economic Activity:** {'🧊 Frozen' if economy_frozen() else '🔥 Active'}\n"
             f"**Bot Uptime:** Since last restart"
         ),
         inline=True
@@ -900,6 +1248,26 @@ async def god_stats(ctx):
         inline=True
     )
 
+    # Self-verification of the aggregate registry (resident users only)
+    aggregates = user_data.aggregates
+    if aggregates is not None:
+        if aggregates.last_verified is None:
+            checked = "not yet"
+        else:
+            checked = f"{int(time.time() - aggregates.last_verified) // 60}m ago ({aggregates.last_verify_seconds:.2f}s)"
+        if aggregates.drift_reports:
+            last = aggregates.drift_reports[-1]
+            drift = "\n".join(f"`{name}`: {values['tracked']} → {values['actual']}"
+                               for name, values in list(last['drift'].items())[:5])
+            drift = f"⚠️ {len(aggregates.drift_reports)} drift report(s), last fixed:\n{drift}"
+        else:
+            drift = "✅ No drift detected"
+        embed.add_field(
+            name="🧮 **AGGREGATE CHECKS**",
+            value=f"**Last Verified:** {checked}\n**Checks Run:** {aggregates.verifications}\n{drift}",
+            inline=False
+        )
+
     embed.set_footer(text="「You have absolute power over the Soul Society!」")
     await ctx.send(embed=embed)
 
@@ -911,8 +1279,7 @@ async def god_stats(ctx):
 @commands.has_permissions(administrator=True)
 async def freeze_economy(ctx):
     """Freeze all economic activities"""
-    global economy_frozen
-    economy_frozen = True
+    partitions.current().frozen = True
 
     embed = discord.Embed(
         title="🧊 ECONOMY FROZEN!",
@@ -926,8 +1293,7 @@ async def freeze_economy(ctx):
 @commands.has_permissions(administrator=True)
 async def unfreeze_economy(ctx):
     """Unfreeze all economic activities"""
-    global economy_frozen
-    economy_frozen = False
+    partitions.current().frozen = False
 
     embed = discord.Embed(
         title="🔥 ECONOMY RESTORED!",
@@ -960,7 +1326,8 @@ async def adjust_inflation(ctx, percentage: float):
         return user == ctx.author and str(reaction.emoji) in ["✅", "❌"] and reaction.message.id == message.id
 
     try:
-        reaction, user = await bot.wait_for('reaction_add', timeout=30.0, check=check)
+        with timings.phase('wait'):
+            reaction, user = await bot.wait_for('reaction_add', timeout=30.0, check=check)
 
         if str(reaction.emoji) == "❌":
             await ctx.send("「Inflation adjustment cancelled!」")
@@ -968,20 +1335,17 @@ async def adjust_inflation(ctx, percentage: float):
 
         # Apply inflation
         multiplier = 1 + (percentage / 100)
-        affected_users = 0
-        total_reiatsu_change = 0
-        total_fragments_change = 0
-
-        for user_id in user_data:
-            old_reiatsu = user_data[user_id]['reiatsu']
-            old_fragments = user_data[user_id]['soul_fragments']
-
-            user_data[user_id]['reiatsu'] = int(old_reiatsu * multiplier)
-            user_data[user_id]['soul_fragments'] = int(old_fragments * multiplier)
-
-            total_reiatsu_change += user_data[user_id]['reiatsu'] - old_reiatsu
-            total_fragments_change += user_data[user_id]['soul_fragments'] - old_fragments
-            affected_users += 1
+        # One vectorized pass over the balance columns (one UPDATE when users are loaded lazily)
+        try:
+            affected_users, changes = await user_data.bulk_scale(['reiatsu', 'soul_fragments'], multiplier)
+        except OverflowError:
+            await ctx.send("「That would push the richest balances past the limit! Nothing was changed.」")
+            return
+        total_reiatsu_change = changes['reiatsu']
+        total_fragments_change = changes['soul_fragments']
+        # One posting per currency for the whole economy
+        for currency, change in changes.items():
+            ledger.post('inflation', MINT, ALL_USERS, change, currency, ref=f"x{multiplier:g}")
 
         embed = discord.Embed(
             title="📈 INFLATION ADJUSTMENT COMPLETE!",
@@ -1009,6 +1373,8 @@ async def mass_add_currency(ctx, currency, amount: int):
     if currency not in ['reiatsu', 'soul_fragments']:
         await ctx.send("「Currency must be 'reiatsu' or 'soul_fragments'!」")
         return
+    if await reject_admin_amount(ctx, amount):
+        return
 
     # Confirmation check
     embed = discord.Embed(
@@ -1025,19 +1391,22 @@ async def mass_add_currency(ctx, currency, amount: int):
         return user == ctx.author and str(reaction.emoji) in ["✅", "❌"] and reaction.message.id == message.id
 
     try:
-        reaction, user = await bot.wait_for('reaction_add', timeout=30.0, check=check)
+        with timings.phase('wait'):
+            reaction, user = await bot.wait_for('reaction_add', timeout=30.0, check=check)
 
         if str(reaction.emoji) == "❌":
             await ctx.send("「Mass operation cancelled!」")
             return
 
-        # Execute mass addition
-        affected_users = 0
-        for user_id in user_data:
-            user_data[user_id][currency] += amount
-            if user_data[user_id][currency] < 0:
-                user_data[user_id][currency] = 0
-            affected_users += 1
+        # Execute mass addition; balances are clamped at zero, so the ledger
+        # gets the change the update actually made
+        try:
+            affected_users, applied = await user_data.bulk_add(currency, amount)
+        except OverflowError:
+            # Checked before anything changed
+            await ctx.send("「That would push the richest balances past the limit! Nothing was changed.」")
+            return
+        ledger.post('massadd', MINT, ALL_USERS, applied, currency, ref=f"{amount:+} each")
 
         embed = discord.Embed(
             title="🌟 MASS OPERATION COMPLETE!",
@@ -1072,7 +1441,8 @@ async def reset_user(ctx, member: discord.Member):
         return user == ctx.author and str(reaction.emoji) in ["✅", "❌"] and reaction.message.id == message.id
 
     try:
-        reaction, user = await bot.wait_for('reaction_add', timeout=30.0, check=check)
+        with timings.phase('wait'):
+            reaction, user = await bot.wait_for('reaction_add', timeout=30.0, check=check)
 
         if str(reaction.emoji) == "❌":
             await ctx.send("「User reset cancelled!」")
@@ -1080,6 +1450,9 @@ async def reset_user(ctx, member: discord.Member):
 
         # Reset the user
         if str(member.id) in user_data:
+            old = user_data[str(member.id)]
+            for currency in ('reiatsu', 'soul_fragments'):
+                ledger.post('reset', str(member.id), MINT, old[currency], currency)
             del user_data[str(member.id)]
 
         init_user(member.id)
@@ -1103,10 +1476,10 @@ async def emergency_backup(ctx):
     backup_data = {
         'timestamp': datetime.now().isoformat(),
         'backup_by': str(ctx.author.id),
-        'user_data': user_data,
-        'active_offers': active_offers,
-        'offer_results': offer_results,
-        'shop_items': shop_items
+        'user_data': {user_id: dict(data.items()) for user_id, data in user_data.items()},
+        'active_offers': dict(active_offers),
+        'offer_results': dict(offer_results),
+        'shop_items': dict(shop_items)
     }
 
     backup_filename = f"soul_society_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
@@ -1123,6 +1496,295 @@ async def emergency_backup(ctx):
 
     await ctx.send(embed=embed)
 
+# Postings summarized by !audit; older ones in the range are only counted
+AUDIT_SCAN_LIMIT = 20_000
+
+@bot.command(name='audit')
+@commands.has_permissions(administrator=True)
+async def audit(ctx, reason: str = 'all', hours: float = 24, member: discord.Member = None):
+    """Ledger audit: postings by reason over the last N hours
+    Usage: !audit [reason|all] [hours] [@user]
+    """
+    reason = None if reason.lower() == 'all' else reason.lower()
+    if reason is not None and reason not in ledger.by_reason:
+        await ctx.send(f"「Unknown reason! Recorded: {', '.join(sorted(ledger.by_reason)) or 'none yet'}」")
+        return
+
+    start = time.time() - hours * 3600
+    account = str(member.id) if member else None
+    matched = len(ledger.select(start, reason=reason, account=account))
+    postings = ledger.audit(start, reason=reason, account=account, limit=AUDIT_SCAN_LIMIT)
+
+    embed = discord.Embed(
+        title="🧾 LEDGER AUDIT",
+        description=(
+            f"**Reason:** {reason or 'all'}\n**Window:** last {hours:g}h\n"
+            f"**User:** {member.mention if member else 'everyone'}\n**Postings:** {matched:,}"
+        ),
+        color=0x708090
+    )
+    totals = summarize(postings)
+    if totals:
+        embed.add_field(
+            name="📊 Totals",
+            value="\n".join(
+                f"**{name.replace('_', ' ').title()}** ({'💰' if currency == 'reiatsu' else '💎'}): {count:,} × → {total:,}"
+                for (name, currency), (count, total) in sorted(totals.items(), key=lambda item: -item[1][1])[:15]
+            ),
+            inline=False
+        )
+        embed.add_field(
+            name="🕒 Latest",
+            value="\n".join(describe_posting(posting, account) for posting in reversed(postings[-8:])),
+            inline=False
+        )
+    stats = ledger.stats()
+    footer = f"{stats['postings']:,} postings recorded | {stats['unwritten']:,} awaiting write"
+    if matched > len(postings):
+        footer += f" | totals cover the newest {len(postings):,}"
+    embed.set_footer(text=footer)
+    await ctx.send(embed=embed)
+
+@bot.command(name='savestats', aliases=['persistence'])
+@commands.has_permissions(administrator=True)
+async def save_stats(ctx):
+    """Show persistence engine counters"""
+    stats = persistence.stats()
+
+    embed = discord.Embed(
+        title="💾 PERSISTENCE ENGINE",
+        description=f"**Backend:** {stats['backend']}\n**Flush Interval:** {stats['interval']}s\n**Pending Changes:** {'Yes' if stats['pending'] else 'No'}",
+        color=0x00BFFF
+    )
+    embed.add_field(
+        name="📝 Writes",
+        value=(
+            f"**Save Requests:** {stats['save_requests']:,}\n"
+            f"**Coalesced:** {stats['coalesced_writes']:,}\n"
+            f"**Flushes:** {stats['flushes']:,}\n"
+            f"**Failed:** {stats['failed_flushes']:,}"
+        ),
+        inline=True
+    )
+    embed.add_field(
+        name="⏱️ Flush Latency",
+        value=(
+            f"**Last:** {stats['last_flush_ms']:.1f}ms\n"
+            f"**Average:** {stats['avg_flush_ms']:.1f}ms\n"
+            f"**Max:** {stats['max_flush_ms']:.1f}ms\n"
+            f"**Bytes Written:** {stats['bytes_written']:,}"
+        ),
+        inline=True
+    )
+    if 'journal_seq' in stats:
+        embed.add_field(
+            name="📜 Journal",
+            value=(
+                f"**Sequence:** {stats['journal_seq']:,}\n"
+                f"**Records:** {stats['journal_records']:,}\n"
+                f"**Pending Bytes:** {stats['journal_pending_bytes']:,}\n"
+                f"**Compactions:** {stats['compactions']} (last {stats['last_compaction_ms']:.1f}ms)"
+            ),
+            inline=True
+        )
+    cache = user_data.stats()
+    if cache['capacity'] is not None:
+        embed.add_field(
+            name="🗂️ User Cache",
+            value=(
+                f"**Resident:** {cache['resident']:,} / {cache['capacity']:,}\n"
+                f"**Total Users:** {cache['users']:,}\n"
+                f"**Hits / Misses:** {cache['cache_hits']:,} / {cache['cache_misses']:,}\n"
+                f"**Evictions:** {cache['evictions']:,}"
+            ),
+            inline=True
+        )
+    txn = transactions.stats()
+    embed.add_field(
+        name="🔐 Transactions",
+        value=(
+            f"**Commits / Aborts:** {txn['commits']:,} / {txn['aborts']:,}\n"
+            f"**Insufficient Funds:** {txn['insufficient']:,}\n"
+            f"**Contended Locks:** {txn['contended']:,} of {txn['acquisitions']:,}\n"
+            f"**Lock Wait p50/p99/max:** {txn['p50_wait_ms']:.1f} / {txn['p99_wait_ms']:.1f} / {txn['max_wait_ms']:.1f}ms"
+        ),
+        inline=True
+    )
+    books = ledger.stats()
+    embed.add_field(
+        name="📒 Ledger",
+        value=(
+            f"**Postings:** {books['postings']:,} ({books['unwritten']:,} unwritten)\n"
+            f"**Accounts:** {books['accounts']:,}\n"
+            f"**Batches:** {books['batches']:,} ({books['bytes_written']:,} bytes)"
+        ),
+        inline=True
+    )
+    if partitions.current().shared is not None:
+        shared = partitions.current().shared.stats()
+        embed.add_field(
+            name="🔗 Shared Store",
+            value=(
+                f"**Cache Hits / Misses:** {shared['cache_hits']:,} / {shared['cache_misses']:,}\n"
+                f"**Invalidations:** {shared['invalidations']:,}\n"
+                f"**Store Transactions:** {shared['store_transactions']:,} ({shared['insufficient']:,} insufficient)\n"
+                f"**Notifications Sent / Received:** {shared['notifications_sent']:,} / {shared['notifications_received']:,}"
+            ),
+            inline=True
+        )
+    parts = partitions.stats()
+    shard = f"{ctx.guild.shard_id} of {bot.shard_count}" if ctx.guild and bot.shard_count else "unsharded"
+    embed.add_field(
+        name="🧩 Partitions",
+        value=(
+            f"**Mode:** {parts['mode']} (this one: {partitions.current().key})\n"
+            f"**Loaded:** {parts['loaded']:,} ({parts['users']:,} users)\n"
+            f"**Loads / Unloads:** {parts['loads']:,} / {parts['unloads']:,} ({parts['load_seconds']}s)\n"
+            f"**Gateway Shard:** {shard}"
+        ),
+        inline=True
+    )
+    embed.set_footer(text="「Your realm data is safely preserved!」")
+    await ctx.send(embed=embed)
+
+# Commands listed by !perf
+PERF_COMMANDS = 8
+
+@bot.command(name='perf', aliases=['latency'])
+@commands.has_permissions(administrator=True)
+async def perf(ctx, action: str = None):
+    """Slowest commands and phases over recent traffic
+    Usage: !perf [reset]
+    """
+    if action == 'reset':
+        timings.reset()
+        await ctx.send("「Timings cleared - measuring from now!」")
+        return
+
+    embed = discord.Embed(
+        title="⏱️ COMMAND PERFORMANCE",
+        description=f"p50 / p95 / p99 over the last {timings.window:,} runs of each command",
+        color=0x00BFFF
+    )
+    rows = timings.slowest_commands(PERF_COMMANDS)
+    lines = []
+    for name, stats in rows:
+        share = timings.share(name)
+        phases = ' · '.join(f"{phase} {fraction:.0%}" for phase, fraction in
+                            sorted(share.items(), key=lambda item: item[1], reverse=True)[:3])
+        lines.append(
+            f"**!{name}** ({stats['count']:,} runs)\n"
+            f"{stats['p50_ms']:.1f} / {stats['p95_ms']:.1f} / {stats['p99_ms']:.1f}ms, max {stats['max_ms']:.0f}ms\n"
+            f"*{phases}*"
+        )
+    embed.add_field(name="🐢 Slowest Commands (by p95)", value='\n'.join(lines)[:1024] or "No commands timed yet", inline=False)
+    lines = [
+        f"**{name}**: {stats['p50_ms']:.2f} / {stats['p95_ms']:.2f} / {stats['p99_ms']:.2f}ms ({stats['count']:,})"
+        for name, stats in timings.phase_summaries()
+    ]
+    embed.add_field(name="🧩 Phases", value='\n'.join(lines)[:1024] or "No phases timed yet", inline=False)
+    embed.set_footer(text=f"「{STATE} = the command's own work: everything but send, save_data, init_user and waits」")
+    await ctx.send(embed=embed)
+
+# On-demand profiling (economy/profiling.py): compressed reports are written
+# here and attached to the reply. A forgotten !profiler start stops itself
+# after PROFILE_MAX_SECONDS; !memsnap traces for MEMSNAP_SECONDS by default
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_MAX_SECONDS = 600
+MEMSNAP_SECONDS = 30
+MEMSNAP_MAX_SECONDS = 300
+
+# The running CPU profile and the task that stops it, if any
+cpu_profile = {'profile': None, 'timer': None}
+
+def profile_embed(seconds, focused, overall):
+    """Top functions of a finished CPU profile"""
+    embed = discord.Embed(
+        title="🔬 CPU PROFILE",
+        description=f"{seconds:.1f}s of everything on the event loop",
+        color=0xFF4500
+    )
+    lines = [
+        f"**{function}** (line {line}): {cumulative * 1000:.1f}ms total, {own * 1000:.1f}ms own, {calls:,} calls"
+        for _, line, function, calls, own, cumulative in focused
+    ]
+    embed.add_field(name="🔥 Hottest in main.py (total time)", value='\n'.join(lines)[:1024] or "Nothing from main.py ran", inline=False)
+    lines = [
+        f"**{function}** ({filename}:{line}): {own * 1000:.1f}ms own, {calls:,} calls"
+        for filename, line, function, calls, own, _ in overall
+    ]
+    embed.add_field(name="⚙️ Hottest Overall (own time)", value='\n'.join(lines)[:1024] or "Nothing ran", inline=False)
+    embed.set_footer(text="「Full report attached - the .prof.gz next to it on disk loads with pstats after gunzip」")
+    return embed
+
+async def stop_cpu_profile():
+    """Stop the running profile; returns (embed, report path)"""
+    profile = cpu_profile['profile']
+    cpu_profile['profile'] = None
+    seconds = profile.seconds
+    path, focused, overall = await profile.stop()
+    return profile_embed(seconds, focused, overall), path
+
+async def stop_cpu_profile_later(channel, seconds):
+    await asyncio.sleep(seconds)
+    cpu_profile['timer'] = None
+    embed, path = await stop_cpu_profile()
+    await channel.send("「Profile reached its time limit and stopped」", embed=embed, file=discord.File(path))
+
+# !profile is the player profile, so the profiler answers to !profiler
+@bot.command(name='profiler', aliases=['cpuprofile'])
+@commands.has_permissions(administrator=True)
+async def profiler(ctx, action: str = None, seconds: int = PROFILE_MAX_SECONDS):
+    """Profile the bot's CPU time between start and stop
+    Usage: !profiler start [max seconds] | !profiler stop
+    """
+    if action == 'start':
+        if cpu_profile['profile'] is not None:
+            await ctx.send(f"「Already profiling for {cpu_profile['profile'].seconds:.0f}s - `!profiler stop` first!」")
+            return
+        seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+        try:
+            cpu_profile['profile'] = CpuProfile(PROFILE_DIR)
+        except ValueError as e:
+            # Another profiler already owns the interpreter's profiling hook
+            await ctx.send(f"「Cannot profile: {e}」")
+            return
+        cpu_profile['timer'] = asyncio.create_task(stop_cpu_profile_later(ctx.channel, seconds))
+        await ctx.send(f"「Profiling started - `!profiler stop` to see results (stops itself after {seconds}s)」")
+    elif action == 'stop':
+        if cpu_profile['profile'] is None:
+            await ctx.send("「No profile running - `!profiler start` first!」")
+            return
+        cpu_profile['timer'].cancel()
+        cpu_profile['timer'] = None
+        embed, path = await stop_cpu_profile()
+        await ctx.send(embed=embed, file=discord.File(path))
+    else:
+        await ctx.send("「Usage: `!profiler start [max seconds]` or `!profiler stop`」")
+
+@bot.command(name='memsnap')
+@commands.has_permissions(administrator=True)
+async def memsnap(ctx, seconds: int = MEMSNAP_SECONDS):
+    """Largest allocation sites over a window
+    Usage: !memsnap [seconds]
+    """
+    seconds = max(1, min(seconds, MEMSNAP_MAX_SECONDS))
+    await ctx.send(f"「Tracing allocations for {seconds}s...」")
+    path, top, traced = await MemoryWindow(PROFILE_DIR).run(seconds)
+
+    embed = discord.Embed(
+        title="🧠 MEMORY SNAPSHOT",
+        description=f"Memory allocated during the last {seconds}s and still alive ({traced / 1024 / 1024:.1f} MB traced)",
+        color=0x9370DB
+    )
+    lines = [
+        f"**{filename}:{line}**: +{size / 1024:,.1f} KB in {count:+,} blocks"
+        for filename, line, size, count in top
+    ]
+    embed.add_field(name="📦 Largest Allocation Sites", value='\n'.join(lines)[:1024] or "Nothing new stayed allocated", inline=False)
+    embed.set_footer(text="「Full report attached」")
+    await ctx.send(embed=embed, file=discord.File(path))
+
 # ===========================================
 # BETTING SYSTEM COMMANDS
 # ===========================================
@@ -1180,6 +1842,7 @@ async def new_offer(ctx, match_id, team1, team2, profit_percentage: int):
     embed.set_footer(text="「A new battle begins! Place your bets wisely, Soul Reapers!」")
 
     await ctx.send(embed=embed)
+    embed_cache.invalidate('offers')
     save_data()
 
 @bot.command(name='lockoffer', aliases=['lock', 'lockbet'])
@@ -1196,7 +1859,7 @@ async def lock_offer(ctx, match_id):
         await ctx.send(f"「Offer {match_id} is already locked!」")
         return
 
-    if offer_data['status'] == 'completed':
+    if offer_data['status'] in ('completed', 'settling'):
         await ctx.send(f"「Cannot lock completed offer {match_id}!」")
         return
 
@@ -1215,6 +1878,7 @@ async def lock_offer(ctx, match_id):
     embed.set_footer(text="「The match has begun! No more bets accepted!」")
 
     await ctx.send(embed=embed)
+    embed_cache.invalidate('offers')
     save_data()
 
 @bot.command(name='unlockoffer', aliases=['unlock', 'unlockbet'])
@@ -1231,7 +1895,7 @@ async def unlock_offer(ctx, match_id):
         await ctx.send(f"「Offer {match_id} is already open for betting!」")
         return
 
-    if offer_data['status'] == 'completed':
+    if offer_data['status'] in ('completed', 'settling'):
         await ctx.send(f"「Cannot unlock completed offer {match_id}!」")
         return
 
@@ -1251,6 +1915,7 @@ async def unlock_offer(ctx, match_id):
     embed.set_footer(text="「Betting window reopened! Place your bets quickly!」")
 
     await ctx.send(embed=embed)
+    embed_cache.invalidate('offers')
     save_data()
 
 @bot.command(name='offerstatus', aliases=['status', 'matchstatus'])
@@ -1264,7 +1929,7 @@ async def offer_status(ctx, match_id=None):
             return
 
         offer_data = active_offers[match_id]
-        status_emoji = {"open": "🟢", "locked": "🔒", "completed": "✅"}
+        status_emoji = {"open": "🟢", "locked": "🔒", "settling": "⏳", "completed": "✅"}
 
         embed = discord.Embed(
             title=f"📊 Offer Status: {match_id}",
@@ -1310,14 +1975,16 @@ async def offer_status(ctx, match_id=None):
 @bot.command(name='offers', aliases=['matches', 'games'])
 async def view_offers(ctx):
     """View all available offers for betting"""
+    await ctx.send(embed=embed_cache.get('offers', build_offers_embed))
+
+def build_offers_embed():
     if not active_offers:
         embed = discord.Embed(
             title="🏟️ NO ACTIVE OFFERS",
             description="No betting offers available right now!\n\n「Even the strongest warriors need rest...」",
             color=0xFF6B6B
         )
-        await ctx.send(embed=embed)
-        return
+        return embed
 
     embed = discord.Embed(
         title="🎯 ACTIVE BETTING OFFERS",
@@ -1348,12 +2015,12 @@ async def view_offers(ctx):
             )
 
     embed.set_footer(text="Use !bet <match_id> <team> <amount> to place a bet (if open)")
-    await ctx.send(embed=embed)
+    return embed
 
 @bot.command(name='bet')
 async def place_bet(ctx, match_id, team_choice, amount: int):
     """Place a bet on an offer"""
-    if economy_frozen:
+    if economy_frozen():
         embed = discord.Embed(
             title="🧊 ECONOMY FROZEN",
             description="All economic activities are currently suspended by the administrators.\n\nPlease wait for the economy to be restored.",
@@ -1430,31 +2097,54 @@ async def place_bet(ctx, match_id, team_choice, amount: int):
     profit_amount = amount * offer_data['profit_percentage'] // 100
     total_return = amount + profit_amount
 
-    # Place the bet
-    user_data_entry['reiatsu'] -= amount
-    offer_data['bets'][user_id] = {
-        'team': team_choice,
-        'amount': amount,
-        'potential_return': total_return,
-        'user_name': ctx.author.display_name
-    }
-
-    # Update offer totals
-    if team_choice == 'team1':
-        offer_data['total_team1_bets'] += amount
-    else:
-        offer_data['total_team2_bets'] += amount
-
-    offer_data['total_bets_count'] += 1
+    # The offer may be locked, settled or cancelled while this command waits
+    # for the user's lock or the shared store
+    def betting_open():
+        return active_offers.get(match_id) is offer_data and offer_data['status'] == 'open'
 
-    # Add to user's active bets
-    user_data_entry['active_bets'].append({
-        'match_id': match_id,
-        'team': team_choice,
-        'amount': amount,
-        'potential_return': total_return,
-        'match_description': f"{offer_data['team1']} vs {offer_data['team2']}"
-    })
+    # Place the bet: the stake and the bet records change together under
+    # the user's lock
+    placed = False
+    try:
+        async with transactions.transaction(user_id) as txn:
+            # Checked again in case a concurrent !bet got the lock first
+            duplicate = user_id in offer_data['bets']
+            if not duplicate:
+                txn.transfer('bet', user_id, escrow(match_id), amount, ref=match_id)
+                placed = await transactions.commit(txn, check=betting_open)
+            if placed:
+                offer_data['bets'][user_id] = {
+                    'team': team_choice,
+                    'amount': amount,
+                    'potential_return': total_return,
+                    'user_name': ctx.author.display_name
+                }
+
+                # Update offer totals
+                if team_choice == 'team1':
+                    offer_data['total_team1_bets'] += amount
+                else:
+                    offer_data['total_team2_bets'] += amount
+
+                offer_data['total_bets_count'] += 1
+
+                # Add to user's active bets
+                settlement.index.add(user_id, txn.record(user_id)['active_bets'], {
+                    'match_id': match_id,
+                    'team': team_choice,
+                    'amount': amount,
+                    'potential_return': total_return,
+                    'match_description': f"{offer_data['team1']} vs {offer_data['team2']}"
+                })
+    except InsufficientFunds as error:
+        await ctx.send(f"「You don't have enough Reiatsu! You have {error.balance:,}, need {amount:,}」")
+        return
+    if duplicate:
+        await ctx.send("「You already have a bet on this offer! Use `!deletebet` to cancel it first.」")
+        return
+    if not placed:
+        await ctx.send("「This offer closed before your bet went in! Nothing was taken.」")
+        return
 
     embed = discord.Embed(
         title="🎲 BET PLACED SUCCESSFULLY!",
@@ -1471,6 +2161,7 @@ async def place_bet(ctx, match_id, team_choice, amount: int):
     embed.set_footer(text="「Fortune favors the bold! May your spiritual pressure guide you to victory!」")
 
     await ctx.send(embed=embed)
+    embed_cache.invalidate('offers')
     save_data()
 
 @bot.command(name='showbets', aliases=['mybets', 'bets'])
@@ -1581,9 +2272,10 @@ async def delete_bet(ctx, match_id):
 
     # Refund user
     user_data_entry['reiatsu'] += bet_amount
+    ledger.post('bet_refund', escrow(match_id), user_id, bet_amount, ref=match_id)
 
     # Remove from user's active bets
-    user_data_entry['active_bets'] = [bet for bet in user_data_entry['active_bets'] if bet['match_id'] != match_id]
+    settlement.index.remove(user_id, user_data_entry['active_bets'], match_id)
 
     embed = discord.Embed(
         title="🔄 BET CANCELLED",
@@ -1593,6 +2285,7 @@ async def delete_bet(ctx, match_id):
     embed.set_footer(text="「Sometimes retreat is the wisest strategy!」")
 
     await ctx.send(embed=embed)
+    embed_cache.invalidate('offers')
     save_data()
 
 @bot.command(name='result', aliases=['endoffer', 'r'])
@@ -1608,54 +2301,33 @@ async def end_offer(ctx, match_id, winning_team: int):
         return
 
     offer_data = active_offers[match_id]
-    offer_data['status'] = 'completed'
-    offer_data['completed_at'] = datetime.now().isoformat()
-    offer_data['winning_team'] = winning_team
-
-    winning_team_key = f'team{winning_team}'
-
-    # Calculate and distribute winnings
-    winners = []
-    losers = []
-    total_distributed = 0
-    total_lost = 0
-
-    for user_id, bet_data in offer_data['bets'].items():
-        if bet_data['team'] == winning_team_key:
-            # Winner - give them their return amount
-            winnings = bet_data['potential_return']
-
-            if user_id in user_data:
-                user_data[user_id]['reiatsu'] += winnings
-                user_data[user_id]['total_winnings'] += (winnings - bet_data['amount'])  # Only count profit
-
-                # Remove from active bets
-                user_data[user_id]['active_bets'] = [
-                    bet for bet in user_data[user_id]['active_bets'] 
-                    if bet['match_id'] != match_id
-                ]
-
-                winners.append({
-                    'name': bet_data['user_name'],
-                    'bet': bet_data['amount'],
-                    'return': winnings,
-                    'profit': winnings - bet_data['amount']
-                })
-                total_distributed += winnings
-        else:
-            # Loser - they already lost their bet money
-            losers.append({
-                'name': bet_data['user_name'],
-                'lost': bet_data['amount']
-            })
-            total_lost += bet_data['amount']
-
-            # Remove from their active bets
-            if user_id in user_data:
-                user_data[user_id]['active_bets'] = [
-                    bet for bet in user_data[user_id]['active_bets'] 
-                    if bet['match_id'] != match_id
-                ]
+    if match_id in settlement.running:
+        await ctx.send("「This offer is already being settled!」")
+        return
+    if offer_data['status'] == 'settling' and offer_data['winning_team'] != winning_team:
+        await ctx.send(f"「Settlement already started with team {offer_data['winning_team']} as the winner; resuming it.」")
+
+    # Big pools are paid out in chunks; show progress instead of going quiet
+    progress_message = None
+    if len(offer_data['bets']) > settlement.chunk_size:
+        progress_message = await ctx.send(f"⏳ Settling {len(offer_data['bets']):,} bets...")
+
+    last_edit = [time.monotonic()]
+
+    async def progress(done, total):
+        # Throttled so message edits don't hit Discord's rate limit
+        if progress_message is not None and time.monotonic() - last_edit[0] >= 2:
+            last_edit[0] = time.monotonic()
+            await progress_message.edit(content=f"⏳ Settling bets: {done:,}/{total:,}")
+
+    # Settling offers drop out of !offers
+    embed_cache.invalidate('offers')
+    summary = await settlement.settle(match_id, winning_team, progress)
+    winning_team = offer_data['winning_team']
+    winners = summary['winners']
+    losers = summary['losers']
+    total_distributed = summary['total_distributed']
+    total_lost = summary['total_lost']
 
     # Create results embed
     embed = discord.Embed(
@@ -1669,7 +2341,7 @@ async def end_offer(ctx, match_id, winning_team: int):
         value=(
             f"**Total Bets:** {offer_data['total_bets_count']}\n"
             f"**Winners:** {len(winners)}\n"
-            f"**Losers:** {len(losers)}\n"
+            f"**Losers:** {losers}\n"
             f"**Profit Rate:** {offer_data['profit_percentage']}%"
         ),
         inline=True
@@ -1700,24 +2372,30 @@ async def end_offer(ctx, match_id, winning_team: int):
 
     embed.set_footer(text="「Victory belongs to those who believe in their power!」")
 
-    # Move to completed offers
-    offer_results[match_id] = offer_data
-    del active_offers[match_id]
-
     await ctx.send(embed=embed)
+    embed_cache.invalidate('offers', 'history')
+    save_data()
+
+async def resume_settlement(match_id):
+    summary = await settlement.settle(match_id)
+    embed_cache.invalidate('offers', 'history')
     save_data()
+    print(f"Resumed settlement of {match_id}: {len(summary['winners'])} winners, "
+          f"{summary['total_distributed']:,} Reiatsu distributed")
 
 @bot.command(name='history', aliases=['results', 'past'])
 async def offer_history(ctx):
     """View completed offer results"""
+    await ctx.send(embed=embed_cache.get('history', build_history_embed))
+
+def build_history_embed():
     if not offer_results:
         embed = discord.Embed(
             title="📚 NO OFFER HISTORY",
             description="No completed offers yet!\n\n「History is written by the victors!」",
             color=0xFF6B6B
         )
-        await ctx.send(embed=embed)
-        return
+        return embed
 
     embed = discord.Embed(
         title="📚 OFFER HISTORY",
@@ -1745,7 +2423,7 @@ async def offer_history(ctx):
         )
 
     embed.set_footer(text="「Learn from the past to conquer the future!」")
-    await ctx.send(embed=embed)
+    return embed
 
 # ===========================================
 # SHOP MANAGEMENT SYSTEM
@@ -1792,6 +2470,7 @@ async def add_shop_item(ctx, item_id, price: int, currency='reiatsu', stock: int
         'created_by': ctx.author.display_name,
         'created_at': datetime.now().isoformat()
     }
+    shop_engine.restock(item_id)
 
     currency_emoji = "💰" if currency == 'reiatsu' else "💎"
 
@@ -1808,6 +2487,7 @@ async def add_shop_item(ctx, item_id, price: int, currency='reiatsu', stock: int
     embed.set_footer(text=f"Created by {ctx.author.display_name}")
 
     await ctx.send(embed=embed)
+    embed_cache.invalidate('shop', 'shopmanage')
     save_data()
 
 @bot.command(name='removeitem', aliases=['deleteitem'])
@@ -1822,6 +2502,7 @@ async def remove_shop_item(ctx, item_id):
 
     item_data = shop_items[item_id]
     del shop_items[item_id]
+    shop_engine.restock(item_id)
 
     embed = discord.Embed(
         title="🗑️ SHOP ITEM REMOVED!",
@@ -1833,6 +2514,7 @@ async def remove_shop_item(ctx, item_id):
     embed.set_footer(text="「Another soul returns to the void...」")
 
     await ctx.send(embed=embed)
+    embed_cache.invalidate('shop', 'shopmanage')
     save_data()
 
 @bot.command(name='edititem', aliases=['modifyitem'])
@@ -1878,6 +2560,8 @@ async def edit_shop_item(ctx, item_id, field, *, new_value):
     item_data[field] = new_value
     item_data['last_edited'] = datetime.now().isoformat()
     item_data['last_edited_by'] = ctx.author.display_name
+    if field == 'stock':
+        shop_engine.restock(item_id)
 
     embed = discord.Embed(
         title="✏️ SHOP ITEM EDITED!",
@@ -1890,6 +2574,7 @@ async def edit_shop_item(ctx, item_id, field, *, new_value):
     embed.set_footer(text=f"Edited by {ctx.author.display_name}")
 
     await ctx.send(embed=embed)
+    embed_cache.invalidate('shop', 'shopmanage')
     save_data()
 
 @bot.command(name='shopmanage', aliases=['manageshop', 'shopinfo'])
@@ -1897,7 +2582,9 @@ async def edit_shop_item(ctx, item_id, field, *, new_value):
 async def shop_management(ctx):
     """Admin command to view shop management info"""
     init_shop()
+    await ctx.send(embed=embed_cache.get('shopmanage', build_shop_management_embed))
 
+def build_shop_management_embed():
     embed = discord.Embed(
         title="🛠️ SHOP MANAGEMENT PANEL",
         description="Admin tools for managing the Soul Society Shop",
@@ -1946,7 +2633,7 @@ async def shop_management(ctx):
         )
 
     embed.set_footer(text="「Control the economy of the Soul Society!」")
-    await ctx.send(embed=embed)
+    return embed
 
 # ===========================================
 # CORE ECONOMY COMMANDS
@@ -2020,9 +2707,51 @@ async def balance(ctx):
     embed.set_footer(text="「I'll use my Stand to protect these riches!」")
     await ctx.send(embed=embed)
 
+def describe_posting(posting, account):
+    """One !transactions / !audit line; amounts signed from ``account``'s side"""
+    emoji = "💰" if posting.currency == 'reiatsu' else "💎"
+    reason = posting.reason.replace('_', ' ').title()
+    if posting.dest == ALL_USERS or posting.source == ALL_USERS:
+        sign = '+' if posting.dest == ALL_USERS else '-'
+        detail = f" ({posting.ref})" if posting.ref else ""
+        return f"<t:{int(posting.ts)}:R> {reason}: {sign}{emoji}{posting.amount:,} across all users{detail}"
+    if account is None:
+        return f"<t:{int(posting.ts)}:R> {reason}: {emoji}{posting.amount:,} `{posting.source}` → `{posting.dest}`"
+    sign = '+' if posting.dest == account else '-'
+    other = posting.source if posting.dest == account else posting.dest
+    counterparty = f" ↔ <@{other}>" if other.isdigit() else ""
+    return f"<t:{int(posting.ts)}:R> {reason}: **{sign}{emoji}{posting.amount:,}**{counterparty}"
+
+@bot.command(name='transactions', aliases=['txns', 'ledger'])
+async def transaction_history(ctx, member: discord.Member = None):
+    """Recent currency movements of a user"""
+    member = member or ctx.author
+    if member != ctx.author and not ctx.author.guild_permissions.administrator:
+        await ctx.send("「Only admins can inspect someone else's transactions!」")
+        return
+
+    account = str(member.id)
+    postings = ledger.history(account, 10)
+
+    embed = discord.Embed(
+        title=f"📒 {member.display_name}'s Transactions",
+        color=0x4169E1
+    )
+    if postings:
+        embed.description = "\n".join(describe_posting(posting, account) for posting in postings)
+    else:
+        embed.description = "No transactions recorded yet!"
+    embed.add_field(
+        name="📊 Net Since Recording Began",
+        value=f"💰 {ledger.balance(account):+,} Reiatsu\n💎 {ledger.balance(account, 'soul_fragments'):+,} Soul Fragments",
+        inline=False
+    )
+    embed.set_footer(text="「Every coin leaves a trace in the Soul Society!」")
+    await ctx.send(embed=embed)
+
 @bot.command(name='daily')
 async def daily_reward(ctx):
-    if economy_frozen:
+    if economy_frozen():
         embed = discord.Embed(
             title="🧊 ECONOMY FROZEN",
             description="All economic activities are currently suspended by the administrators.\n\nPlease wait for the economy to be restored.",
@@ -2034,13 +2763,12 @@ async def daily_reward(ctx):
     init_user(ctx.author.id)
     data = user_data[str(ctx.author.id)]
 
-    now = datetime.now()
-    last_daily = datetime.fromisoformat(data['last_daily']) if data['last_daily'] else None
+    now = time.time()
+    time_left = cooldowns.remaining(data, 'daily', now)
 
-    if last_daily and (now - last_daily).total_seconds() < 86400:  # 24 hours
-        time_left = 86400 - (now - last_daily).total_seconds()
-        hours = int(time_left // 3600)
-        minutes = int((time_left % 3600) // 60)
+    if time_left > 0:  # 24 hours
+        hours = time_left // 3600
+        minutes = (time_left % 3600) // 60
 
         embed = discord.Embed(
             title="⏰ Daily Reward Already Claimed!",
@@ -2051,7 +2779,8 @@ async def daily_reward(ctx):
         return
 
     # Calculate streak
-    if last_daily and (now - last_daily).total_seconds() <= 172800:  # Within 48 hours
+    since_last = cooldowns.since(data, 'daily', now)
+    if since_last is not None and since_last <= STREAK_WINDOW:  # Within 48 hours
         data['daily_streak'] += 1
     else:
         data['daily_streak'] = 1
@@ -2066,9 +2795,11 @@ async def daily_reward(ctx):
     if random.random() < 0.1:  # 10% chance
         soul_fragments = random.randint(1, 5)
         data['soul_fragments'] += soul_fragments
+        ledger.post('daily', MINT, str(ctx.author.id), soul_fragments, 'soul_fragments')
 
     data['reiatsu'] += total_reward
-    data['last_daily'] = now.isoformat()
+    ledger.post('daily', MINT, str(ctx.author.id), total_reward)
+    cooldowns.use(str(ctx.author.id), data, 'daily', now)
     data['exp'] += 10
 
     embed = discord.Embed(
@@ -2089,7 +2820,7 @@ async def daily_reward(ctx):
 
 @bot.command(name='work')
 async def work(ctx):
-    if economy_frozen:
+    if economy_frozen():
         embed = discord.Embed(
             title="🧊 ECONOMY FROZEN",
             description="All economic activities are currently suspended by the administrators.\n\nPlease wait for the economy to be restored.",
@@ -2101,12 +2832,10 @@ async def work(ctx):
     init_user(ctx.author.id)
     data = user_data[str(ctx.author.id)]
 
-    now = datetime.now()
-    last_work = datetime.fromisoformat(data['last_work']) if data['last_work'] else None
+    time_left = cooldowns.remaining(data, 'work')
 
-    if last_work and (now - last_work).total_seconds() < 3600:  # 1 hour cooldown
-        time_left = 3600 - (now - last_work).total_seconds()
-        minutes = int(time_left // 60)
+    if time_left > 0:  # 1 hour cooldown
+        minutes = time_left // 60
 
         embed = discord.Embed(
             title="⏰ Still Recovering from Last Mission!",
@@ -2140,7 +2869,8 @@ async def work(ctx):
     reward = random.randint(min_reward, max_reward)
 
     data['reiatsu'] += reward
-    data['last_work'] = now.isoformat()
+    ledger.post('work', MINT, str(ctx.author.id), reward)
+    cooldowns.use(str(ctx.author.id), data, 'work')
     data['exp'] += 5
 
     embed = discord.Embed(
@@ -2156,7 +2886,7 @@ async def work(ctx):
 
 @bot.command(name='train', aliases=['t'])
 async def train(ctx):
-    if economy_frozen:
+    if economy_frozen():
         embed = discord.Embed(
             title="🧊 ECONOMY FROZEN",
             description="All economic activities are currently suspended by the administrators.\n\nPlease wait for the economy to be restored.",
@@ -2168,12 +2898,10 @@ async def train(ctx):
     init_user(ctx.author.id)
     data = user_data[str(ctx.author.id)]
 
-    now = datetime.now()
-    last_train = datetime.fromisoformat(data['last_train']) if data['last_train'] else None
+    time_left = cooldowns.remaining(data, 'train')
 
-    if last_train and (now - last_train).total_seconds() < 1800:  # 30 min cooldown
-        time_left = 1800 - (now - last_train).total_seconds()
-        minutes = int(time_left // 60)
+    if time_left > 0:  # 30 min cooldown
+        minutes = time_left // 60
 
         embed = discord.Embed(
             title="😤 Still Exhausted from Training!",
@@ -2205,7 +2933,7 @@ async def train(ctx):
             bonus_reward = f"\n🎊 **You've manifested your Stand: {data['stand']}!**"
 
     data['exp'] += exp_gained
-    data['last_train'] = now.isoformat()
+    cooldowns.use(str(ctx.author.id), data, 'train')
 
     embed = discord.Embed(
         title="🏋️ Training Session Complete!",
@@ -2218,6 +2946,40 @@ async def train(ctx):
     check_level_up(ctx.author.id)
     save_data()
 
+@bot.command(name='remind', aliases=['reminders'])
+async def remind(ctx, setting: str = None):
+    """Opt in/out of a DM when !daily or !work comes off cooldown"""
+    init_user(ctx.author.id)
+    data = user_data[str(ctx.author.id)]
+
+    if setting is None:
+        enabled = not data.get('reminders')
+    elif setting.lower() in ('on', 'yes', 'enable'):
+        enabled = True
+    elif setting.lower() in ('off', 'no', 'disable'):
+        enabled = False
+    else:
+        await ctx.send("「Use `!remind on` or `!remind off`!」")
+        return
+
+    cooldowns.set_reminders(str(ctx.author.id), data, enabled)
+
+    embed = discord.Embed(
+        title="⏰ Cooldown Reminders " + ("Enabled" if enabled else "Disabled"),
+        description=(
+            "I'll send you a DM the moment `!daily` or `!work` is ready again!"
+            if enabled else "No more cooldown reminders."
+        ),
+        color=0x00CED1 if enabled else 0x808080
+    )
+    embed.set_footer(text="「A true warrior never misses training!」")
+    await ctx.send(embed=embed)
+    save_data()
+
+async def send_cooldown_reminder(user_id, action):
+    user = bot.get_user(int(user_id)) or await bot.fetch_user(int(user_id))
+    await user.send(f"⏰ 「Your `!{action}` is ready, Soul Reaper!」 (`!remind off` to stop these)")
+
 @bot.command(name='battle', aliases=['fight', 'duel'])
 async def battle(ctx, opponent: discord.Member = None):
     if opponent is None or opponent.bot or opponent == ctx.author:
@@ -2252,48 +3014,57 @@ async def battle(ctx, opponent: discord.Member = None):
         return user == opponent and str(reaction.emoji) in ["⚔️", "❌"] and reaction.message.id == message.id
 
     try:
-        reaction, user = await bot.wait_for('reaction_add', timeout=60.0, check=check)
+        with timings.phase('wait'):
+            reaction, user = await bot.wait_for('reaction_add', timeout=60.0, check=check)
 
         if str(reaction.emoji) == "❌":
             await ctx.send(f"{opponent.mention} declined the battle! 「What a coward!」")
             return
 
-        # Battle mechanics
-        challenger_power = calculate_battle_power(challenger_data)
-        opponent_power = calculate_battle_power(opponent_data)
-
-        # Add some randomness
-        challenger_roll = random.randint(1, 100)
-        opponent_roll = random.randint(1, 100)
-
-        challenger_total = challenger_power + challenger_roll
-        opponent_total = opponent_power + opponent_roll
-
-        # Determine winner
-        if challenger_total > opponent_total:
-            winner = ctx.author
-            loser = opponent
-            winner_data = challenger_data
-            loser_data = opponent_data
-            winner_total = challenger_total
-            loser_total = opponent_total
-        else:
-            winner = opponent
-            loser = ctx.author
-            winner_data = opponent_data
-            loser_data = challenger_data
-            winner_total = opponent_total
-            loser_total = challenger_total
-
-        # Calculate rewards/losses
-        bet_amount = min(winner_data['reiatsu'], loser_data['reiatsu']) // 10  # 10% of lower balance
-        bet_amount = max(bet_amount, min_bet)
-
-        winner_data['reiatsu'] += bet_amount
-        loser_data['reiatsu'] -= bet_amount
-        winner_data['battles_won'] += 1
-        winner_data['exp'] += 25
-        loser_data['exp'] += 10  # Consolation exp
+        # Resolved under both fighters' locks with their current records -
+        # balances may have moved while the challenge was open
+        challenger_id = str(ctx.author.id)
+        opponent_id = str(opponent.id)
+        async with transactions.transaction(challenger_id, opponent_id) as txn:
+            challenger_data = txn.record(challenger_id)
+            opponent_data = txn.record(opponent_id)
+
+            # Battle mechanics
+            challenger_power = calculate_battle_power(challenger_data)
+            opponent_power = calculate_battle_power(opponent_data)
+
+            # Add some randomness
+            challenger_roll = random.randint(1, 100)
+            opponent_roll = random.randint(1, 100)
+
+            challenger_total = challenger_power + challenger_roll
+            opponent_total = opponent_power + opponent_roll
+
+            # Determine winner
+            if challenger_total > opponent_total:
+                winner = ctx.author
+                loser = opponent
+                winner_id, loser_id = challenger_id, opponent_id
+                winner_total = challenger_total
+                loser_total = opponent_total
+            else:
+                winner = opponent
+                loser = ctx.author
+                winner_id, loser_id = opponent_id, challenger_id
+                winner_total = opponent_total
+                loser_total = challenger_total
+
+            # Calculate rewards/losses
+            loser_balance = txn.balance(loser_id, 'reiatsu')
+            bet_amount = min(txn.balance(winner_id, 'reiatsu'), loser_balance) // 10  # 10% of lower balance
+            bet_amount = max(bet_amount, min_bet)
+            # The loser may have spent below the minimum since the challenge
+            bet_amount = min(bet_amount, loser_balance)
+
+            txn.transfer('battle', loser_id, winner_id, bet_amount)
+            txn.add(winner_id, 'battles_won', 1)
+            txn.add(winner_id, 'exp', 25)
+            txn.add(loser_id, 'exp', 10)  # Consolation exp
 
         # Battle result embed
         result_embed = discord.Embed(
@@ -2350,15 +3121,16 @@ def check_level_up(user_id):
 @bot.command(name='shop')
 async def shop(ctx):
     init_shop()
+    await ctx.send(embed=embed_cache.get('shop', build_shop_embed))
 
+def build_shop_embed():
     if not shop_items:
         embed = discord.Embed(
             title="🏪 Soul Society Shop",
             description="The shop is currently empty!\n\n「Even the Soul Society needs time to restock...」",
             color=0xFF6B6B
         )
-        await ctx.send(embed=embed)
-        return
+        return embed
 
     embed = discord.Embed(
         title="🏪 Soul Society Shop",
@@ -2401,16 +3173,103 @@ async def shop(ctx):
         )
 
     embed.set_footer(text="Use !buy <item_id> to purchase | 「Money can't buy everything, but it helps!」")
+    return embed
+
+@bot.command(name='buy', aliases=['purchase'])
+async def buy(ctx, item_id, quantity: int = 1):
+    if economy_frozen():
+        embed = discord.Embed(
+            title="🧊 ECONOMY FROZEN",
+            description="All economic activities are currently suspended by the administrators.\n\nPlease wait for the economy to be restored.",
+            color=0x87CEEB
+        )
+        await ctx.send(embed=embed)
+        return
+
+    init_shop()
+    init_user(ctx.author.id)
+    user_id = str(ctx.author.id)
+
+    try:
+        async with transactions.locks.hold(user_id):
+            shared = partitions.current().shared
+            if shared is None:
+                item, total, owned = shop_engine.buy(user_id, user_data[user_id], item_id, quantity)
+            else:
+                # Nothing changes when the shared store is busy; try again shortly
+                item, total, owned = await shared.retry(
+                    lambda: shop_engine.buy(user_id, user_data[user_id], item_id, quantity))
+    except PurchaseError as error:
+        item = error.item
+        if error.reason == PurchaseError.UNKNOWN:
+            await ctx.send(f"「Item '{item_id}' doesn't exist! Use `!shop` to see what's for sale.」")
+        elif error.reason == PurchaseError.QUANTITY:
+            await ctx.send("「Quantity must be at least 1!」")
+        elif error.reason == PurchaseError.UNAVAILABLE:
+            await ctx.send(f"「{item['name']} is not for sale right now!」")
+        elif error.reason == PurchaseError.SOLD_OUT:
+            if error.detail:
+                await ctx.send(f"「Only {error.detail} {item['name']} left in stock!」")
+            else:
+                await ctx.send(f"「{item['name']} is sold out!」")
+        else:
+            currency = item['currency'].replace('_', ' ').title()
+            await ctx.send(f"「You need {item['price'] * quantity:,} {currency} but only have {error.detail:,}!」")
+        return
+
+    currency_emoji = "💰" if item['currency'] == 'reiatsu' else "💎"
+    embed = discord.Embed(
+        title="🛍️ PURCHASE COMPLETE!",
+        description=f"{ctx.author.mention} bought **{quantity}x {item['name']}**!",
+        color=0x00FF7F
+    )
+    embed.add_field(name="💸 Paid", value=f"{currency_emoji} {total:,} {item['currency'].replace('_', ' ').title()}", inline=True)
+    embed.add_field(name="🎒 Owned", value=f"{owned:,}", inline=True)
+    if limited(item):
+        embed.add_field(name="📦 Stock Left", value=f"{item['stock']:,}", inline=True)
+    embed.set_footer(text="「A wise investment, Soul Reaper!」")
+
+    await ctx.send(embed=embed)
+    save_data()
+
+@bot.command(name='inventory', aliases=['inv', 'items'])
+async def inventory(ctx, member: discord.Member = None):
+    member = member or ctx.author
+    init_shop()
+    init_user(member.id)
+    owned = user_data[str(member.id)]['inventory']
+
+    embed = discord.Embed(
+        title=f"🎒 {member.display_name}'s Inventory",
+        color=0x9932CC
+    )
+    if owned:
+        embed.description = "\n".join(
+            f"• {shop_items[item_id]['name'] if item_id in shop_items else item_id} × {count:,}"
+            for item_id, count in owned.items()
+        )
+    else:
+        embed.description = "Nothing here yet! Use `!shop` to browse items."
+    embed.set_footer(text="「Every item tells the story of a battle!」")
     await ctx.send(embed=embed)
 
 @bot.command(name='leaderboard', aliases=['lb', 'top'])
-async def leaderboard(ctx):
-    # Sort users by reiatsu
-    sorted_users = sorted(user_data.items(), key=lambda x: x[1]['reiatsu'], reverse=True)[:10]
+async def leaderboard(ctx, metric: str = 'reiatsu'):
+    metric = LEADERBOARD_ALIASES.get(metric.lower())
+    if metric is None:
+        options = ", ".join(f"`{name}`" for name in LEADERBOARDS)
+        await ctx.send(f"「Unknown leaderboard! Choose one of: {options}」")
+        return
+    label = LEADERBOARDS[metric][0]
+
+    # Served from the metric's index, no sorting here; a derived index that
+    # needs refilling is rebuilt on the store worker first
+    await user_data.prepare_top(metric, 10)
+    sorted_users = user_data.top(metric, 10)
 
     embed = discord.Embed(
         title="🏆 Soul Society Leaderboard",
-        description="Top 10 Strongest Souls",
+        description=f"Top 10 Strongest Souls by {label}",
         color=0xFFD700
     )
 
@@ -2420,15 +3279,42 @@ async def leaderboard(ctx):
         try:
             user = bot.get_user(int(user_id))
             if user:
+                value = calculate_battle_power(data) if metric == 'battle_power' else data[metric]
                 embed.add_field(
                     name=f"{medals[i]} #{i+1} {user.display_name}",
-                    value=f"Reiatsu: {data['reiatsu']:,}\nRank: {data['rank']}\nLevel: {data['level']}",
+                    value=f"{label}: {value:,}\nRank: {data['rank']}\nLevel: {data['level']}",
                     inline=True
                 )
         except:
             continue
 
-    embed.set_footer(text="「Only the strongest reach the top!」")
+    embed.set_footer(text="「Only the strongest reach the top!」 | !lb <metric>")
+    await ctx.send(embed=embed)
+
+@bot.command(name='rank', aliases=['position'])
+async def rank_command(ctx, member: discord.Member = None):
+    member = member or ctx.author
+    if member == ctx.author:
+        init_user(ctx.author.id)
+
+    result = await user_data.rank(str(member.id), 'reiatsu')
+    if result is None:
+        await ctx.send("「That soul has no spiritual record yet!」")
+        return
+
+    position, total = result
+    data = user_data[str(member.id)]
+    # Share of souls this user is ahead of
+    percentile = 100 * (total - position) / total if total > 1 else 100.0
+
+    embed = discord.Embed(
+        title=f"📈 {member.display_name}'s Standing",
+        description=f"**Position:** #{position:,} of {total:,}\n**Percentile:** {percentile:.1f}%",
+        color=0xFFD700
+    )
+    embed.add_field(name="Reiatsu", value=f"{data['reiatsu']:,}", inline=True)
+    embed.add_field(name="Rank", value=data['rank'], inline=True)
+    embed.set_footer(text=f"「Stronger than {percentile:.1f}% of Soul Society!」")
     await ctx.send(embed=embed)
 
 @bot.command(name='give', aliases=['transfer', 'send'])
@@ -2444,19 +3330,21 @@ async def give_reiatsu(ctx, member: discord.Member, amount: int):
     init_user(ctx.author.id)
     init_user(member.id)
 
-    sender_data = user_data[str(ctx.author.id)]
-    receiver_data = user_data[str(member.id)]
-
-    if sender_data['reiatsu'] < amount:
-        await ctx.send("「You don't have enough Reiatsu!」")
-        return
+    sender_id = str(ctx.author.id)
+    receiver_id = str(member.id)
 
     # Transfer with small fee
     fee = max(1, amount // 20)  # 5% fee
     transfer_amount = amount - fee
 
-    sender_data['reiatsu'] -= amount
-    receiver_data['reiatsu'] += transfer_amount
+    # Both balances change together or not at all
+    try:
+        async with transactions.transaction(sender_id, receiver_id) as txn:
+            txn.transfer('give', sender_id, receiver_id, transfer_amount)
+            txn.transfer('fee', sender_id, FEES, fee)
+    except InsufficientFunds:
+        await ctx.send("「You don't have enough Reiatsu!」")
+        return
 
     embed = discord.Embed(
         title="💸 Reiatsu Transfer Complete!",
@@ -2474,9 +3362,93 @@ async def daily_reset():
     # Reset daily missions, update shop, etc.
     pass
 
+# Full-scan check of the incrementally maintained aggregates; any drift is
+# corrected and reported in !godstats
+@tasks.loop(minutes=AGGREGATE_VERIFY_MINUTES)
+async def verify_aggregates():
+    if verify_aggregates.current_loop == 0:
+        return  # just built from the loaded data
+    for economy in partitions.loaded():
+        if economy.user_data.aggregates is None:
+            continue  # lazy users: figures come from the store, nothing to drift
+        drift = economy.user_data.aggregates.verify()
+        if drift:
+            print(f"Aggregate drift corrected in {economy.key}: {drift}")
+
+# One /metrics scrape: the counters above plus every loaded partition's
+# engine counters, summed so the series don't grow with the guild count
+def render_metrics():
+    out = MetricsWriter()
+    out.add_counter(command_count)
+    out.add_counter(command_errors)
+    out.add_histogram(command_latency)
+    out.add_histogram(phase_latency)
+    out.gauge('soulbot_gateway_latency_seconds', "Discord gateway heartbeat latency",
+              bot.latency if bot.is_ready() else float('nan'))
+    out.gauge('soulbot_event_loop_lag_seconds_last', "Most recent event loop lag sample", loop_lag.last)
+    out.gauge('soulbot_event_loop_lag_seconds_max', "Largest event loop lag seen", loop_lag.max)
+    out.add_histogram(loop_lag.histogram)
+
+    loaded = partitions.loaded()
+    totals = dict.fromkeys((
+        'flushes', 'failed_flushes', 'flush_seconds', 'save_requests', 'bytes_written',
+        'users', 'resident_users', 'user_cache_hits', 'user_cache_misses', 'embed_cache_hits',
+        'embed_cache_builds', 'shared_cache_hits', 'shared_cache_misses', 'active_offers',
+        'offer_results', 'ledger_postings'
+    ), 0)
+    max_flush_ms = 0.0
+    for economy in loaded:
+        saves = economy.persistence.stats()
+        totals['flushes'] += saves['flushes']
+        totals['failed_flushes'] += saves['failed_flushes']
+        totals['flush_seconds'] += economy.persistence.total_flush_ms / 1000
+        totals['save_requests'] += saves['save_requests']
+        totals['bytes_written'] += saves['bytes_written']
+        max_flush_ms = max(max_flush_ms, saves['max_flush_ms'])
+        users = economy.user_data.stats()
+        totals['users'] += users['users']
+        totals['resident_users'] += users['resident']
+        totals['user_cache_hits'] += users['cache_hits']
+        totals['user_cache_misses'] += users['cache_misses']
+        embeds = economy.embed_cache.stats()
+        totals['embed_cache_hits'] += embeds['hits']
+        totals['embed_cache_builds'] += embeds['builds']
+        totals['active_offers'] += len(economy.active_offers)
+        totals['offer_results'] += len(economy.offer_results)
+        totals['ledger_postings'] += economy.ledger.seq
+        if economy.shared is not None:
+            shared = economy.shared.stats()
+            totals['shared_cache_hits'] += shared['cache_hits']
+            totals['shared_cache_misses'] += shared['cache_misses']
+
+    out.gauge('soulbot_partitions', "Economy partitions loaded in this process", len(loaded))
+    out.gauge('soulbot_users', "Users in the loaded economies", totals['users'])
+    out.gauge('soulbot_resident_users', "Users held in memory", totals['resident_users'])
+    out.gauge('soulbot_active_offers', "Betting offers not yet settled", totals['active_offers'])
+    out.gauge('soulbot_offer_results', "Settled betting offers kept as history", totals['offer_results'])
+    out.counter('soulbot_ledger_postings_total', "Ledger postings recorded", totals['ledger_postings'])
+    out.counter('soulbot_save_requests_total', "save_data() calls", totals['save_requests'])
+    out.counter('soulbot_flushes_total', "Persistence flushes written", totals['flushes'])
+    out.counter('soulbot_failed_flushes_total', "Persistence flushes that failed", totals['failed_flushes'])
+    out.counter('soulbot_flush_seconds_total', "Time spent in persistence flushes", float(totals['flush_seconds']))
+    out.gauge('soulbot_flush_seconds_max', "Slowest persistence flush", max_flush_ms / 1000)
+    out.counter('soulbot_flush_bytes_total', "Bytes (rows for SQLite) written by flushes", totals['bytes_written'])
+    out.counter('soulbot_cache_hits_total', "Cache hits", {
+        ('users',): totals['user_cache_hits'],
+        ('embeds',): totals['embed_cache_hits'],
+        ('shared_balances',): totals['shared_cache_hits'],
+    }, labels=('cache',))
+    out.counter('soulbot_cache_misses_total', "Cache misses (embed cache: rebuilds)", {
+        ('users',): totals['user_cache_misses'],
+        ('embeds',): totals['embed_cache_builds'],
+        ('shared_balances',): totals['shared_cache_misses'],
+    }, labels=('cache',))
+    return out.render()
+
 # Error handling
 @bot.event
 async def on_command_error(ctx, error):
+    command_errors.inc(type(error).__name__)
     if isinstance(error, commands.CommandOnCooldown):
         embed = discord.Embed(
             title="⏰ Command on Cooldown",
@@ -2488,9 +3460,17 @@ async def on_command_error(ctx, error):
         await ctx.send("「You're missing required arguments! Check the command usage.」")
     elif isinstance(error, commands.MissingPermissions):
         await ctx.send("「You don't have permission to use this command!」")
+    elif isinstance(error, commands.NoPrivateMessage):
+        await ctx.send("「Each server has its own Soul Society - use this command in a server!」")
+    elif isinstance(getattr(error, 'original', None), StoreBusy):
+        # A spend written straight to a record while another bot process held
+        # the shared balances; it was undone
+        await ctx.send("「The Soul Society's vault is busy - try again in a moment!」")
     else:
         print(f"Error: {error}")
 
 # Run the bot
 if __name__ == "__main__":
     bot.run(os.getenv('DISCORD_BOT_TOKEN'))
+    for economy in partitions.loaded():
+        economy.persistence.flush_now(force_snapshot=True)
@@ -0,0 +1,32 @@
+"""Balance columns refuse to wrap around int64."""
+import pytest
+
+from economy.columns import INT64_MAX, BalanceColumns, add_op, scale_op
+
+
+def columns_with(*values):
+    columns = BalanceColumns(capacity=4)
+    for value in values:
+        columns.set('reiatsu', columns.allocate(), value)
+    return columns
+
+
+def test_add_past_int64_changes_nothing():
+    columns = columns_with(5, INT64_MAX - 10)
+    with pytest.raises(OverflowError):
+        columns.apply(add_op('reiatsu', 100))
+    assert columns.bounds('reiatsu') == (5, INT64_MAX - 10)
+
+
+def test_scale_past_int64_changes_nothing():
+    columns = columns_with(5, INT64_MAX // 2 + 1)
+    with pytest.raises(OverflowError):
+        columns.apply(scale_op('reiatsu', 2))
+    assert columns.total('reiatsu') == 5 + INT64_MAX // 2 + 1
+
+
+def test_set_out_of_range():
+    columns = columns_with(0)
+    with pytest.raises(OverflowError):
+        columns.set('reiatsu', 0, INT64_MAX + 1)
+    assert columns.get('reiatsu', 0) == 0
@@ -0,0 +1,39 @@
+"""Ledger segments: startup resumes from the checkpoint."""
+from economy.ledger import MINT, Ledger
+
+
+def write(ledger, batches, per_batch=10):
+    for _ in range(batches):
+        for i in range(per_batch):
+            ledger.post('give', str(i % 3), str((i + 1) % 3), i + 1)
+        ledger.post('work', MINT, '0', 5)
+        ledger.commit(ledger.prepare())
+
+
+def test_load_indexes_only_after_checkpoint(tmp_path):
+    path = str(tmp_path / 'ledger.jsonl')
+    ledger = Ledger(path, segment_bytes=2000, recent=0)
+    write(ledger, 25)
+    assert ledger.checkpoints > 0
+
+    reloaded = Ledger(path, segment_bytes=2000, recent=0)
+    reloaded.load()
+    assert reloaded.seq == ledger.seq
+    assert reloaded.net == ledger.net
+    assert reloaded.base > 0
+    assert list(reloaded.select()) == list(range(reloaded.base + 1, reloaded.seq + 1))
+    assert [reloaded.get(seq) for seq in reloaded.select()] == [ledger.get(seq) for seq in reloaded.select()]
+
+
+def test_retried_commit_writes_once(tmp_path):
+    path = str(tmp_path / 'ledger.jsonl')
+    ledger = Ledger(path)
+    ledger.post('work', MINT, '0', 5)
+    job = ledger.prepare()
+    ledger.commit(job)
+    ledger.commit(job)
+
+    reloaded = Ledger(path)
+    reloaded.load()
+    assert reloaded.seq == 1
+    assert reloaded.balance('0') == 5
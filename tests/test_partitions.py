@@ -0,0 +1,37 @@
+"""Guild partitions load once, in a thread, and commands wait for the load."""
+import asyncio
+import threading
+
+import pytest
+
+from economy.partitions import Partition, PartitionRegistry
+
+
+def test_commands_wait_for_the_guild_load():
+    release = threading.Event()
+    loads, started = [], []
+
+    def load(key):
+        loads.append(threading.current_thread())
+        release.wait(5)
+        partition = Partition(key)
+        partition.user_data = {}
+        return partition
+
+    registry = PartitionRegistry(load, per_guild=True, start=started.append)
+
+    async def scenario():
+        gateway = asyncio.ensure_future(registry.ensure(1))
+        command = asyncio.ensure_future(registry.bind(1))
+        await asyncio.sleep(0.05)
+        assert registry.stats()['loading'] == 1
+        with pytest.raises(LookupError):
+            registry.get(1)  # a second load would race the first
+        release.set()
+        return await gateway, await command
+
+    first, second = asyncio.run(scenario())
+    assert first is second is registry.partitions['1']
+    assert started == [first]
+    assert len(loads) == 1 and loads[0] is not threading.main_thread()
+    assert registry.stats()['loading'] == 0
@@ -0,0 +1,35 @@
+"""Several processes on one SharedStore: money and limited stock are conserved."""
+import pytest
+
+from benchmarks.bench_shared import STOCK, simulate
+from economy.shared_store import SharedStore, SoldOut
+from economy.transactions import InsufficientFunds
+
+
+@pytest.mark.parametrize('processes', [2, 4])
+def test_processes_conserve_money_and_stock(processes):
+    outcome = simulate(processes, users=200, ops=800)
+
+    assert outcome['total'] == outcome['expected']
+    assert outcome['lowest'] >= 0
+    assert outcome['sold'] <= STOCK
+    assert outcome['left'] == STOCK - outcome['sold']
+
+
+def test_rejected_purchase_changes_nothing(tmp_path):
+    store = SharedStore(str(tmp_path / 'shared.db'))
+    try:
+        store.seed({'1': {'reiatsu': 100, 'soul_fragments': 0}})
+        assert store.purchase('1', 'reiatsu', 30, 'shard', 2, stock=3) == (70, 1)
+
+        with pytest.raises(SoldOut):
+            store.purchase('1', 'reiatsu', 30, 'shard', 2, stock=3)
+        with pytest.raises(InsufficientFunds):
+            store.purchase('1', 'reiatsu', 500, 'shard', 1, stock=3)
+
+        assert store.balances('1')['reiatsu'] == 70
+        assert store.stock_levels() == {'shard': 1}
+        # Items the store doesn't track are unlimited
+        assert store.purchase('1', 'reiatsu', 10, 'robes', 5) == (60, None)
+    finally:
+        store.close()
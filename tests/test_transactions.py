@@ -0,0 +1,22 @@
+"""TransactionManager.commit() re-checks its precondition before applying."""
+import asyncio
+
+from economy.ledger import escrow
+from economy.transactions import TransactionManager
+from economy.users import UserRepository
+
+
+def test_failed_check_commits_nothing():
+    users = UserRepository({'1': {'reiatsu': 500}})
+    manager = TransactionManager(users)
+    offer = {'status': 'open'}
+
+    async def bet():
+        async with manager.transaction('1') as txn:
+            txn.transfer('bet', '1', escrow('m1'), 300, ref='m1')
+            offer['status'] = 'locked'  # closed while the command awaited
+            return await manager.commit(txn, check=lambda: offer['status'] == 'open')
+
+    assert asyncio.run(bet()) is False
+    assert users['1']['reiatsu'] == 500
+    assert manager.commits == 0
@@ -0,0 +1,50 @@
+"""Lazy user cache: prefetch() reads misses on the worker, not the loop."""
+import asyncio
+
+from economy.persistence import PersistenceEngine
+from economy.sqlite_store import SqliteBackend, connect, state_ops
+from economy.users import UserRepository
+
+
+def lazy_repository(path, users):
+    conn = connect(path)
+    conn.execute('BEGIN')
+    for sql, params in state_ops({'user_data': users}):
+        conn.execute(sql, params)
+    conn.execute('COMMIT')
+    conn.close()
+    backend = SqliteBackend(path, lazy_users=True)
+    engine = PersistenceEngine(backend, lambda: {})
+    return UserRepository(engine.load()['user_data'], store=backend, engine=engine, capacity=10)
+
+
+def test_prefetch_serves_hits_and_absent_users(tmp_path):
+    users = lazy_repository(str(tmp_path / 'economy.db'), {'1': {'reiatsu': 10}, '2': {'reiatsu': 20}})
+
+    asyncio.run(users.prefetch('1', '2', '3'))
+    assert users.resident() == 2
+    assert users['2']['reiatsu'] == 20
+    assert '3' not in users
+    assert users.loop_misses == 0
+
+    users['3'] = {'reiatsu': 30}  # created here: no longer absent
+    assert users['3']['reiatsu'] == 30
+
+
+def test_prepare_top_rebuilds_derived_leaders_on_the_worker(tmp_path):
+    stored = {str(i): {'reiatsu': i} for i in range(50)}
+    users = lazy_repository(str(tmp_path / 'economy.db'), stored)
+    users.add_index('power', lambda record: record['reiatsu'] * 2, fields=('reiatsu',), size=5)
+    index = users.metrics['power'].index
+
+    async def leaders():
+        await asyncio.gather(users.prepare_top('power', 3), users.prepare_top('power', 3))
+        return [key for key, _ in users.top('power', 3)]
+
+    assert asyncio.run(leaders()) == ['49', '48', '47']
+    assert index.rebuilds == 1
+    assert users.loop_misses == 0
+
+    users['7'] = {'reiatsu': 1000}
+    assert asyncio.run(leaders()) == ['7', '49', '48']
+    assert index.rebuilds == 1